@@ -1,5 +1,6 @@
 import os
 import sys
+from optparse import OptionParser
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
@@ -47,11 +48,50 @@ CALLGRAPH_DLG_CONTROLS = "\n Zoom In : Ctrl+Mouse Wheel or Ctrl++\n" \
                          "\n Center Image : Space\n"
 
 
+DEFAULT_FLAMEGRAPH_DLG_WIDTH  = 800
+DEFAULT_FLAMEGRAPH_DLG_HEIGHT = 480
+
+DEFAULT_TRENDCHART_DLG_WIDTH  = 640
+DEFAULT_TRENDCHART_DLG_HEIGHT = 320
+FLAMEGRAPH_FRAME_HEIGHT       = 18
+
+FLAMEGRAPH_DLG_CONTROLS = "Left click : zoom into a frame,  Right click : zoom out"
+
+
 INLINETIME_LABEL = '(Inline Time)'
 
+ALL_THREADS_LABEL = '(All Threads)'
+
 
 DEFAULT_REMOTE_HOST = '127.0.0.1'
 DEFAULT_REMOTE_PORT = '18812'
+DEFAULT_REMOTE_REFRESH_INTERVAL = 1000   # in milliseconds
+
+DEFAULT_HOTPATH_COUNT = 20
+DEFAULT_HOTPATH_MIN_FRACTION = 1e-4  # paths lighter than this share are not followed
+
+# (label, top, min_pct) of the load pruning choices, see vProfile.prune_vstats
+LOAD_PRUNINGS = (
+    ('None', None, None),
+    ('Top 1000 by cumtime', 1000, None),
+    ('Top 10000 by cumtime', 10000, None),
+    ('Top 100000 by cumtime', 100000, None),
+    ('Above 0.001% of cumtime', None, 0.001),
+    ('Above 0.01% of cumtime', None, 0.01),
+    ('Above 0.1% of cumtime', None, 0.1),
+)
+
+EXPR_FILTER_TOOLTIP = ('e.g. cumtime > 0.5 and file ~ "db/" and ncall > 1000, '
+                       'see vstatsfilter.py')
+
+RECENT_FILES_KEY   = 'recentFiles'
+RECENT_FILES_COUNT = 8
+
+DEFAULT_GROUP_LEVEL = 'package'
+DEFAULT_GROUP_DEPTH = 1
+
+GROUP_SORT_ROLE = Qt.UserRole
+GROUP_FUNC_ROLE = Qt.UserRole + 1   # index into the member list of a model
 
 
 def createStatsTable(summary, entries):
@@ -82,6 +122,175 @@ def createStatsTable(summary, entries):
     return stats_header, stats_table
 
 
+def createMemoryStatsTable(summary, entries, peaks):
+    # like createStatsTable, for memory stats, see vMemoryProfile
+    from vProfile import simple_code_format
+    stats_header = ['index',   # not shown in views
+                    'func', 'file:ln', 'nalloc', 'bytes', 'percall', 'cumbytes', 'percall', 'peak', 'pct (%)']
+    stats_table = []
+    index = 0
+    for entry in entries:
+        inline_perall, total_perall = '-', '-'
+        if entry.callcount > 0:
+            inline_perall = "%d" % (entry.inlinetime / entry.callcount)
+            total_perall  = "%d" % (entry.totaltime / entry.callcount)
+
+        name, where = simple_code_format(entry.code)
+        rowdata = list((index,
+                        name,
+                        where,
+                        entry.callcount,
+                        "%d" % entry.inlinetime,
+                        inline_perall,
+                        "%d" % entry.totaltime,
+                        total_perall,
+                        "%d" % peaks.get(str(entry.code), 0),
+                        "%6.2f" % (100.0 * entry.totaltime / summary),
+                        ))
+        stats_table.append(rowdata)
+        index += 1
+    return stats_header, stats_table
+
+
+def createHotPathTable(summary, paths, vstats):
+    from vProfile import simple_code_format
+    hotpath_header = ['index',   # index into paths, not shown in views
+                      'leaf', 'file:ln', 'depth', 'path', 'time', 'pct (%)']
+    hotpath_table = []
+    for index, (time, funcs) in enumerate(paths):
+        name, where = simple_code_format(vstats[funcs[-1]].code)
+        path = ' > '.join(simple_code_format(vstats[func].code)[0] for func in funcs)
+        hotpath_table.append([index,
+                              name,
+                              where,
+                              len(funcs),
+                              path,
+                              "%.3f" % time,
+                              "%6.2f" % (100.0 * time / summary if summary else 0.0),
+                              ])
+    return hotpath_header, hotpath_table
+
+
+def createGroupModel(summary, groups, members, vstats):
+    # a tree of groups and their functions, see vstatsgroups; returns the
+    # model and the list of functions indexed by GROUP_FUNC_ROLE of items
+    from vProfile import simple_code_format
+    model = QStandardItemModel()
+    model.setHorizontalHeaderLabels(['group / func', 'file:ln', 'ncall',
+                                     'tottime', 'cumtime', 'pct (%)'])
+    model.setSortRole(GROUP_SORT_ROLE)
+
+    def __row(name, where, entry, index):
+        pct = 100.0 * entry.totaltime / summary if summary else 0.0
+        items = []
+        for text, key in ((name, name), (where, where),
+                          (str(entry.callcount), entry.callcount),
+                          ("%.3f" % entry.inlinetime, entry.inlinetime),
+                          ("%.3f" % entry.totaltime, entry.totaltime),
+                          ("%6.2f" % pct, pct)):
+            item = QStandardItem(text)
+            item.setEditable(False)
+            item.setData(QVariant(key), GROUP_SORT_ROLE)
+            items.append(item)
+        items[0].setData(QVariant(index), GROUP_FUNC_ROLE)
+        return items
+
+    funcs = []
+    for group, entry in groups.iteritems():
+        where = '%d funcs' % len(members[group])
+        row = __row(group, where, entry, -1)
+        for func in members[group]:
+            name, where = simple_code_format(vstats[func].code)
+            row[0].appendRow(__row(name, where, vstats[func], len(funcs)))
+            funcs.append(func)
+        model.appendRow(row)
+    return model, funcs
+
+
+def createDiffTable(diff):
+    from vProfile import simple_code_format
+    diff_header = ['index',   # index into diff, not shown in views
+                   'func', 'file:ln',
+                   'ncall A', 'ncall B', 'B/A', 'ncall +/-',
+                   'tottime A', 'tottime B', 'B/A', 'tottime +/-',
+                   'cumtime A', 'cumtime B', 'B/A',
+                   'cumtime +/-']   # sort by regression size by default
+    diff_table = []
+    index = 0
+    for _, _, entry_a, entry_b in diff:
+        entry = entry_b if entry_b is not None else entry_a
+        ncall_a, tottime_a, cumtime_a = 0, 0.0, 0.0
+        if entry_a is not None:
+            ncall_a, tottime_a, cumtime_a = entry_a.callcount, entry_a.inlinetime, entry_a.totaltime
+        ncall_b, tottime_b, cumtime_b = 0, 0.0, 0.0
+        if entry_b is not None:
+            ncall_b, tottime_b, cumtime_b = entry_b.callcount, entry_b.inlinetime, entry_b.totaltime
+
+        name, where = simple_code_format(entry.code)
+        rowdata = list((index,
+                        name,
+                        where,
+                        ncall_a,
+                        ncall_b,
+                        getRatio(float(ncall_a), ncall_b),
+                        ncall_b - ncall_a,
+                        "%.3f" % tottime_a,
+                        "%.3f" % tottime_b,
+                        getRatio(tottime_a, tottime_b),
+                        "%+.3f" % (tottime_b - tottime_a),
+                        "%.3f" % cumtime_a,
+                        "%.3f" % cumtime_b,
+                        getRatio(cumtime_a, cumtime_b),
+                        "%+.3f" % (cumtime_b - cumtime_a),
+                        ))
+        diff_table.append(rowdata)
+        index += 1
+    return diff_header, diff_table
+
+
+def createSourceTable(code, line_stats):
+    # rows of the lines of a function, annotated with their line stats
+    source_header = ['index',   # not shown in views
+                     'line', 'hits', 'time', 'percall', 'pct (%)', 'source']
+    if code is None:
+        return source_header, []
+    import linecache, inspect
+    lines = linecache.getlines(code.co_filename)
+    first = code.co_firstlineno
+    if not lines or not 0 < first <= len(lines):
+        return source_header, []
+
+    hits, times = [], []
+    if line_stats:
+        _, first, hits, times = line_stats
+    try:
+        count = len(inspect.getblock(lines[first - 1:]))
+    except (IndentationError, SyntaxError, inspect.EndOfBlock):
+        count = len(hits) or 1
+    count = max(count, len(hits))
+    total = sum(times) or 1.0
+
+    source_table = []
+    for index in xrange(count):
+        lineno = first + index
+        if lineno > len(lines):
+            break
+        rowdata = [index, lineno, '', '', '', '', lines[lineno - 1].rstrip()]
+        if index < len(hits) and hits[index]:
+            rowdata[2:6] = [hits[index],
+                            "%.6f" % times[index],
+                            "%.6f" % (times[index] / hits[index]),
+                            "%6.2f" % (100.0 * times[index] / total)]
+        source_table.append(rowdata)
+    return source_header, source_table
+
+
+def getRatio(a, b):
+    if a <= 0.0:
+        return '-'
+    return "%.2f" % (b / a)
+
+
 def getCodeLabel(code):
     from vProfile import simple_code_format
     return '%s [%s]' % simple_code_format(code)
@@ -95,20 +304,85 @@ def validateIPAddress(ip):
     return len(match) == 1
 
 
-def loadStats(datafile):
-    load_methods = [loadPstats, loadVstats]
+_dot_executable = [None]    # [path] once found, see findDot()
+
+
+def findDot():
+    # path of the Graphviz dot executable, looked up on first use, and
+    # again while not found, e.g. until Graphviz is installed
+    if _dot_executable[0] is None:
+        from distutils.spawn import find_executable
+        _dot_executable[0] = find_executable('dot')
+    return _dot_executable[0]
+
+
+def loadStats(datafile, top=None, min_pct=None):
+    if not os.path.isfile(datafile):
+        return None
+    # stats converted before are loaded from the cache, see vstatscache
+    import vstatscache
+    variant = cacheVariant(top, min_pct)
+    ret = vstatscache.load_cached(datafile, variant)
+    if ret:
+        return ret
+    ret = convertStats(datafile, top, min_pct)
+    if ret:
+        # saved in the background, the window shows the stats meanwhile
+        vstatscache.store_cached_async(datafile, ret, variant)
+    return ret
+
+
+def cacheVariant(top=None, min_pct=None):
+    # the vstatscache variant of the stats loaded with these prunings
+    return 'top=%s,min_pct=%s' % (top, min_pct)
+
+
+def convertStats(datafile, top=None, min_pct=None):
+    # pstats are pruned while being converted, other stats once loaded
+    ret = loadPstats(datafile, top, min_pct)
+    if ret:
+        return ret
+    load_methods = [loadVstats, loadCallgrind, loadStacks]
     for method in load_methods:
         ret = method(datafile)
         if ret:
+            if top is not None or min_pct is not None:
+                ret = pruneStats(ret, top, min_pct)
             return ret
     return None
 
 
-def loadPstats(datafile):
+def pruneStats(vstats, top, min_pct):
+    import vProfile
+    if vProfile.is_memory_vstats(vstats):
+        return {vProfile.MEMORY_KEY: vProfile.prune_vstats(vstats[vProfile.MEMORY_KEY], top, min_pct),
+                vProfile.PEAKS_KEY: vstats.get(vProfile.PEAKS_KEY, {})}
+    if vProfile.is_thread_vstats(vstats):
+        return {vProfile.THREADS_KEY: dict((label, vProfile.prune_vstats(thread_vstats, top, min_pct))
+                                           for label, thread_vstats
+                                           in vstats[vProfile.THREADS_KEY].iteritems())}
+    return vProfile.prune_vstats(vstats, top, min_pct)
+
+
+def loadLineStats(datafile):
+    import vLineProfile
+    filename = vLineProfile.line_stats_file(datafile)
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        return vLineProfile.load_line_stats(filename)
+    except:
+        print 'Exception Occured in loadLineStats!'
+        return {}
+
+
+def loadPstats(datafile, top=None, min_pct=None):
+    # converted in this process: a pool would fork the threads of Qt, see
+    # vstatsmerge.convert_pstats for the command line
     import vProfile
     try:
         pstats = vProfile.load_pstats(datafile)
-        return vProfile.pstats2vstats(pstats)
+        return vProfile.pstats2vstats(pstats, top, min_pct)
     except:
         print 'Exception Occured in loadPStats!'
         return None
@@ -123,6 +397,81 @@ def loadVstats(datafile):
         return None
 
 
+def loadCallgrind(datafile):
+    import callgrind2vstats
+    try:
+        if not callgrind2vstats.is_callgrind_file(datafile):
+            return None
+        return callgrind2vstats.load_callgrind(datafile)
+    except:
+        print 'Exception Occured in loadCallgrind!'
+        return None
+
+
+def loadStacks(datafile):
+    import stacks2vstats
+    try:
+        if not stacks2vstats.sniff_format(datafile):
+            return None
+        return stacks2vstats.load_stacks(datafile)
+    except:
+        print 'Exception Occured in loadStacks!'
+        return None
+
+
+def recentFiles():
+    # absolute paths of the recently opened stats files, the latest first
+    settings = QSettings(APPNAME, APPNAME)
+    return [str(filename) for filename in
+            settings.value(RECENT_FILES_KEY, QVariant([])).toStringList()]
+
+
+def addRecentFile(datafile):
+    datafile = os.path.abspath(datafile)
+    files = [datafile] + [filename for filename in recentFiles() if filename != datafile]
+    settings = QSettings(APPNAME, APPNAME)
+    settings.setValue(RECENT_FILES_KEY, QVariant(files[:RECENT_FILES_COUNT]))
+
+
+class StatsPreloader:
+    """Loads stats in a background thread, e.g. while the window is built
+
+    The stats are also saved in the cache by loadStats(), so a preload that
+    is never used still makes the next load of the file fast. With
+    'skip_cached', stats already in the cache are left to be loaded from
+    there when the file is opened.
+    """
+
+    def __init__(self, datafile, top=None, min_pct=None, skip_cached=False):
+        import threading
+        self.datafile = os.path.abspath(datafile)
+        self.top, self.min_pct = top, min_pct
+        self.skip_cached = skip_cached
+        self._stats = None
+        self._thread = threading.Thread(target=self._run, name='StatsPreloader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            if self.skip_cached:
+                import vstatscache
+                if vstatscache.is_cached(self.datafile, cacheVariant(self.top, self.min_pct)):
+                    return
+            self._stats = loadStats(self.datafile, self.top, self.min_pct)
+        except:
+            print 'Exception Occured in StatsPreloader!'
+
+    def matches(self, datafile, top, min_pct):
+        return (os.path.abspath(datafile), top, min_pct) == \
+            (self.datafile, self.top, self.min_pct)
+
+    def stats(self):
+        # waits for the load to finish
+        self._thread.join()
+        return self._stats
+
+
 class MyWindow(QMainWindow):
     def __init__(self, *args):
         QWidget.__init__(self, *args)
@@ -136,14 +485,20 @@ class MyWindow(QMainWindow):
         
         self.initMenuBar()
 
-        self._piechart_dialog = PieChartDialog('Callees\' Pie Chart', self)
+        # dialogs are made when first shown, see piechartDialog() etc.
+        self._piechart_dialog = None
+        self._flamegraph_dialog = None
+        self._trendchart_dialog = None
+        self._store = None  # see vstatsstore
 
         # settings for callgraph dialog
         self._thresholds = ('1', '0.1', '0.01', '0.001', '0.0001', '0')
         self._threshold_index = 2   # default threshold_index
         self._default_threshold = self._thresholds[self._threshold_index]
 
-        self._callgraph_window = ImageWindow('Callgraph', self)
+        self._pruning_index = 0     # index into LOAD_PRUNINGS
+
+        self._callgraph_window = None
 
         self._filtfunc_label = QLabel('Func Filter:')
         self._funcfilter_lineedit = QLineEdit()
@@ -151,16 +506,57 @@ class MyWindow(QMainWindow):
         self._filtfile_label = QLabel('File Filter:')
         self._filefilter_lineedit = QLineEdit()
         self._filefilter_lineedit.textChanged.connect(self.onStatsFilter)
+        self._filtexpr_label = QLabel('Expr Filter:')
+        self._exprfilter_lineedit = QLineEdit()
+        self._exprfilter_lineedit.setToolTip(EXPR_FILTER_TOOLTIP)
+        self._exprfilter_lineedit.textChanged.connect(self.onStatsFilter)
+        self._expr_filter = None    # the last compiled filter, see vstatsfilter
+        self._thread_label = QLabel('Thread:')
+        self._thread_combobox = QComboBox()
+        self._thread_combobox.currentIndexChanged.connect(self.onThreadSelected)
 
         self._stats_tableview = MyTableView()
 
         stats_tabwidget = self.createStatsTabWidget('Stats')
+        self._stats_tabwidget = stats_tabwidget
+
+        self._diff_tableview = MyTableView()
+        stats_tabwidget.addTab(self.createDiffWidget(), 'Diff')
+
+        self._hotpath_tableview = MyTableView()
+        self._hotpath_spinbox = QSpinBox()
+        self._hotpath_spinbox.setRange(1, 1000)
+        self._hotpath_spinbox.setValue(DEFAULT_HOTPATH_COUNT)
+        self._hotpath_checkbox = QCheckBox('From Selected')
+        self._hotpath_widget = self.createHotPathWidget()
+        stats_tabwidget.addTab(self._hotpath_widget, 'Hot Paths')
+        self._hotpaths = []
+        self._hotpaths_stale = True     # found when the tab is shown, see updateStatsTab()
+
+        self._group_treeview = QTreeView()
+        self._group_treeview.setFont(DEFAULT_FONT)
+        self._group_treeview.setSortingEnabled(True)
+        self._group_treeview.setUniformRowHeights(True)
+        self._group_combobox = QComboBox()
+        # the other levels are added with the first groups, see updateGroups()
+        self._group_combobox.addItem(DEFAULT_GROUP_LEVEL)
+        self._group_spinbox = QSpinBox()
+        self._group_spinbox.setRange(1, 16)
+        self._group_spinbox.setValue(DEFAULT_GROUP_DEPTH)
+        self._group_widget = self.createGroupWidget()
+        stats_tabwidget.addTab(self._group_widget, 'Modules')
+        self._group_funcs = []
+        self._groups_stale = True       # rolled up when the tab is shown
+        stats_tabwidget.currentChanged.connect(self.updateStatsTab)
 
         self._callers_tableview = MyTableView()
         self._callees_tableview = MyTableView()
 
         calls_tabwidget = self.createCallsTabWidget('Callees', 'Callers')
 
+        self._source_tableview = MyTableView()
+        calls_tabwidget.addTab(self.createSourceWidget(), 'Source')
+
         grid_layout = QGridLayout()
         grid_layout.addWidget(stats_tabwidget, 0, 0, 3, 5)
         grid_layout.addWidget(calls_tabwidget,  3, 0, 2, 5)
@@ -170,9 +566,22 @@ class MyWindow(QMainWindow):
         self.setCentralWidget(widget)
 
         self._vstats = {}
+        self._thread_vstats = {}  # map: thread label -> vstats
+        self._line_stats = {}     # see vLineProfile
+        self._peaks = None        # map: func -> peak bytes, for memory stats
+        self._all_vstats = self._vstats
+        self.initThreadSelector()
         self.initVstatsRelatedAttributes()
 
+        self.clearDiff()
+
+        self._remote_client = None
+        self._remote_address = ''
+        self._remote_timer = QTimer(self)
+        self._remote_timer.timeout.connect(self.onRemoteTimer)
+
         self._pstats_file = ''
+        self._preloader = None  # see StatsPreloader
         self.loadStats(self._pstats_file)
         self.initTableViews()
 
@@ -182,11 +591,32 @@ class MyWindow(QMainWindow):
         fileMenu = menubar.addMenu(self.tr('&File'))
         fileMenu.addAction(QAction('Open...', self,
                                    shortcut='Ctrl+O', triggered=self.showFileDialog))
+        self._recent_menu = fileMenu.addMenu('Open Recent')
+        self._recent_menu.aboutToShow.connect(self.updateRecentMenu)
+        fileMenu.addAction(QAction('Merge...', self,
+                                   shortcut='Ctrl+M', triggered=self.showMergeDialog))
+        fileMenu.addAction(QAction('Compare With...', self,
+                                   shortcut='Ctrl+D', triggered=self.showCompareDialog))
         fileMenu.addAction(QAction('Save As...', self,
                                    shortcut='Ctrl+S', triggered=self.saveStats))
+        fileMenu.addAction(QAction('Export Callgrind...', self,
+                                   triggered=self.exportCallgrind))
+        fileMenu.addAction(QAction('Export Speedscope...', self,
+                                   triggered=self.exportSpeedscope))
+        fileMenu.addAction(QAction('Export Chrome Trace...', self,
+                                   triggered=self.exportChromeTrace))
+        fileMenu.addAction(QAction('Open Profile Store...', self,
+                                   triggered=self.showStoreDialog))
+        fileMenu.addSeparator()
+        fileMenu.addAction(QAction('Connect to Remote...', self,
+                                   shortcut='Ctrl+R', triggered=self.showRemoteDialog))
+        fileMenu.addAction(QAction('Disconnect', self,
+                                   triggered=self.disconnectRemote))
         fileMenu.addSeparator()
         fileMenu.addAction(QAction('Settings...', self,
                                    shortcut='Ctrl+Alt+S', triggered=self.showSettingsDialog))
+        fileMenu.addAction(QAction('Load Pruning...', self,
+                                   triggered=self.showPruningDialog))
         fileMenu.addSeparator()
         fileMenu.addAction(QAction('Exit', self,
                                    shortcut=QKeySequence.Quit, triggered=qApp.closeAllWindows))
@@ -194,8 +624,20 @@ class MyWindow(QMainWindow):
         viewMenu = menubar.addMenu(self.tr('&View'))
         viewMenu.addAction(QAction('Callgraph', self,
                                    shortcut='Ctrl+G', triggered=self.showCallgraphDialog))
+        viewMenu.addAction(QAction('Module Callgraph', self,
+                                   shortcut='Ctrl+Alt+G', triggered=self.showGroupCallgraphDialog))
+        viewMenu.addAction(QAction('Diff Callgraph', self,
+                                   shortcut='Ctrl+Shift+G', triggered=self.showDiffCallgraphDialog))
         viewMenu.addAction(QAction('Callees\' Pie Chart', self,
                                    shortcut='Ctrl+L', triggered=self.showPieChartDialog))
+        viewMenu.addAction(QAction('Flame Graph', self,
+                                   shortcut='Ctrl+F', triggered=self.showFlameGraphDialog))
+        viewMenu.addAction(QAction('Trend Chart', self,
+                                   shortcut='Ctrl+T', triggered=self.showTrendChartDialog))
+        viewMenu.addSeparator()
+        self._collapse_cycles_action = QAction('Collapse Cycles', self,
+                                               checkable=True, triggered=self.onCollapseCycles)
+        viewMenu.addAction(self._collapse_cycles_action)
 
         helpMenu = menubar.addMenu(self.tr('&Help'))
         helpMenu.addAction(QAction('About', self, triggered=self.showAboutDialog))
@@ -210,9 +652,19 @@ class MyWindow(QMainWindow):
         grid_layout2.addWidget(self._filtfile_label, 0, 0, 2, 1)
         grid_layout2.addWidget(self._filefilter_lineedit, 0, 1, 2, 9)
 
+        grid_layout5 = QGridLayout()
+        grid_layout5.addWidget(self._filtexpr_label, 0, 0, 2, 1)
+        grid_layout5.addWidget(self._exprfilter_lineedit, 0, 1, 2, 9)
+
+        grid_layout4 = QGridLayout()
+        grid_layout4.addWidget(self._thread_label, 0, 0, 2, 1)
+        grid_layout4.addWidget(self._thread_combobox, 0, 1, 2, 9)
+
         grid_layout3 = QGridLayout()
         grid_layout3.addItem(grid_layout1)
         grid_layout3.addItem(grid_layout2)
+        grid_layout3.addItem(grid_layout5)
+        grid_layout3.addItem(grid_layout4)
         grid_layout3.setSpacing(0)
 
         grid_layout = QGridLayout()
@@ -226,6 +678,58 @@ class MyWindow(QMainWindow):
 
         return stats_tabwidget
 
+    def createDiffWidget(self):
+        grid_layout = QGridLayout()
+        grid_layout.addWidget(self._diff_tableview)
+        widget = QWidget()
+        widget.setLayout(grid_layout)
+        return widget
+
+    def createSourceWidget(self):
+        grid_layout = QGridLayout()
+        grid_layout.addWidget(self._source_tableview)
+        widget = QWidget()
+        widget.setLayout(grid_layout)
+        return widget
+
+    def createHotPathWidget(self):
+        find_button = QPushButton('Find')
+        find_button.clicked.connect(self.updateHotPaths)
+        self._hotpath_spinbox.valueChanged.connect(self.updateHotPaths)
+        self._hotpath_checkbox.toggled.connect(self.updateHotPaths)
+
+        controls_layout = QHBoxLayout()
+        controls_layout.addWidget(QLabel('Paths:'))
+        controls_layout.addWidget(self._hotpath_spinbox)
+        controls_layout.addWidget(self._hotpath_checkbox)
+        controls_layout.addWidget(find_button)
+        controls_layout.addStretch()
+
+        grid_layout = QGridLayout()
+        grid_layout.addItem(controls_layout, 0, 0)
+        grid_layout.addWidget(self._hotpath_tableview, 1, 0)
+        widget = QWidget()
+        widget.setLayout(grid_layout)
+        return widget
+
+    def createGroupWidget(self):
+        self._group_combobox.currentIndexChanged.connect(self.updateGroups)
+        self._group_spinbox.valueChanged.connect(self.updateGroups)
+
+        controls_layout = QHBoxLayout()
+        controls_layout.addWidget(QLabel('Group By:'))
+        controls_layout.addWidget(self._group_combobox)
+        controls_layout.addWidget(QLabel('Depth:'))
+        controls_layout.addWidget(self._group_spinbox)
+        controls_layout.addStretch()
+
+        grid_layout = QGridLayout()
+        grid_layout.addItem(controls_layout, 0, 0)
+        grid_layout.addWidget(self._group_treeview, 1, 0)
+        widget = QWidget()
+        widget.setLayout(grid_layout)
+        return widget
+
     def createCallsTabWidget(self, callees_tabtitle, callers_tabtitle):
         grid_layout1 = QGridLayout()
         grid_layout1.addWidget(self._callees_tableview)
@@ -245,18 +749,104 @@ class MyWindow(QMainWindow):
     def setTitleDetails(self, details):
         self.setWindowTitle("%s - %s" % (self._title_base, details))
 
+    def setPreloader(self, preloader):
+        self._preloader = preloader
+
     def loadStats(self, datafile):
-        vstats = loadStats(datafile)
+        _, top, min_pct = LOAD_PRUNINGS[self._pruning_index]
+        vstats = None
+        if self._preloader is not None:
+            # waited for even if it is another file, so that two conversions
+            # never run at once
+            preloaded = self._preloader.stats()
+            if self._preloader.matches(datafile, top, min_pct):
+                vstats = preloaded
+            self._preloader = None
+        if not vstats:
+            vstats = loadStats(datafile, top, min_pct)
         if not vstats:
             return False
+        self.setStats(vstats, datafile)
+        self.clearDiff()    # the diff was against the stats replaced
+        addRecentFile(datafile)
+        self._line_stats = loadLineStats(datafile)
+        from vstatsstore import STORE_FILENAME
+        self.openStore(os.path.join(os.path.dirname(datafile), STORE_FILENAME), create=False)
+        return True
+
+    def openStore(self, filename, create=True):
+        if not create and not os.path.isfile(filename):
+            return False
+        from vstatsstore import ProfileStore
+        try:
+            store = ProfileStore(filename)
+        except:
+            print 'Exception Occured in openStore!'
+            return False
+        if self._store is not None:
+            self._store.close()
+        self._store = store
+        return True
+
+    def setStats(self, vstats, datafile):
+        import vProfile
+        self._thread_vstats = {}
+        self._line_stats = {}
+        self._peaks = None
+        if vProfile.is_memory_vstats(vstats):
+            self._peaks = vstats.get(vProfile.PEAKS_KEY, {})
+            vstats = vstats[vProfile.MEMORY_KEY]
+        if vProfile.is_thread_vstats(vstats):
+            self._thread_vstats = vstats[vProfile.THREADS_KEY]
+            vstats = vProfile.merge_vstats(self._thread_vstats.values())
+        self._all_vstats = vstats
         self._vstats = vstats
         self._pstats_file = datafile
 
+        self.initThreadSelector()
         self.initVstatsRelatedAttributes()
         self.setTitleDetails(datafile)
-        return True
+
+    def clearDiff(self):
+        self._diff = []
+        self._diff_vstats = {}
+        self._diff_summary = 0
+        self._diff_selected_func = None
+        self.initDiffTableView()
+
+    def initThreadSelector(self):
+        self._thread_combobox.blockSignals(True)
+        self._thread_combobox.clear()
+        self._thread_combobox.addItem(ALL_THREADS_LABEL)
+        for label in sorted(self._thread_vstats):
+            self._thread_combobox.addItem(label)
+        self._thread_combobox.setCurrentIndex(0)
+        self._thread_combobox.blockSignals(False)
+        self._thread_combobox.setEnabled(len(self._thread_vstats) > 0)
+
+    def onThreadSelected(self, index):
+        label = str(self._thread_combobox.itemText(index))
+        if label in self._thread_vstats:
+            self._vstats = self._thread_vstats[label]
+        else:
+            self._vstats = self._all_vstats
+
+        self.initVstatsRelatedAttributes()
+        self.onStatsFilter()
+
+    def onCollapseCycles(self):
+        self._vstats = self._raw_vstats
+        self.initVstatsRelatedAttributes()
+        self.onStatsFilter()
 
     def initVstatsRelatedAttributes(self):
+        # self._vstats is replaced by its collapsed version if asked to
+        self._raw_vstats = self._vstats
+        self._cycles = {}   # map: cycle key -> member keys, see vstatscycles
+        if self._collapse_cycles_action.isChecked():
+            from vstatscycles import collapse_cycles
+            self._vstats, self._cycles = collapse_cycles(self._vstats)
+
         from vProfile import vstats_summary
         self._summary = vstats_summary(self._vstats)
         self._funcs = list(self._vstats.keys())
@@ -264,16 +854,35 @@ class MyWindow(QMainWindow):
 
         self._filtered_vstats = self._vstats
         self._filtered_funcs  = self._funcs
+        self._filter_columns = None     # columns of self._vstats for expression filters
+
+        self._hotpaths_stale = True
+        self._groups_stale = True
+        self.updateStatsTab()
+
+    def updateStatsTab(self):
+        # tabs of costly views are brought up to date when shown
+        widget = self._stats_tabwidget.currentWidget()
+        if widget is self._hotpath_widget and self._hotpaths_stale:
+            self.updateHotPaths()
+        elif widget is self._group_widget and self._groups_stale:
+            self.updateGroups()
+
+    def createStatsTable(self, entries):
+        if self._peaks is not None:
+            return createMemoryStatsTable(self._summary, entries, self._peaks)
+        return createStatsTable(self._summary, entries)
 
     def initTableViews(self):
         entries = [self._filtered_vstats[func] for func in self._filtered_funcs]
-        stats_header, stats_table = createStatsTable(self._summary, entries)
+        stats_header, stats_table = self.createStatsTable(entries)
 
         model = MyTableModel(stats_header, stats_table, self._stats_tableview)
         self._stats_tableview.setModel(model)
         self._stats_tableview.setOnSelectionChanged(self.onSelectionChanged)
         self._callers_tableview.setModel(MyTableModel(stats_header, []))
         self._callees_tableview.setModel(MyTableModel(stats_header, []))
+        self._source_tableview.setModel(MyTableModel(*createSourceTable(None, None)))
 
     def onSelectionChanged(self, selected, deselected):
         indexes = selected.indexes()
@@ -291,7 +900,7 @@ class MyWindow(QMainWindow):
 
         # refresh _callees_tableview
         callee_entries = [self._vstats[callee] for callee in self._vstats[func].callees]
-        self._callees_tableview.setModel(MyTableModel(*createStatsTable(self._summary, callee_entries)))
+        self._callees_tableview.setModel(MyTableModel(*self.createStatsTable(callee_entries)))
 
         # refresh _callers_tableview
         import vProfile
@@ -300,29 +909,39 @@ class MyWindow(QMainWindow):
         if func in caller_map:
             callers = [caller for caller in caller_map[func]]
         caller_entries = [self._vstats[caller] for caller in callers]
-        self._callers_tableview.setModel(MyTableModel(*createStatsTable(self._summary, caller_entries)))
+        self._callers_tableview.setModel(MyTableModel(*self.createStatsTable(caller_entries)))
+
+        self.updateSourceView()
 
         self.updatePieChartDialog()
 
+        self.updateFlameGraphDialog()
+
+        self.updateTrendChartDialog()
+
         self.updateCallgraphDialog()
 
+    def updateSourceView(self):
+        func = self._selected_func
+        model = MyTableModel(*createSourceTable(self._vstats[func].code,
+                                                self._line_stats.get(func)))
+        self._source_tableview.setModel(model)
+        self._source_tableview.sortByColumn(1, Qt.AscendingOrder)
+
     def updatePieChartDialog(self):
-        if not self._piechart_dialog.isVisible():
+        if self._piechart_dialog is None or not self._piechart_dialog.isVisible():
             return
 
         func = self._selected_func
 
-        callee_data = [subentry.totaltime for _, subentry in self._vstats[func].callees.iteritems()]
+        # times of recursive calls are estimated if unknown
+        from vstatscycles import callee_times
+        callee_data, labels = [], []
+        for callee, time in callee_times(self._vstats, func).iteritems():
+            callee_data.append(time)
+            labels.append(getCodeLabel(self._vstats[callee].code))
         callee_data.append(self._vstats[func].inlinetime)
-        if len(callee_data) > 0 and callee_data[0] < 0.0:
-            callee_data = []
-
-        labels = []
-        if callee_data:
-            callee_entries = [self._vstats[callee] for callee in self._vstats[func].callees]
-            for entry in callee_entries:
-                labels.append(getCodeLabel(entry.code))
-            labels.append(INLINETIME_LABEL)
+        labels.append(INLINETIME_LABEL)
         data = zip(callee_data, labels)
         data.sort(key=lambda item: item[0], reverse=True)
         data = zip(*data)
@@ -332,8 +951,30 @@ class MyWindow(QMainWindow):
             self._piechart_dialog.setData([], [])
         self._piechart_dialog.setTitleDetails(getCodeLabel(self._vstats[func].code))
 
+    def updateFlameGraphDialog(self):
+        if self._flamegraph_dialog is None or not self._flamegraph_dialog.isVisible():
+            return
+
+        from vstatsflame import FlameGraph
+        graph = FlameGraph(self._vstats, self._selected_func)
+        self._flamegraph_dialog.setGraph(graph, self._vstats, self._peaks is not None)
+        if self._selected_func in self._vstats:
+            self._flamegraph_dialog.setTitleDetails(getCodeLabel(self._vstats[self._selected_func].code))
+
+    def updateTrendChartDialog(self):
+        if self._trendchart_dialog is None or not self._trendchart_dialog.isVisible() \
+                or self._selected_func is None:
+            return
+
+        func = self._selected_func
+        points = []
+        if self._store is not None:
+            points = self._store.trend(func, self._trendchart_dialog.metric())
+        self._trendchart_dialog.setData(points)
+        self._trendchart_dialog.setTitleDetails(getCodeLabel(self._vstats[func].code))
+
     def updateCallgraphDialog(self):
-        if not self._callgraph_window.isVisible():
+        if self._callgraph_window is None or not self._callgraph_window.isVisible():
             return
 
         pixmap = self.createCallgraph()
@@ -369,30 +1010,167 @@ class MyWindow(QMainWindow):
         if vstats is not None:
             self._filtered_vstats = vstats
 
+        selected = self.selectByExpression()
+        if selected is not None:
+            self._filtered_vstats = dict((func, self._filtered_vstats[func]) for func in selected
+                                         if func in self._filtered_vstats)
+
         self._filtered_funcs = list(self._filtered_vstats.keys())
         self.initTableViews()
 
+    def selectByExpression(self):
+        # funcs selected by the expression filter, or None if there is no
+        # valid expression
+        from vstatsfilter import compile_filter, Columns, FilterError
+        expression = str(self._exprfilter_lineedit.text()).strip()
+        if not expression:
+            self._exprfilter_lineedit.setStyleSheet('')
+            self._exprfilter_lineedit.setToolTip(EXPR_FILTER_TOOLTIP)
+            return None
+        if self._expr_filter is None or self._expr_filter.expression != expression:
+            try:
+                self._expr_filter = compile_filter(expression)
+            except FilterError, e:
+                self._expr_filter = None
+                self._exprfilter_lineedit.setStyleSheet('QLineEdit { background: #ffd0d0 }')
+                self._exprfilter_lineedit.setToolTip(str(e))
+                return None
+        self._exprfilter_lineedit.setStyleSheet('')
+        self._exprfilter_lineedit.setToolTip(EXPR_FILTER_TOOLTIP)
+        if self._filter_columns is None:
+            self._filter_columns = Columns(self._vstats, self._summary)
+        return self._expr_filter.select(self._filter_columns)
+
+    def updateHotPaths(self):
+        self._hotpaths = []
+        self._hotpaths_stale = False
+        if self._vstats:
+            from vProfile import hot_paths
+            root = None
+            if self._hotpath_checkbox.isChecked():
+                root = self._selected_func
+            self._hotpaths = hot_paths(self._vstats, self._hotpath_spinbox.value(), root,
+                                       DEFAULT_HOTPATH_MIN_FRACTION)
+
+        model = MyTableModel(*createHotPathTable(self._summary, self._hotpaths, self._vstats),
+                             parent=self._hotpath_tableview)
+        self._hotpath_tableview.setModel(model)
+        self._hotpath_tableview.setOnSelectionChanged(self.onHotPathSelectionChanged)
+
+    def onHotPathSelectionChanged(self, selected, deselected):
+        indexes = selected.indexes()
+        if not indexes:
+            return
+
+        model = self._hotpath_tableview.model()
+        row = indexes[0].row()
+        index, ok = model.data(model.index(row, 0), Qt.DisplayRole).toInt()
+        if not ok:
+            return
+        _, funcs = self._hotpaths[index]
+        self.selectFunc(funcs[-1])
+
+    def groupOptions(self):
+        # group_level and group_depth for vstatsgroups and vstats2dot
+        return dict(group_level=str(self._group_combobox.currentText()),
+                    group_depth=self._group_spinbox.value())
+
+    def updateGroups(self):
+        # groups are made of the functions before cycles are collapsed
+        groups, members = {}, {}
+        self._groups_stale = False
+        if self._raw_vstats:
+            from vstatsgroups import rollup, GROUP_LEVELS
+            if self._group_combobox.count() < len(GROUP_LEVELS):
+                self._group_combobox.blockSignals(True)
+                self._group_combobox.clear()
+                self._group_combobox.addItems(list(GROUP_LEVELS))
+                self._group_combobox.setCurrentIndex(GROUP_LEVELS.index(DEFAULT_GROUP_LEVEL))
+                self._group_combobox.blockSignals(False)
+            options = self.groupOptions()
+            groups, members = rollup(self._raw_vstats, options['group_level'],
+                                     options['group_depth'])
+        model, self._group_funcs = createGroupModel(self._summary, groups,
+                                                    members, self._raw_vstats)
+        model.setParent(self._group_treeview)
+        self._group_treeview.setModel(model)
+        self._group_treeview.sortByColumn(4, Qt.DescendingOrder)
+        self._group_treeview.resizeColumnToContents(0)
+        self._group_treeview.selectionModel().selectionChanged.connect(
+            self.onGroupSelectionChanged)
+
+    def onGroupSelectionChanged(self, selected, deselected):
+        indexes = selected.indexes()
+        if not indexes:
+            return
+
+        model = self._group_treeview.model()
+        item = model.itemFromIndex(indexes[0].sibling(indexes[0].row(), 0))
+        index, ok = item.data(GROUP_FUNC_ROLE).toInt()
+        if not ok or index < 0:
+            return
+        func = self._group_funcs[index]
+        if func not in self._vstats:    # a member of a collapsed cycle
+            for cycle, members in self._cycles.iteritems():
+                if func in members:
+                    func = cycle
+        self.selectFunc(func)
+
+    def initDiffTableView(self):
+        model = MyTableModel(*createDiffTable(self._diff), parent=self._diff_tableview)
+        self._diff_tableview.setModel(model)
+        self._diff_tableview.setOnSelectionChanged(self.onDiffSelectionChanged)
+
+    def onDiffSelectionChanged(self, selected, deselected):
+        indexes = selected.indexes()
+        if not indexes:
+            return
+
+        model = self._diff_tableview.model()
+        row = indexes[0].row()
+        index, ok = model.data(model.index(row, 0), Qt.DisplayRole).toInt()
+        if not ok:
+            return
+        func_a, func_b, _, _ = self._diff[index]
+        self._diff_selected_func = func_b if func_b is not None else func_a
+
     def createCallgraph(self):
+        return self.renderCallgraph(self._vstats, self._selected_func, self._summary)
+
+    def createGroupCallgraph(self):
+        return self.renderCallgraph(self._raw_vstats, self._selected_func, self._summary,
+                                    **self.groupOptions())
+
+    def createDiffCallgraph(self):
+        from vstatsdiff import diff_weights
+        from vstats2dot import DIFF_COLORMAP
+        weights, notes = diff_weights(self._diff)
+        return self.renderCallgraph(self._diff_vstats, self._diff_selected_func, self._diff_summary,
+                                    theme=DIFF_COLORMAP, weights=weights, notes=notes)
+
+    def renderCallgraph(self, vstats, root, summary, **options):
+        dot = findDot()
+        if dot is None:
+            QMessageBox().information(self, 'Error',
+                                      'Failed to find dot.exe, please make sure the '
+                                      'Graphviz executables are on your system path')
+            return None
+
         from tempfile import NamedTemporaryFile
-        from vstats2dot import vstats2dot
-        from subprocess import call
+        from vstats2dot import render_dot
 
-        dot_fp = NamedTemporaryFile(delete=False)
-        dot_fp.close()
         png_fp = NamedTemporaryFile(delete=False)
         png_fp.close()
 
         def __on_exit():
-            os.remove(dot_fp.name)
             os.remove(png_fp.name)
 
+        # the dot source is streamed into dot, see vstats2dot.render_dot
         callgraph_threshold = eval(self._thresholds[self._threshold_index])
-        vstats2dot(self._vstats, self._selected_func,
-                   outfile=dot_fp.name,
-                   threshold=callgraph_threshold,
-                   summary=self._summary)
-
-        if call(['dot', '-Tpng', dot_fp.name, '-o', png_fp.name], shell=True):
+        if render_dot(vstats, root, png_fp.name, 'png', dot,
+                      threshold=callgraph_threshold,
+                      summary=summary,
+                      **options):
             QMessageBox().information(self, 'Error',
                                       'Failed to execute dot.exe, please make sure the '
                                       'Graphviz executables are on your system path')
@@ -408,10 +1186,144 @@ class MyWindow(QMainWindow):
                                                directory=os.path.dirname(self._pstats_file))
         if filename == '':
             return
-        if self.loadStats(str(filename)):
+        self.openFile(str(filename))
+
+    def openFile(self, filename):
+        if self.loadStats(filename):
             self.initTableViews()
         else:
-            QMessageBox().information(self, 'Error', 'The file does not exist or is not a pstats/vstats file')
+            QMessageBox().information(self, 'Error', 'The file does not exist or is not a pstats/vstats/callgrind/stack sample file')
+
+    def updateRecentMenu(self):
+        self._recent_menu.clear()
+        files = recentFiles()
+        for index, filename in enumerate(files):
+            self._recent_menu.addAction(QAction('&%d  %s' % (index + 1, filename), self,
+                                                triggered=lambda checked=False, filename=filename:
+                                                self.openFile(filename)))
+        if not files:
+            self._recent_menu.addAction(QAction('No Recent Files', self, enabled=False))
+
+    def showStoreDialog(self):
+        from vstatsstore import STORE_FILENAME
+        filename = QFileDialog.getOpenFileName(self, 'Open Profile Store...',
+                                               os.path.join(os.path.dirname(self._pstats_file),
+                                                            STORE_FILENAME),
+                                               self.tr('*.db'))
+        if filename == '':
+            return
+        if not self.openStore(str(filename)):
+            QMessageBox().information(self, 'Error', 'The file is not a profile store')
+            return
+        self.updateTrendChartDialog()
+
+    def showMergeDialog(self):
+        filenames = QFileDialog.getOpenFileNames(caption='Merge files',
+                                                 directory=os.path.dirname(self._pstats_file))
+        filenames = [str(filename) for filename in filenames]
+        if not filenames:
+            return
+
+        import multiprocessing
+        from vstatsmerge import merge_files
+        try:
+            vstats = merge_files(filenames, multiprocessing.cpu_count())
+        except:
+            QMessageBox().information(self, 'Error', 'Some of the files do not exist or are not pstats/vstats files')
+            return
+        self.setStats(vstats, '%s (+%d)' % (filenames[0], len(filenames) - 1))
+        self.clearDiff()
+        self._pstats_file = filenames[0]
+        self.initTableViews()
+
+    def showCompareDialog(self):
+        if not self._vstats:
+            QMessageBox().information(self, 'Error', 'Open a profile to compare with first')
+            return
+
+        filename = QFileDialog.getOpenFileName(caption='Compare with file',
+                                               directory=os.path.dirname(self._pstats_file))
+        if filename == '':
+            return
+        vstats = loadStats(str(filename))
+        if not vstats:
+            QMessageBox().information(self, 'Error', 'The file does not exist or is not a pstats/vstats/callgrind/stack sample file')
+            return
+
+        import vProfile
+        from vstatsdiff import diff_vstats
+        if vProfile.is_thread_vstats(vstats):
+            vstats = vProfile.merge_vstats(vstats[vProfile.THREADS_KEY].values())
+        self._diff_vstats = vstats
+        self._diff_summary = vProfile.vstats_summary(vstats)
+        self._diff = diff_vstats(self._vstats, vstats)
+        self._diff_selected_func = None
+        self.initDiffTableView()
+        self.setTitleDetails('%s vs %s' % (self._pstats_file, filename))
+
+    def showRemoteDialog(self):
+        address, ok = QInputDialog.getText(self, 'Connect to Remote',
+                                           'Address of the vProfile agent (host:port):',
+                                           QLineEdit.Normal,
+                                           '%s:%s' % (DEFAULT_REMOTE_HOST, DEFAULT_REMOTE_PORT))
+        if not ok:
+            return
+        host, _, port = str(address).strip().partition(':')
+        if not validateIPAddress(host) or not port.isdigit():
+            QMessageBox().information(self, 'Error', 'Invalid address: %s' % address)
+            return
+
+        self.disconnectRemote()
+        from vRemote import RemoteClient
+        try:
+            self._remote_client = RemoteClient(host, int(port))
+            self._remote_client.start()
+        except Exception as e:
+            self._remote_client = None
+            QMessageBox().information(self, 'Error', 'Failed to connect to %s: %s' % (address, e))
+            return
+        self._remote_address = '%s:%s' % (host, port)
+        self._remote_timer.start(DEFAULT_REMOTE_REFRESH_INTERVAL)
+
+    def disconnectRemote(self):
+        self._remote_timer.stop()
+        if self._remote_client is None:
+            return
+        try:
+            self._remote_client.stop()
+            self._remote_client.close()
+        except Exception:
+            pass
+        self._remote_client = None
+
+    def onRemoteTimer(self):
+        try:
+            updated = self._remote_client.poll()
+        except Exception as e:
+            self.disconnectRemote()
+            QMessageBox().information(self, 'Error', 'Disconnected from %s: %s' % (self._remote_address, e))
+            return
+        if not updated:
+            return
+
+        # the views are rebuilt from the whole snapshot, not updated in
+        # place; the filters and the selection are kept
+        selected_func = self._selected_func
+        self.setStats(self._remote_client.vstats(), 'remote %s' % self._remote_address)
+        self.onStatsFilter()
+        if selected_func in self._vstats:
+            self._selected_func = selected_func
+            self.selectFunc(selected_func)
+
+    def selectFunc(self, func):
+        if func not in self._filtered_vstats:
+            return
+        model = self._stats_tableview.model()
+        for row in xrange(model.rowCount()):
+            index, ok = model.data(model.index(row, 0), Qt.DisplayRole).toInt()
+            if ok and self._filtered_funcs[index] == func:
+                self._stats_tableview.selectRow(row)
+                return
 
     def saveStats(self):
         if not self._vstats:
@@ -420,8 +1332,47 @@ class MyWindow(QMainWindow):
 
         filename = QFileDialog.getSaveFileName(self, 'Save As...', 'profviz.vstats', self.tr('*.vstats'))
         if filename:
-            from vProfile import dump_vstats
-            dump_vstats(self._vstats, filename)
+            from vProfile import dump_vstats, THREADS_KEY, MEMORY_KEY, PEAKS_KEY
+            vstats = self._raw_vstats
+            if self._thread_vstats:
+                vstats = {THREADS_KEY: self._thread_vstats}
+            if self._peaks is not None:
+                vstats = {MEMORY_KEY: vstats, PEAKS_KEY: self._peaks}
+            dump_vstats(vstats, str(filename))
+            if self._line_stats:
+                import vLineProfile
+                vLineProfile.dump_line_stats(self._line_stats,
+                                             vLineProfile.line_stats_file(str(filename)))
+
+    def exportCallgrind(self):
+        if not self._vstats:
+            QMessageBox().information(self, 'Error', 'You have no data to be exported')
+            return
+
+        filename = QFileDialog.getSaveFileName(self, 'Export Callgrind...', 'callgrind.out', self.tr('callgrind.out*'))
+        if filename:
+            from vstats2callgrind import vstats2callgrind
+            vstats2callgrind(self._vstats, str(filename))
+
+    def exportSpeedscope(self):
+        if not self._vstats:
+            QMessageBox().information(self, 'Error', 'You have no data to be exported')
+            return
+
+        filename = QFileDialog.getSaveFileName(self, 'Export Speedscope...', 'profile.speedscope.json', self.tr('*.json'))
+        if filename:
+            from vstats2trace import dump_speedscope
+            dump_speedscope(self._vstats, str(filename))
+
+    def exportChromeTrace(self):
+        if not self._vstats:
+            QMessageBox().information(self, 'Error', 'You have no data to be exported')
+            return
+
+        filename = QFileDialog.getSaveFileName(self, 'Export Chrome Trace...', 'trace.json', self.tr('*.json'))
+        if filename:
+            from vstats2trace import dump_chrome_trace
+            dump_chrome_trace(self._vstats, str(filename))
 
     def showSettingsDialog(self):
         thres, ok = QInputDialog.getItem(self, 'Settings',
@@ -441,19 +1392,85 @@ class MyWindow(QMainWindow):
                     self._threshold_index = index
                     return
 
+    def showPruningDialog(self):
+        labels = [label for label, _, _ in LOAD_PRUNINGS]
+        label, ok = QInputDialog.getItem(self, 'Load Pruning',
+                                         'Functions to keep when loading a profile: <blockquote>'
+                                         'The calls of a kept function to pruned functions are '
+                                         'folded into one &lt;other&gt; callee</blockquote>'
+                                         '<p></p>',
+                                         labels, self._pruning_index, False)
+        if not ok:
+            return
+        self._pruning_index = labels.index(str(label))
+        if self._pstats_file and os.path.isfile(self._pstats_file):
+            if self.loadStats(self._pstats_file):
+                self.initTableViews()
+
+    def piechartDialog(self):
+        if self._piechart_dialog is None:
+            self._piechart_dialog = PieChartDialog('Callees\' Pie Chart', self)
+        return self._piechart_dialog
+
+    def flamegraphDialog(self):
+        if self._flamegraph_dialog is None:
+            self._flamegraph_dialog = FlameGraphDialog('Flame Graph', self)
+        return self._flamegraph_dialog
+
+    def trendchartDialog(self):
+        if self._trendchart_dialog is None:
+            self._trendchart_dialog = TrendChartDialog('Trend Chart', self)
+            self._trendchart_dialog.metricChanged.connect(self.updateTrendChartDialog)
+        return self._trendchart_dialog
+
+    def callgraphWindow(self):
+        if self._callgraph_window is None:
+            self._callgraph_window = ImageWindow('Callgraph', self)
+        return self._callgraph_window
+
     def showPieChartDialog(self):
         # show piechart dialog at the right-bottom corner of the main window
-        dw, dh = self._piechart_dialog.width(), self._piechart_dialog.height()
+        dialog = self.piechartDialog()
+        dw, dh = dialog.width(), dialog.height()
         x = self.geometry().x() + self.geometry().width() - dw
         y = self.geometry().y() + self.geometry().height() - dh
-        self._piechart_dialog.setGeometry(x, y, dw, dh)
-        self._piechart_dialog.show()
+        dialog.setGeometry(x, y, dw, dh)
+        dialog.show()
+
+    def showFlameGraphDialog(self):
+        self.flamegraphDialog().show()
+        self.updateFlameGraphDialog()
+
+    def showTrendChartDialog(self):
+        if self._store is None:
+            QMessageBox().information(self, 'Error', 'Open a profile store first, see vstatsstore.py')
+            return
+        self.trendchartDialog().show()
+        self.updateTrendChartDialog()
 
     def showCallgraphDialog(self):
         pixmap = self.createCallgraph()
         if pixmap:
-            self._callgraph_window.setPixmap(pixmap)
-            self._callgraph_window.show()
+            window = self.callgraphWindow()
+            window.setPixmap(pixmap)
+            window.show()
+
+    def showGroupCallgraphDialog(self):
+        pixmap = self.createGroupCallgraph()
+        if pixmap:
+            window = self.callgraphWindow()
+            window.setPixmap(pixmap)
+            window.show()
+
+    def showDiffCallgraphDialog(self):
+        if not self._diff:
+            QMessageBox().information(self, 'Error', 'Compare with another profile first')
+            return
+        pixmap = self.createDiffCallgraph()
+        if pixmap:
+            window = self.callgraphWindow()
+            window.setPixmap(pixmap)
+            window.show()
 
     def showAboutDialog(self):
         QMessageBox.about(self, "About %s" % APPNAME, ABOUT)
@@ -628,6 +1645,218 @@ class PieChartDialog(QDialog):
         return scene
 
 
+class FlameGraphDialog(QDialog):
+    def __init__(self, title, parent=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle(title)
+        self.resize(DEFAULT_FLAMEGRAPH_DLG_WIDTH, DEFAULT_FLAMEGRAPH_DLG_HEIGHT)
+
+        self._title_base = title
+
+        self._flamegraph_widget = FlameGraphWidget()
+        scroll_area = QScrollArea()
+        scroll_area.setWidgetResizable(True)
+        scroll_area.setWidget(self._flamegraph_widget)
+
+        self._flip_checkbox = QCheckBox('Flame (root at bottom)')
+        self._flip_checkbox.toggled.connect(self._flamegraph_widget.setFlipped)
+
+        grid_layout = QGridLayout()
+        grid_layout.addWidget(scroll_area, 0, 0, 1, 2)
+        grid_layout.addWidget(self._flip_checkbox, 1, 0)
+        grid_layout.addWidget(QLabel(FLAMEGRAPH_DLG_CONTROLS), 1, 1)
+        self.setLayout(grid_layout)
+
+    def setTitleDetails(self, details):
+        self.setWindowTitle('%s - %s' % (self._title_base, details.strip()))
+
+    def setGraph(self, graph, vstats, memory=False):
+        self._flamegraph_widget.setGraph(graph, vstats, memory)
+
+
+class TrendChartDialog(QDialog):
+    metricChanged = pyqtSignal()
+
+    def __init__(self, title, parent=None):
+        QDialog.__init__(self, parent, Qt.WindowStaysOnTopHint)
+        self.setWindowTitle(title)
+        self.resize(DEFAULT_TRENDCHART_DLG_WIDTH, DEFAULT_TRENDCHART_DLG_HEIGHT)
+
+        self._title_base = title
+        self._points = []
+
+        from vstatsstore import METRICS
+        self._metric_combobox = QComboBox()
+        self._metric_combobox.addItems(list(METRICS))
+        self._metric_combobox.setCurrentIndex(METRICS.index('tottime'))
+        self._metric_combobox.currentIndexChanged.connect(self.metricChanged)
+
+        self._chart_view = QGraphicsView()
+        self._chart_view.setFrameStyle(QFrame.NoFrame)
+        self._chart_view.setRenderHint(QPainter.Antialiasing)
+
+        grid_layout = QGridLayout()
+        grid_layout.addWidget(self._chart_view, 0, 0, 1, 3)
+        grid_layout.addWidget(QLabel('Metric:'), 1, 0)
+        grid_layout.addWidget(self._metric_combobox, 1, 1)
+        grid_layout.setColumnStretch(2, 1)
+        self.setLayout(grid_layout)
+
+    def setTitleDetails(self, details):
+        self.setWindowTitle('%s - %s' % (self._title_base, details.strip()))
+
+    def metric(self):
+        return str(self._metric_combobox.currentText())
+
+    def setData(self, points):
+        # points: [(time taken, value)] ordered by time
+        self._points = points
+        self._chart_view.setScene(self.createTrendChartScene(points))
+
+    def resizeEvent(self, event):
+        QDialog.resizeEvent(self, event)
+        self._chart_view.setScene(self.createTrendChartScene(self._points))
+
+    def createTrendChartScene(self, points):
+        import time
+        scene = QGraphicsScene()
+        if not points:
+            scene.addText('No snapshots of this function in the profile store')
+            return scene
+
+        margin = 64
+        width = max(self._chart_view.width() - 2 * margin, 100)
+        height = max(self._chart_view.height() - 2 * margin, 60)
+        t0, t1 = points[0][0], points[-1][0]
+        top = max(value for _, value in points) or 1.0
+
+        def __pos(taken, value):
+            x = width * (taken - t0) / (t1 - t0) if t1 > t0 else width / 2.0
+            return QPointF(x, height - height * value / top)
+
+        def __time(taken):
+            return time.strftime('%Y-%m-%d %H:%M', time.localtime(taken))
+
+        axis_pen = QPen(Qt.gray)
+        scene.addLine(0, height, width, height, axis_pen)
+        scene.addLine(0, 0, 0, height, axis_pen)
+        for text, x, y in ((str(top), 0, 0), ('0', 0, height)):
+            label = scene.addText(text)
+            label.setPos(x - label.boundingRect().width() - 4,
+                         y - label.boundingRect().height() / 2)
+        for text, taken in ((__time(t0), t0), (__time(t1), t1)):
+            label = scene.addText(text)
+            label.setPos(__pos(taken, 0).x() - label.boundingRect().width() / 2, height + 4)
+            if t1 <= t0:
+                break
+
+        path = QPainterPath(__pos(*points[0]))
+        for point in points[1:]:
+            path.lineTo(__pos(*point))
+        scene.addPath(path, QPen(QColor(255, 0, 0), 2))
+        for taken, value in points:
+            pos = __pos(taken, value)
+            dot = scene.addEllipse(pos.x() - 3, pos.y() - 3, 6, 6,
+                                   QPen(QColor(255, 0, 0)), QBrush(QColor(255, 0, 0)))
+            dot.setToolTip('%s  %s' % (__time(taken), value))
+        return scene
+
+
+class FlameGraphWidget(QWidget):
+    def __init__(self, parent=None):
+        QWidget.__init__(self, parent)
+        self.setMouseTracking(True)
+        self.setFont(DEFAULT_FONT)
+
+        self._graph = None
+        self._vstats = {}
+        self._zoom = 0
+        self._layout = ([], [], [])
+        self._flipped = False
+        self._memory = False
+
+    def setGraph(self, graph, vstats, memory=False):
+        self._graph = graph
+        self._vstats = vstats
+        self._memory = memory   # values are bytes instead of seconds
+        self.setMinimumHeight((graph.max_depth + 1) * FLAMEGRAPH_FRAME_HEIGHT)
+        self.zoomTo(0)
+
+    def setFlipped(self, flipped):
+        self._flipped = flipped
+        self.update()
+
+    def zoomTo(self, frame):
+        self._zoom = frame
+        self._layout = self._graph.layout(frame)
+        self.update()
+
+    def frameRect(self, frame):
+        xs, widths, _ = self._layout
+        depth = self._graph.depths[frame]
+        y = depth * FLAMEGRAPH_FRAME_HEIGHT
+        if self._flipped:
+            y = self.height() - y - FLAMEGRAPH_FRAME_HEIGHT
+        return QRectF(xs[frame] * self.width(), y,
+                      widths[frame] * self.width(), FLAMEGRAPH_FRAME_HEIGHT)
+
+    def frameAt(self, pos):
+        if self._graph is None:
+            return None
+        for frame in self._layout[2]:
+            if self.frameRect(frame).contains(QPointF(pos)):
+                return frame
+        return None
+
+    def frameColor(self, frame):
+        func = self._graph.funcs[frame]
+        if func is None:
+            return QColor(192, 192, 192)
+        h = hash(func)
+        return QColor.fromHsv(h % 50, 140 + (h >> 8) % 80, 235)
+
+    def paintEvent(self, event):
+        if self._graph is None:
+            return
+        painter = QPainter(self)
+        painter.setPen(QPen(Qt.white, 0.5))
+        metrics = painter.fontMetrics()
+        for frame in self._layout[2]:
+            rect = self.frameRect(frame)
+            if rect.width() < 0.5:
+                continue
+            painter.fillRect(rect, self.frameColor(frame))
+            painter.drawRect(rect)
+            if rect.width() > 24:
+                label = self._graph.label(frame, self._vstats)
+                text = metrics.elidedText(label, Qt.ElideRight, int(rect.width()) - 4)
+                painter.setPen(Qt.black)
+                painter.drawText(rect.adjusted(2, 0, -2, 0), Qt.AlignVCenter | Qt.AlignLeft, text)
+                painter.setPen(QPen(Qt.white, 0.5))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        if self._graph is None:
+            return
+        if event.button() == Qt.RightButton:
+            self.zoomTo(0)
+            return
+        frame = self.frameAt(event.pos())
+        if frame is not None:
+            self.zoomTo(frame)
+
+    def mouseMoveEvent(self, event):
+        frame = self.frameAt(event.pos())
+        if frame is None:
+            self.setToolTip('')
+            return
+        value = self._graph.values[frame]
+        total = self._graph.values[0]
+        pct = 100.0 * value / total if total > 0 else 0.0
+        value = ('%d bytes' if self._memory else '%.3fs') % value
+        self.setToolTip('%s\n%s (%5.2f%%)' % (self._graph.label(frame, self._vstats), value, pct))
+
+
 class ImageWindow(QMainWindow):
     def __init__(self, titile, parent=None, pixmap=None):
         super(ImageWindow, self).__init__(parent)
@@ -778,9 +2007,37 @@ class ImageWindow(QMainWindow):
 
 
 def main():
-    app = QApplication(sys.argv)
+    # in the frozen exe, workers of multiprocessing pools (see vstatsmerge)
+    # start this main() too, and must run their task instead of the GUI
+    import multiprocessing
+    multiprocessing.freeze_support()
+
+    app = QApplication(sys.argv)  # takes the options of Qt out of sys.argv
+    usage = "%s [stats_file]"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    options, args = parser.parse_args(sys.argv[1:])
+    if len(args) > 1:
+        parser.print_usage()
+        sys.exit(2)
+
+    # the stats to open, or else the latest of the recent files, are loaded
+    # while the window is built and painted; the latest file is likely to
+    # be opened next, and needs no conversion if it is in the cache
+    datafile = args[0] if args else None
+    preload = datafile
+    if preload is None:
+        preload = ([filename for filename in recentFiles()[:1]
+                    if os.path.isfile(filename)] or [None])[0]
+    preloader = None
+    if preload is not None:
+        _, top, min_pct = LOAD_PRUNINGS[0]
+        preloader = StatsPreloader(preload, top, min_pct, skip_cached=datafile is None)
+
     window = MyWindow()
+    window.setPreloader(preloader)
     window.show()
+    if datafile is not None:
+        QTimer.singleShot(0, lambda: window.openFile(datafile))
     sys.exit(app.exec_())
 
 
@@ -0,0 +1,314 @@
+#! /usr/bin/env python
+#
+#  Tool for converting callgrind files (as read by KCachegrind) to vstats
+#      see http://valgrind.org/docs/manual/cl-format.html
+#
+
+"""Callgrind import as vstats
+
+The input is read in large chunks and parsed line by line with string
+methods only. Compressed names ('fn=(1) name', then 'fn=(1)') are
+resolved per kind: files (fl, fi, fe, cfl, cfi), functions (fn, cfn) and
+objects (ob, cob). Any number of position columns is skipped, and the
+costs of one event, the first by default, are taken.
+
+Costs of a function become its inline time, the inclusive costs of its
+calls become callee edges, and total time is inline time plus the costs
+of calls to other functions. Costs are converted to seconds for events
+written by vstats2callgrind.py and lsprof2calltree.py, and taken as they
+are otherwise.
+
+Function names written by vstats2callgrind.py ('name [file:line]') and by
+older lsprof2calltree.py ('name file:line') are mapped back to their
+vstats keys.
+"""
+
+import os
+import sys
+from optparse import OptionParser
+
+import vProfile
+import vstatsmerge
+
+
+__all__ = ["is_callgrind_file", "load_callgrind", "CallgrindParser"]
+
+# seconds per unit of cost of known events
+EVENT_SCALES = {
+    'Microseconds': 1e-6,
+    'Ticks': 1e-3,      # lsprof2calltree.py, in milliseconds
+}
+
+BUILTIN_FILENAMES = ('', '~', '???', '<built-in>')
+
+CHUNK_SIZE = 1 << 20
+
+_file_keys = ('fl', 'fi', 'fe', 'cfl', 'cfi')
+_func_keys = ('fn', 'cfn')
+_object_keys = ('ob', 'cob')
+
+
+class CallgrindParser:
+    def __init__(self, event=None):
+        self.event = event      # name of the event to import
+        self.scale = 1.0
+        self.positions = 1
+        self._event_index = 0
+
+        self._names = {'file': {}, 'func': {}, 'object': {}}
+        self._funcs = {}        # map: (filename, funcname) -> function id
+        self._labels = []       # function id -> (filename, funcname)
+        self._linenos = []      # function id -> first line of its costs
+        self._costs = []        # function id -> inline cost
+        self._callees = []      # function id -> {callee id: [calls, cost]}
+
+        self._file = ''         # of the current function
+        self._func = None       # id of the current function
+        self._callee_file = None
+        self._callee = None
+        self._call_count = None # of the last 'calls=' line
+        self._skip_cost = False # the line after 'jump=' or 'jcnd='
+
+    def feed(self, fp):
+        rest = ''
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (rest + chunk).split('\n')
+            rest = lines.pop()
+            self._parse_lines(lines)
+        if rest:
+            self._parse_lines([rest])
+
+    def _parse_lines(self, lines):
+        for line in lines:
+            line = line.rstrip('\r')
+            if not line:
+                continue
+            c = line[0]
+            if c.isdigit() or c in '+-*':
+                self._cost_line(line)
+            elif c == '#':
+                continue
+            else:
+                key, sep, value = line.partition('=')
+                if sep:
+                    self._spec_line(key, value)
+                else:
+                    key, sep, value = line.partition(':')
+                    if sep:
+                        self._header_line(key, value.strip())
+
+    def _header_line(self, key, value):
+        if key == 'events':
+            events = value.split()
+            if self.event in events:
+                self._event_index = events.index(self.event)
+            elif events:
+                self.event = events[0]
+                self._event_index = 0
+            self.scale = EVENT_SCALES.get(self.event, 1.0)
+        elif key == 'positions':
+            self.positions = len(value.split())
+
+    def _spec_line(self, key, value):
+        if key in _func_keys:
+            name = self._resolve('func', value)
+            if key == 'fn':
+                self._func = self._function(self._file, name)
+                self._callee_file = None
+            else:
+                filename = self._callee_file
+                if filename is None:
+                    filename = self._file
+                self._callee = self._function(filename, name)
+        elif key in _file_keys:
+            name = self._resolve('file', value)
+            if key == 'fl':
+                self._file = name
+            elif key in ('cfl', 'cfi'):
+                self._callee_file = name
+            else:
+                # fi= and fe=: the costs that follow are of code inlined
+                # from another file, and stay with the current function
+                pass
+        elif key in _object_keys:
+            self._resolve('object', value)
+        elif key == 'calls':
+            self._call_count = int(value.split(None, 1)[0])
+        elif key in ('jump', 'jcnd'):
+            self._skip_cost = True
+
+    def _cost_line(self, line):
+        if self._skip_cost:
+            self._skip_cost = False
+            return
+        if self._func is None:
+            return
+        fields = line.split()
+        index = self.positions + self._event_index
+        cost = 0
+        if index < len(fields):
+            cost = _number(fields[index])
+
+        func = self._func
+        if self._call_count is not None:
+            callees = self._callees[func]
+            edge = callees.get(self._callee)
+            if edge is None:
+                callees[self._callee] = [self._call_count, cost]
+            else:
+                edge[0] += self._call_count
+                edge[1] += cost
+            self._call_count = None
+            self._callee_file = None
+            return
+
+        self._costs[func] += cost
+        if self._linenos[func] is None:
+            lineno = fields[0]
+            if lineno.isdigit():
+                self._linenos[func] = int(lineno)
+
+    def _resolve(self, kind, value):
+        # resolve a compressed name
+        if not value.startswith('('):
+            return value
+        end = value.find(')')
+        if end < 0:
+            return value
+        name_id = value[1:end]
+        name = value[end + 1:].strip()
+        names = self._names[kind]
+        if name:
+            names[name_id] = name
+            return name
+        return names.get(name_id, '')
+
+    def _function(self, filename, funcname):
+        label = (filename, funcname)
+        func = self._funcs.get(label)
+        if func is None:
+            func = self._funcs[label] = len(self._labels)
+            self._labels.append(label)
+            self._linenos.append(None)
+            self._costs.append(0)
+            self._callees.append({})
+        return func
+
+    def to_partial(self):
+        scale = self.scale
+        keys, codes = [], {}
+        for (filename, funcname), lineno in zip(self._labels, self._linenos):
+            label = _code_label(filename, funcname, lineno or 0)
+            name = intern(str(vProfile.fake_code(label)))
+            keys.append(name)
+            codes[name] = label
+
+        entries = {}
+        calls_in = [0] * len(keys)
+        for func, callees in enumerate(self._callees):
+            for callee, (count, cost) in callees.iteritems():
+                calls_in[callee] += count
+
+        for func, name in enumerate(keys):
+            inlinetime = self._costs[func] * scale
+            totaltime = inlinetime
+            reccallcount = 0
+            callees = {}
+            for callee, (count, cost) in self._callees[func].iteritems():
+                callees[keys[callee]] = [count, cost * scale]
+                if callee == func:
+                    reccallcount += count
+                else:
+                    totaltime += cost * scale
+
+            entry = entries.get(name)
+            if entry is None:
+                entries[name] = [calls_in[func], reccallcount,
+                                 inlinetime, totaltime, callees]
+            else:   # names of several files mapped to one label, e.g. the
+                    # 'name [file:line]' of vstats2callgrind.py under two fl=
+                vstatsmerge.merge_partials(
+                    (codes, entries),
+                    ({name: codes[name]},
+                     {name: [calls_in[func], reccallcount,
+                             inlinetime, totaltime, callees]}))
+        return codes, entries
+
+
+def _number(field):
+    if field.startswith('0x'):
+        return int(field, 16)
+    try:
+        return int(field)
+    except ValueError:
+        return float(field)
+
+
+def _code_label(filename, funcname, lineno):
+    # returns (filename, lineno, funcname) of a function
+    if funcname.endswith(']') and ' [' in funcname:  # vstats2callgrind.py
+        name, _, where = funcname[:-1].rpartition(' [')
+        path, _, line = where.rpartition(':')
+        if line.isdigit():
+            return (path, int(line), name)
+    if ' ' in funcname:     # lsprof2calltree.py
+        name, _, where = funcname.rpartition(' ')
+        path, _, line = where.rpartition(':')
+        if path and line.isdigit():
+            return (path, int(line), name)
+    if filename in BUILTIN_FILENAMES:
+        return ('', 0, funcname)
+    return (filename, lineno, funcname)
+
+
+def is_callgrind_file(filename):
+    fp = open(filename, 'rb')
+    try:
+        head = fp.read(65536)
+    finally:
+        fp.close()
+    if head.startswith('# callgrind format'):
+        return True
+    has_events, has_fn = False, False
+    for line in head.splitlines():
+        if line.startswith('events:'):
+            has_events = True
+        elif line.startswith('fn='):
+            has_fn = True
+        if has_events and has_fn:
+            return True
+    return False
+
+
+def load_callgrind(filename, event=None):
+    parser = CallgrindParser(event)
+    fp = open(filename, 'rb')
+    try:
+        parser.feed(fp)
+    finally:
+        fp.close()
+    return vstatsmerge.partial2vstats(parser.to_partial())
+
+
+def main():
+    usage = "%s [-e event] -o output_file_path callgrind_file"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    parser.add_option('-o', '--outfile', dest="outfile",
+                      help="save stats to <outfile>", default=None)
+    parser.add_option('-e', '--event', dest="event",
+                      help="event to import, defaults to the first one",
+                      default=None)
+
+    options, args = parser.parse_args()
+    if not options.outfile or len(args) != 1:
+        parser.print_usage()
+        sys.exit(2)
+
+    vstats = load_callgrind(args[0], options.event)
+    vProfile.dump_vstats(vstats, options.outfile)
+
+if __name__ == '__main__':
+    sys.exit(main())
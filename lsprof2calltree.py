@@ -17,87 +17,23 @@ import optparse
 import sys
 import os
 
+import vProfile
+from vstats2callgrind import CallgrindWriter
+
 try:
     import cProfile
 except ImportError:
     raise SystemExit("This script requires cProfile from Python 2.5")
 
 
-def label(code):
-    if isinstance(code, str):
-        return code   # ('~', 0, code)    # built-in functions ('~' sorts at the end)
-    else:
-        return '%s %s:%d' % (code.co_name,
-                             code.co_filename,
-                             code.co_firstlineno)
-
-filename_of_builtin_funcs = ''
-
-
 class KCacheGrind(object):
+    # writes stats of a cProfile.Profile by vstats2callgrind.CallgrindWriter
     def __init__(self, profiler):
-        self.data = profiler.get_stats()
-        self.out_file = None
+        profiler.create_stats()
+        self.data = vProfile.pstats2vstats(profiler.stats)
 
     def output(self, out_file):
-        self.out_file = out_file
-        print >> out_file, 'events: Ticks'
-        self._print_summary()
-        for entry in self.data:
-            self._entry(entry)
-
-    def _print_summary(self):
-        max_cost = 0
-        for entry in self.data:
-            totaltime = int(entry.totaltime * 1000)
-            max_cost = max(max_cost, totaltime)
-        print >> self.out_file, 'summary: %d' % (max_cost,)
-
-    def _entry(self, entry):
-        out_file = self.out_file
-        code = entry.code
-
-        if isinstance(code, str):
-            print >> out_file, 'fi=%s' % filename_of_builtin_funcs
-        else:
-            print >> out_file, 'fi=%s' % (code.co_filename,)
-        print >> out_file, 'fn=%s' % (label(code),)
-
-        inlinetime = int(entry.inlinetime * 1000)
-        if isinstance(code, str):
-            print >> out_file, '0 ', inlinetime
-        else:
-            print >> out_file, '%d %d' % (code.co_firstlineno, inlinetime)
-
-        # recursive calls are counted in entry.calls
-        if entry.calls:
-            calls = entry.calls
-        else:
-            calls = []
-
-        if isinstance(code, str):
-            lineno = 0
-        else:
-            lineno = code.co_firstlineno
-
-        for subentry in calls:
-            self._subentry(lineno, subentry)
-        print >> out_file
-
-    def _subentry(self, lineno, subentry):
-        out_file = self.out_file
-        code = subentry.code
-        print >> out_file, 'cfn=%s' % (label(code),)
-        if isinstance(code, str):
-            print >> out_file, 'cfi=%s' % filename_of_builtin_funcs
-            print >> out_file, 'calls=%d 0' % (subentry.callcount,)
-        else:
-            print >> out_file, 'cfi=%s' % (code.co_filename,)
-            print >> out_file, 'calls=%d %d' % (
-                subentry.callcount, code.co_firstlineno)
-
-        totaltime = int(subentry.totaltime * 1000)
-        print >> out_file, '%d %d' % (lineno, totaltime)
+        CallgrindWriter(out_file).graph(self.data)
 
 
 def main():
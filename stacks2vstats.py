@@ -0,0 +1,239 @@
+#! /usr/bin/env python
+#
+#  Tool for converting stack samples of external samplers to vstats
+#
+
+"""Import stack samples as vstats
+
+Two input formats are understood:
+
+    collapsed : one folded stack per line, root first, followed by its
+                sample count, e.g. 'main;run;parse 123', as written by
+                py-spy, stackcollapse-perf.pl and the like. Frames of the
+                form 'func (file:line)' keep their file and line.
+    perf      : output of 'perf script', a header line per sample followed
+                by one indented line per frame, leaf first, and a blank
+                line.
+
+Samples are streamed into a trie of stacks, so memory is bounded by the
+number of distinct stacks rather than by the size of the input. The trie
+is then folded into the 'partial' stats of vstatsmerge, where inline time
+of a function comes from the samples it is the leaf of, and its total time
+from the samples whose stack contains it, counted once per sample even if
+it recurses. callcount counts samples the same way.
+"""
+
+import os
+import re
+import sys
+from optparse import OptionParser
+
+import vProfile
+import vstatsmerge
+
+
+__all__ = ["sniff_format", "load_stacks", "StackTrie"]
+
+DEFAULT_SAMPLE_INTERVAL = 0.01   # seconds per sample
+
+_frame_pattern = re.compile(r'^(.*) \((.*):(\d+)\)$')
+_perf_frame_pattern = re.compile(r'^\s+[0-9a-fA-F]+\s+(.*?)(\+0x[0-9a-fA-F]+)?(\s+\(.*\))?$')
+
+
+class StackTrie:
+    """Trie of stacks, each node counts the samples ending at it
+
+    A node is a list [count, children], where children maps frame ids to
+    nodes; frames are interned to ids by 'frames'.
+    """
+
+    def __init__(self):
+        self.root = [0, {}]
+        self.frames = {}    # map: frame -> frame id
+        self.labels = []    # frame id -> frame
+
+    def add(self, stack, count=1):
+        # add samples of a stack, given as a list of frames, root first
+        node = self.root
+        frames = self.frames
+        for frame in stack:
+            frame_id = frames.get(frame)
+            if frame_id is None:
+                frame_id = frames[frame] = len(self.labels)
+                self.labels.append(frame)
+            children = node[1]
+            child = children.get(frame_id)
+            if child is None:
+                child = children[frame_id] = [0, {}]
+            node = child
+        node[0] += count
+
+    def to_partial(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        names = [_frame2key(frame) for frame in self.labels]
+        codes, entries = {}, {}
+        for frame, (name, label) in zip(self.labels, names):
+            codes[name] = label
+            entries[name] = [0, 0, 0.0, 0.0, {}]
+
+        # post-order walk with an explicit stack, so deep stacks are fine
+        #   on_path: map: key -> times it is on the current path
+        #   edges_on_path: map: (caller, callee) -> the same
+        on_path, edges_on_path = {}, {}
+        totals = {}
+        path = []   # keys of the functions on the current path
+        work = [(self.root, None, False)]
+        while work:
+            node, name, done = work.pop()
+            if not done:
+                if name is not None:
+                    caller = path[-1] if path else None
+                    path.append(name)
+                    on_path[name] = on_path.get(name, 0) + 1
+                    if caller is not None:
+                        edge = (caller, name)
+                        edges_on_path[edge] = edges_on_path.get(edge, 0) + 1
+                work.append((node, name, True))
+                for frame_id, child in node[1].iteritems():
+                    work.append((child, names[frame_id][0], False))
+                continue
+
+            total = node[0]
+            for child in node[1].itervalues():
+                total += totals.pop(id(child))
+            totals[id(node)] = total
+            if name is None:
+                continue
+
+            path.pop()
+            entry = entries[name]
+            entry[2] += node[0] * interval
+            on_path[name] -= 1
+            if not on_path[name]:  # outermost frame of the function
+                entry[0] += total
+                entry[3] += total * interval
+            if path:
+                caller = path[-1]
+                edge = (caller, name)
+                edges_on_path[edge] -= 1
+                if not edges_on_path[edge]:
+                    callees = entries[caller][4]
+                    if name not in callees:
+                        callees[name] = [0, 0.0]
+                    callees[name][0] += total
+                    callees[name][1] += total * interval
+        return codes, entries
+
+
+def _frame2key(frame):
+    # returns (vstats key, label) of a frame
+    match = _frame_pattern.match(frame)
+    if match:
+        funcname, filename, lineno = match.groups()
+        label = (filename, int(lineno), funcname)
+    else:
+        label = ('', 0, frame)
+    return intern(str(vProfile.fake_code(label))), label
+
+#__________________________________________________________________________
+# Readers
+
+
+def iter_collapsed(fp):
+    for line in fp:
+        line = line.rstrip()
+        if not line:
+            continue
+        stack, _, count = line.rpartition(' ')
+        if not stack or not count.isdigit():
+            continue
+        yield stack.split(';'), int(count)
+
+
+def iter_perf(fp):
+    stack = []
+    for line in fp:
+        if not line.strip():
+            if stack:
+                stack.reverse()
+                yield stack, 1
+                stack = []
+            continue
+        if not line[0].isspace():
+            continue  # header of a sample
+        match = _perf_frame_pattern.match(line.rstrip())
+        if match:
+            stack.append(match.group(1))
+    if stack:
+        stack.reverse()
+        yield stack, 1
+
+
+_readers = {
+    'collapsed': iter_collapsed,
+    'perf': iter_perf,
+}
+
+
+def sniff_format(filename, max_lines=32):
+    # guess the format of a stack sample file, returns None if unknown
+    fp = open(filename, 'r')
+    try:
+        head = fp.read(65536)
+    finally:
+        fp.close()
+    lines = [line for line in head.splitlines() if line.strip()]
+    lines = lines[:max_lines]
+    if len(head) == 65536 and len(lines) > 1:
+        lines = lines[:-1]  # may be cut off
+    if not lines:
+        return None
+
+    if not lines[0][0].isspace() and len(lines) > 1 \
+            and _perf_frame_pattern.match(lines[1]):
+        return 'perf'
+    for line in lines:
+        stack, _, count = line.rpartition(' ')
+        if not stack or not count.isdigit() or line[0].isspace():
+            return None
+    return 'collapsed'
+
+
+def load_stacks(filename, format=None, interval=DEFAULT_SAMPLE_INTERVAL):
+    format = format or sniff_format(filename)
+    if format not in _readers:
+        raise ValueError('not a stack sample file: %s' % filename)
+
+    trie = StackTrie()
+    fp = open(filename, 'r')
+    try:
+        for stack, count in _readers[format](fp):
+            trie.add(stack, count)
+    finally:
+        fp.close()
+    return vstatsmerge.partial2vstats(trie.to_partial(interval))
+
+
+def main():
+    usage = "%s [-f format] [-i interval] -o output_file_path stack_file"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    parser.add_option('-o', '--outfile', dest="outfile",
+                      help="save stats to <outfile>", default=None)
+    parser.add_option('-f', '--format', dest="format",
+                      type="choice", choices=sorted(_readers),
+                      help="format of the input, guessed if not given",
+                      default=None)
+    parser.add_option('-i', '--interval', dest="interval", type="float",
+                      help="seconds per sample, defaults to %g"
+                           % DEFAULT_SAMPLE_INTERVAL,
+                      default=DEFAULT_SAMPLE_INTERVAL)
+
+    options, args = parser.parse_args()
+    if not options.outfile or len(args) != 1:
+        parser.print_usage()
+        sys.exit(2)
+
+    vstats = load_stacks(args[0], options.format, options.interval)
+    vProfile.dump_vstats(vstats, options.outfile)
+
+if __name__ == '__main__':
+    sys.exit(main())
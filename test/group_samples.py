@@ -0,0 +1,57 @@
+##
+#   Checks the roll-up of vstatsgroups on the sample profiles of this
+#   directory, which were recorded on Windows
+#
+#   Exits with 1 if a group is not as expected.
+##
+
+
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import vProfile
+import vstatsgroups
+
+
+# (file, level, depth, groups expected, or a part of them)
+CASES = (
+    ('test.cprof', 'package', 1,
+     ['<built-in>', 'codecs', 'duptest', 'encodings', 'genericpath', 'json',
+      're', 'sre_compile', 'sre_parse']),
+    ('test.cprof', 'module', 1,
+     ['<built-in>', 'codecs', 'duptest', 'encodings', 'encodings.hex_codec',
+      'genericpath', 'json', 'json.decoder', 'json.encoder', 'json.scanner',
+      're', 'sre_compile', 'sre_parse']),
+    ('profviz.vstats', 'package', 1,
+     ['<built-in>', 'avatarmembers', 'com', 'engine', 'entities', 'redirect']),
+    ('profviz.vstats', 'module', 2,
+     ['com.data.MissionData', 'entities.components.AIComp', 'GameWorld']),
+)
+
+
+def load(filename):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    try:
+        return vProfile.load_vstats(path)
+    except ValueError:
+        return vProfile.pstats2vstats(vProfile.load_pstats(path))
+
+
+def main():
+    failed = False
+    for filename, level, depth, expected in CASES:
+        groups = sorted(vstatsgroups.rollup(load(filename), level, depth)[0])
+        missing = [name for name in expected if name not in groups]
+        drives = [name for name in groups if ':' in name]
+        exact = len(expected) > 6   # the groups of test.cprof are all listed
+        if missing or drives or (exact and groups != sorted(expected)):
+            print '%s by %s (depth %d): %s' % (filename, level, depth, ', '.join(groups))
+            failed = True
+    print 'failed' if failed else 'ok'
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+##
+#   Loopback harness for remote profiling: a busy worker thread stands in
+#   for the remote process, and a client connects to its agent over the
+#   loopback interface
+##
+
+
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import vProfile
+import vRemote
+
+
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+
+def work(stopped):
+    while not stopped.is_set():
+        fib(18)
+        time.sleep(0.001)
+
+
+def main():
+    stopped = threading.Event()
+    worker = threading.Thread(target=work, name='worker', args=(stopped,))
+    worker.start()
+
+    agent = vProfile.start_agent('127.0.0.1', 0)
+    client = vRemote.RemoteClient(*agent.address)
+    client.start(0.001)
+
+    for i in xrange(3):
+        while not client.poll(1.0):
+            pass
+        vstats = client.vstats()
+        summary = vProfile.vstats_summary(vstats)
+        print 'Snapshot %d: %d funcs, %.3fs' % (i, len(vstats), summary)
+
+    client.stop()
+    client.close()
+    stopped.set()
+    worker.join()
+    agent.stop()
+
+    funcs = sorted(vstats, key=lambda func: vstats[func].totaltime, reverse=True)
+    for func in funcs[:5]:
+        entry = vstats[func]
+        print '%8.3f %8.3f  %s' % (entry.totaltime, entry.inlinetime, func)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
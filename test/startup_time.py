@@ -0,0 +1,94 @@
+##
+#   Startup benchmark of ProfViz: time to import it and to show an empty
+#   main window, in fresh interpreters, and the modules loaded by then
+#
+#   Exits with 1 if the median time to window is above --max (DEFAULT_MAX
+#   seconds unless given), or if a module meant to be loaded on first use (LAZY_MODULES) is loaded at
+#   startup, so startup regressions can be checked from scripts.
+##
+
+
+import os
+import sys
+import json
+import subprocess
+from optparse import OptionParser
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# time to an empty main window deemed a regression, in seconds
+DEFAULT_MAX = 1.0
+
+# modules of dialogs, tools and loaders, imported when first used
+LAZY_MODULES = ('ImageViewer', 'vstats2dot', 'vstatsgroups', 'vstatscycles',
+                'vstatspaths', 'vstatsflame', 'vstatsstore', 'vstatsfilter',
+                'vstatscache', 'vstatsmerge', 'vstatsdiff', 'vRemote',
+                'vLineProfile', 'callgrind2vstats', 'stacks2vstats',
+                'numpy', 'sqlite3')
+
+CHILD = r'''
+import sys, time, json
+start = time.time()
+sys.path.insert(0, %r)
+import ProfViz
+imported = time.time()
+app = ProfViz.QApplication(sys.argv)
+window = ProfViz.MyWindow()
+window.show()
+app.processEvents()
+shown = time.time()
+print json.dumps({'import': imported - start, 'window': shown - start,
+                  'modules': sorted(sys.modules)})
+'''
+
+
+def run_once():
+    import time
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', CHILD % ROOT])
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process'] = time.time() - start
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    usage = "%s [-n repeat] [--max seconds]"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    parser.add_option('-n', '--repeat', dest="repeat", type="int",
+                      help="number of runs, defaults to 5", default=5)
+    parser.add_option('--max', dest="max", type="float",
+                      help="fail if the median time to window is above <seconds>, "
+                           "defaults to %.1f, 0 to disable" % DEFAULT_MAX,
+                      default=DEFAULT_MAX)
+
+    options, args = parser.parse_args()
+    if args:
+        parser.print_usage()
+        sys.exit(2)
+
+    results = [run_once() for _ in xrange(max(options.repeat, 1))]
+    for name in ('import', 'window', 'process'):
+        times = [result[name] for result in results]
+        print '%-8s median %7.1f ms  min %7.1f ms  max %7.1f ms' % (
+            name, 1000 * median(times), 1000 * min(times), 1000 * max(times))
+
+    failed = False
+    modules = set(results[0]['modules'])
+    eager = [name for name in LAZY_MODULES if name in modules]
+    if eager:
+        print 'loaded at startup: %s' % ', '.join(eager)
+        failed = True
+    window = median([result['window'] for result in results])
+    if options.max and window > options.max:
+        print 'time to window %.1f ms is above %.1f ms' % (1000 * window, 1000 * options.max)
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
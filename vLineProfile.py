@@ -0,0 +1,315 @@
+#! /usr/bin/env python
+#
+#  Module for profiling the lines of Python functions
+#
+
+"""Line-level timing as a companion of vstats
+
+A LineProfile hooks sys.settrace (and threading.settrace for new threads),
+and counts the hits and times of every line of the functions it traces.
+Line times are wall clock times from the line event of a line to the next
+event in the same frame, so they include the time of the calls made on
+the line.
+
+Counters are kept in two flat arrays per code object, hits and times,
+indexed by the line number relative to co_firstlineno. Code of the
+standard library and the files of the profiler itself are not traced by
+default; site-packages are, even where they sit in the standard library.
+
+Tracing every line is expensive. If a budget is given, the cost of a line
+event is calibrated at enable(), and whenever the estimated overhead
+exceeds 'budget' times the time spent outside the tracer, the code object
+with the most line events since the last check stops being traced; its
+counters so far are kept.
+
+Line stats are saved next to the vstats they go with, as JSON of
+    {vstats key: [filename, firstlineno, hits, times]}
+in the file named by line_stats_file().
+"""
+
+import os
+import sys
+import dis
+import json
+import array
+import site
+import threading
+from timeit import default_timer as timer
+from distutils import sysconfig
+from optparse import OptionParser
+
+import vProfile
+
+
+__all__ = ["LineProfile", "line_stats_file", "load_line_stats",
+           "dump_line_stats", "print_line_stats", "LINES_SUFFIX"]
+
+LINES_SUFFIX = '.lines'
+
+CHECK_INTERVAL = 100000     # line events between checks of the budget
+
+
+def line_stats_file(filename):
+    # file of the line stats going with the stats file 'filename'
+    return filename + LINES_SUFFIX
+
+
+def load_line_stats(filename):
+    fp = open(filename, 'r')
+    try:
+        return json.load(fp)
+    finally:
+        fp.close()
+
+
+def dump_line_stats(line_stats, filename):
+    fp = open(filename, 'w', 1 << 16)
+    try:
+        json.dump(line_stats, fp)
+    finally:
+        fp.close()
+
+
+def print_line_stats(line_stats, stream=None):
+    # print the hit lines of each function, the most expensive one first
+    stream = stream or sys.stdout
+    for key in sorted(line_stats, key=lambda k: -sum(line_stats[k][3])):
+        filename, first, hits, times = line_stats[key]
+        print >> stream, '%s  %.3fs' % (key, sum(times))
+        for i, (nhits, time) in enumerate(zip(hits, times)):
+            if nhits:
+                print >> stream, '%8d %10d %10.6f' % (first + i, nhits, time)
+        print >> stream
+
+
+def _normdir(path):
+    return os.path.join(os.path.normcase(os.path.abspath(path)), '')
+
+
+def _site_dirs():
+    # directories of third-party packages, e.g. site-packages under the
+    # standard library on Windows or in virtualenvs
+    dirs = [sysconfig.get_python_lib(), sysconfig.get_python_lib(plat_specific=True)]
+    for getter in ('getsitepackages', 'getusersitepackages'):
+        try:
+            found = getattr(site, getter)()
+        except AttributeError:  # not in the site.py of old virtualenvs
+            continue
+        dirs.extend([found] if isinstance(found, basestring) else found)
+    return tuple(set(_normdir(d) for d in dirs))
+
+
+def _own_files():
+    # the profiler's files, without extensions, so .pyc files match too
+    return frozenset(os.path.splitext(os.path.normcase(os.path.abspath(f)))[0]
+                     for f in (__file__, vProfile.__file__))
+
+
+def _default_filter(code, stdlib=_normdir(sysconfig.get_python_lib(standard_lib=True)),
+                    site_dirs=_site_dirs(), own_files=_own_files()):
+    filename = code.co_filename
+    if filename.startswith('<'):
+        return False
+    path = os.path.normcase(os.path.abspath(filename))
+    if os.path.splitext(path)[0] in own_files:
+        return False
+    return not path.startswith(stdlib) or path.startswith(site_dirs)
+
+
+class LineProfile:
+    def __init__(self, filter=None, budget=None):
+        self.filter = filter or _default_filter
+        self.budget = budget    # max overhead / time outside the tracer
+        self.event_cost = 0.0   # seconds per line event, see calibrate()
+
+        self.tracers = []       # a _LineTracer per thread
+        self.dropped = set()    # code objects dropped by the budget
+        self._next_check = CHECK_INTERVAL
+        self._last_hits = {}    # map: code object -> hits at the last check
+        self._lock = threading.Lock()
+        self._start = None
+
+    def enable(self):
+        if self.budget is not None and not self.event_cost:
+            self.event_cost = self.calibrate()
+        self._start = timer()
+        threading.settrace(self._attach)
+        sys.settrace(self._new_tracer().trace_call)
+
+    def disable(self):
+        sys.settrace(None)
+        threading.settrace(None)
+        for tracer in self.tracers:
+            tracer.frames.clear()
+
+    def _attach(self, frame, event, arg):
+        # installed by threading.settrace, called once in every new thread
+        # to replace itself by a tracer of the thread
+        tracer = self._new_tracer()
+        sys.settrace(tracer.trace_call)
+        return tracer.trace_call(frame, event, arg)
+
+    def _new_tracer(self):
+        tracer = _LineTracer(self)
+        self._lock.acquire()
+        try:
+            self.tracers.append(tracer)
+        finally:
+            self._lock.release()
+        return tracer
+
+    @staticmethod
+    def calibrate(loops=20000):
+        # estimate the cost of a line event, in seconds
+        def __loop(n):
+            x = 0
+            for i in xrange(n):
+                x += i
+            return x
+
+        start = timer()
+        __loop(loops)
+        plain = timer() - start
+
+        tracer = LineProfile(filter=lambda code: code is __loop.func_code)._new_tracer()
+        sys.settrace(tracer.trace_call)
+        start = timer()
+        __loop(loops)
+        traced = timer() - start
+        sys.settrace(None)
+        return max(traced - plain, 0.0) / max(tracer.events, 1)
+
+    def check_budget(self):
+        # called by the tracers every CHECK_INTERVAL line events of theirs
+        if self.budget is None or not self._lock.acquire(False):
+            return
+        try:
+            events = sum(tracer.events for tracer in self.tracers)
+            if events < self._next_check:
+                return
+            self._next_check = events + CHECK_INTERVAL
+            overhead = events * self.event_cost
+            elapsed = timer() - self._start
+            if overhead <= self.budget * max(elapsed - overhead, 0.0):
+                return
+
+            # drop the code object with the most line events since the
+            # last check
+            totals = {}
+            for tracer in self.tracers:
+                for code, record in tracer.records.items():
+                    if record is not None and record[3]:
+                        totals[code] = totals.get(code, 0) + sum(record[1])
+            hottest, hottest_hits = None, 0
+            for code, total in totals.iteritems():
+                hits = total - self._last_hits.get(code, 0)
+                self._last_hits[code] = total
+                if hits > hottest_hits:
+                    hottest, hottest_hits = code, hits
+            if hottest is not None:
+                self.dropped.add(hottest)
+                for tracer in self.tracers:
+                    record = tracer.records.get(hottest)
+                    if record is not None:
+                        record[3] = False
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        line_stats = {}
+        for tracer in self.tracers:
+            for code, record in tracer.records.items():
+                if record is None:
+                    continue
+                first, hits, times, _ = record
+                label = (code.co_filename, first, code.co_name)
+                key = str(vProfile.fake_code(label))
+                if key in line_stats:   # other threads, or lambdas on a line
+                    old = line_stats[key]
+                    for i in xrange(min(len(old[2]), len(hits))):
+                        old[2][i] += hits[i]
+                        old[3][i] += times[i]
+                else:
+                    line_stats[key] = [code.co_filename, first,
+                                       hits.tolist(), times.tolist()]
+        return line_stats
+
+    def dump_stats(self, filename):
+        dump_line_stats(self.get_stats(), filename)
+
+    def print_stats(self, stream=None):
+        print_line_stats(self.get_stats(), stream)
+
+
+class _LineTracer:
+    # trace functions and counters of one thread
+
+    def __init__(self, profile):
+        self.profile = profile
+        # map: code object -> [firstlineno, hits, times, enabled] or None
+        self.records = {}
+        self.frames = {}        # map: frame -> (record, line index, time)
+        self.events = 0
+        self._next_check = CHECK_INTERVAL
+
+    def trace_call(self, frame, event, arg):
+        code = frame.f_code
+        try:
+            record = self.records[code]
+        except KeyError:
+            record = self.records[code] = self._new_record(code)
+        if record is None or not record[3]:
+            return None
+        return self.trace_line
+
+    def _new_record(self, code):
+        if not self.profile.filter(code):
+            return None
+        first = code.co_firstlineno
+        last = max([lineno for _, lineno in dis.findlinestarts(code)] + [first])
+        size = last - first + 1
+        return [first, array.array('l', [0]) * size,
+                array.array('d', [0.0]) * size,
+                code not in self.profile.dropped]
+
+    def trace_line(self, frame, event, arg):
+        now = timer()
+        state = self.frames.get(frame)
+        if state is not None:
+            record, index, start = state
+            record[2][index] += now - start
+        else:
+            record = self.records[frame.f_code]
+
+        if event == 'line':
+            if not record[3]:   # dropped by the budget
+                self.frames.pop(frame, None)
+                return None
+            index = frame.f_lineno - record[0]
+            if not 0 <= index < len(record[1]):
+                return self.trace_line
+            record[1][index] += 1
+            self.events += 1
+            if self.events >= self._next_check:
+                self._next_check = self.events + CHECK_INTERVAL
+                self.profile.check_budget()
+            self.frames[frame] = (record, index, timer())
+        elif event == 'return':
+            self.frames.pop(frame, None)
+        elif state is not None:
+            self.frames[frame] = (record, state[1], timer())
+        return self.trace_line
+
+
+def main():
+    usage = "%s stats_file.lines"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_usage()
+        sys.exit(2)
+
+    print_line_stats(load_line_stats(args[0]))
+
+if __name__ == '__main__':
+    sys.exit(main())
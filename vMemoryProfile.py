@@ -0,0 +1,297 @@
+#! /usr/bin/env python
+#
+#  Module for profiling memory allocations of Python functions
+#
+
+"""Memory stats in the vstats schema
+
+A MemoryProfile traces allocations with tracemalloc (part of the standard
+library since Python 3.4, and of pytracemalloc for Python 2.7), and takes
+snapshots of the traced memory at an interval from a thread of its own.
+Between two snapshots, the growth of the memory allocated by a traceback
+is attributed to the functions on the traceback, the way StackSampler of
+vRemote attributes samples:
+
+    inlinetime : bytes allocated by the function itself
+    totaltime  : bytes allocated by the function and its callees
+    callcount  : number of blocks allocated, the same way
+    callees    : blocks and bytes allocated by calls to each callee
+
+Frames of tracemalloc only tell files and lines, so they are mapped to the
+innermost code object around the line, which gives the same vstats keys
+as cProfile. Lines outside every known function belong to '<module>'.
+
+Memory allocated and freed between two snapshots is not seen, so the
+interval trades overhead for accuracy.
+
+The peak of a function is the largest amount of memory held by the
+function and its callees in any snapshot. Memory stats are saved as
+    {MEMORY_KEY: vstats, PEAKS_KEY: {vstats key: peak in bytes}}
+so they are never taken for stats of time.
+"""
+
+import sys
+import gc
+import dis
+import time
+import types
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import vProfile
+import vstatsmerge
+
+
+__all__ = ["MemoryProfile", "CodeIndex"]
+
+DEFAULT_SNAPSHOT_INTERVAL = 0.1
+DEFAULT_NFRAMES = 64
+
+# tracemalloc lists frames from the oldest one since Python 3.7
+_OLDEST_FRAME_FIRST = sys.version_info >= (3, 7)
+
+
+class CodeIndex:
+    """Map (filename, lineno) to the vstats key of the innermost function"""
+
+    def __init__(self):
+        self._codes = {}    # map: filename -> [(first, last, label)]
+        self._keys = {}     # map: (filename, lineno, outer) -> (key, label)
+        self._scanned = False
+
+    def lookup(self, filename, lineno, outer=0):
+        """Return (vstats key, label) of the function around a line
+
+        outer skips that many of the innermost functions around the line,
+        e.g. 1 for the caller of a generator expression on the same line.
+        """
+        result = self._keys.get((filename, lineno, outer))
+        if result is None:
+            if filename not in self._codes and not self._scanned:
+                self.scan()
+            labels = [code_label for first, last, code_label
+                      in self._codes.get(filename, ()) if first <= lineno <= last]
+            labels.sort(key=lambda label: label[1], reverse=True)
+            labels.append((filename, 1, '<module>'))
+            label = labels[min(outer, len(labels) - 1)]
+            result = (intern(str(vProfile.fake_code(label))), label)
+            self._keys[(filename, lineno, outer)] = result
+        return result
+
+    def scan(self):
+        # index the code objects of all living functions
+        self._scanned = True
+        codes = set()
+        for obj in gc.get_objects():
+            if isinstance(obj, types.FunctionType):
+                _collect_codes(obj.func_code, codes)
+        self._codes = {}
+        for code in codes:
+            lines = [lineno for _, lineno in dis.findlinestarts(code)]
+            label = (code.co_filename, code.co_firstlineno, code.co_name)
+            self._codes.setdefault(code.co_filename, []).append(
+                (code.co_firstlineno, max(lines + [code.co_firstlineno]), label))
+
+    def refresh(self):
+        # let the next lookup of an unknown file scan again
+        self._scanned = False
+
+
+def _collect_codes(code, codes):
+    work = [code]
+    while work:
+        code = work.pop()
+        if code in codes:
+            continue
+        codes.add(code)
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                work.append(const)
+
+
+class MemoryProfile:
+    def __init__(self, interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 nframes=DEFAULT_NFRAMES):
+        self.interval = interval
+        self.nframes = nframes
+        self.codes, self.entries = {}, {}   # partial stats
+        self.peaks = {}         # map: vstats key -> peak in bytes
+        self.index = CodeIndex()
+        self._last = {}         # map: traceback -> (size, count) last seen
+        self._stacks = {}       # map: traceback -> vstats keys, leaf first
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self.stats = None
+
+    def enable(self):
+        if tracemalloc is None:
+            raise RuntimeError('memory profiling requires tracemalloc')
+        tracemalloc.start(self.nframes)
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='vProfile-memory')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def disable(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            self.take_snapshot()
+            tracemalloc.stop()
+
+    def _run(self):
+        while self._running:
+            self.take_snapshot()
+            time.sleep(self.interval)
+
+    def take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        self.add_statistics((stat.traceback, stat.size, stat.count)
+                            for stat in snapshot.statistics('traceback'))
+
+    def add_statistics(self, statistics):
+        """Account a snapshot given as (traceback, size, count) tuples
+
+        A traceback is a sequence of frames with 'filename' and 'lineno',
+        ordered as tracemalloc orders them.
+        """
+        self._lock.acquire()
+        try:
+            self.index.refresh()
+            live = {}
+            last, current = self._last, {}
+            for traceback, size, count in statistics:
+                stack = self._stack(traceback)
+                if stack is None:
+                    continue
+                current[traceback] = (size, count)
+                old_size, old_count = last.get(traceback, (0, 0))
+                if size > old_size:
+                    self._attribute(stack, size - old_size,
+                                    max(count - old_count, 0))
+                for name in set(stack):
+                    live[name] = live.get(name, 0) + size
+            self._last = current
+
+            peaks = self.peaks
+            for name, size in live.iteritems():
+                if size > peaks.get(name, 0):
+                    peaks[name] = size
+        finally:
+            self._lock.release()
+
+    def _stack(self, traceback):
+        # vstats keys of a traceback, leaf first, cut at runctx(), or None
+        # for memory allocated by the profiler itself
+        try:
+            return self._stacks[traceback]
+        except KeyError:
+            pass
+        frames = list(traceback)
+        if _OLDEST_FRAME_FIRST:
+            frames.reverse()
+        functions = []
+        last, outer = None, 0
+        for frame in frames:
+            if frame.filename == _THIS_FILE:
+                if frame.lineno not in _RUNCTX_LINES:
+                    self._stacks[traceback] = None
+                    return None
+                break
+            # the caller of a comprehension or a lambda is on the same line
+            # as the code it calls, but outside of it
+            where = (frame.filename, frame.lineno)
+            if where == last and functions[-1][1][1] == frame.lineno:
+                outer += 1
+            else:
+                outer = 0
+            last = where
+            functions.append(self.index.lookup(frame.filename, frame.lineno,
+                                               outer))
+
+        stack = []
+        for name, label in functions:
+            if name not in self.entries:
+                self.codes[name] = label
+                self.entries[name] = [0, 0, 0, 0, {}]
+            stack.append(name)
+        self._stacks[traceback] = stack
+        return stack
+
+    def _attribute(self, stack, size, count):
+        if not stack:
+            return
+        entries = self.entries
+        entries[stack[0]][2] += size    # the leaf allocates inline
+        seen, calls = set(), set()
+        callee = None
+        for name in stack:
+            entry = entries[name]
+            if name not in seen:
+                seen.add(name)
+                entry[0] += count
+                entry[3] += size
+            if callee is not None and (name, callee) not in calls:
+                calls.add((name, callee))
+                edge = entry[4].get(callee)
+                if edge is None:
+                    entry[4][callee] = [count, size]
+                else:
+                    edge[0] += count
+                    edge[1] += size
+            callee = name
+
+    def get_stats(self):
+        self._lock.acquire()
+        try:
+            vstats = vstatsmerge.partial2vstats((self.codes, self.entries))
+            peaks = dict(self.peaks)
+        finally:
+            self._lock.release()
+        self.stats = {vProfile.MEMORY_KEY: vstats, vProfile.PEAKS_KEY: peaks}
+        return self.stats
+
+    def print_stats(self, sort=-1):
+        stats = self.get_stats()
+        vstats, peaks = stats[vProfile.MEMORY_KEY], stats[vProfile.PEAKS_KEY]
+        print '%10s %12s %12s %12s  %s' % ('nalloc', 'bytes', 'cumbytes',
+                                           'peak', 'function')
+        for func in sorted(vstats, key=lambda f: -vstats[f].totaltime):
+            entry = vstats[func]
+            print '%10d %12d %12d %12d  %s' % (entry.callcount,
+                                               entry.inlinetime,
+                                               entry.totaltime,
+                                               peaks.get(func, 0), func)
+
+    def dump_stats(self, filename):
+        vProfile.dump_vstats(self.get_stats(), filename)
+
+    def run(self, cmd):
+        import __main__
+        dict = __main__.__dict__
+        return self.runctx(cmd, dict, dict)
+
+    def runctx(self, cmd, globals, locals):
+        self.enable()
+        try:
+            exec cmd in globals, locals
+        finally:
+            self.disable()
+        return self
+
+
+# frames of this module on a traceback are those of the profiler, except
+# the frame of runctx() running the profiled code
+_THIS_FILE = MemoryProfile.runctx.im_func.func_code.co_filename
+_RUNCTX_LINES = frozenset(lineno for _, lineno in dis.findlinestarts(
+    MemoryProfile.runctx.im_func.func_code))
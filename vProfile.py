@@ -19,13 +19,19 @@ A note on naming:
 import sys
 import os
 import json
+import threading
 from optparse import OptionParser
 
 
-__all__ = ["load_pstats", "loads_pstats", "load_vstats", "loads_vstats"
-           "dump_vstats", "pstats2vstats", "vstats2callermap", "vstats_summary",
+__all__ = ["load_pstats", "loads_pstats", "load_vstats", "loads_vstats",
+           "dump_vstats", "export_vstats", "pstats2vstats", "prune_vstats", "OTHER_NAME",
+           "vstats2callermap", "vstats_summary",
+           "callee_totaltime",
+           "merge_vstats", "is_thread_vstats", "THREADS_KEY",
+           "is_memory_vstats", "MEMORY_KEY", "PEAKS_KEY",
            "simple_code_format", "simple_funcname",
-           "run", "runctx", "Profile"]
+           "run", "runctx", "Profile", "ThreadProfile",
+           "profile_children", "profile_child", "child_outfile", "start_agent", "hot_paths"]
 
 #__________________________________________________________________________
 # Utility classes
@@ -87,7 +93,7 @@ class fake_subentry:
 
 class json_encoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, (fake_code, fake_entry, fake_subentry)):
+        if isinstance(obj, (fake_code, fake_entry, fake_entry2, fake_subentry)):
             return obj.__dict__ 
         elif isinstance(obj, tuple):
             return list(obj)
@@ -144,17 +150,72 @@ def loads_vstats(content):
 
 
 def dump_vstats(vstats, filename):
-    fp = open(filename, 'w')
+    # json.dump writes the chunks of its encoder as they are produced
+    fp = open(filename, 'w', 1 << 16)
     try:
         json.dump(vstats, fp, cls=json_encoder)
     finally:
         fp.close()
 
 
-def pstats2vstats(stats):
-    # convert pstats to vstats
+def export_vstats(vstats, filename, format='vstats'):
+    # save vstats as 'vstats', or as 'speedscope' or 'chrome' trace events
+    if format == 'vstats':
+        dump_vstats(vstats, filename)
+        return
+    import vstats2trace
+    if format == 'speedscope':
+        vstats2trace.dump_speedscope(vstats, filename)
+    elif format == 'chrome':
+        vstats2trace.dump_chrome_trace(vstats, filename)
+    else:
+        raise ValueError('unknown stats format: %s' % format)
+
+
+def without_gc(function):
+    # run 'function' with the cyclic garbage collector paused; converting
+    # stats allocates millions of objects, none of them in cycles, and the
+    # collections they trigger would take longer than the conversion
+    import functools
+
+    @functools.wraps(function)
+    def __wrapper(*args, **kwargs):
+        import gc
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if enabled:
+                gc.enable()
+    return __wrapper
+
+
+@without_gc
+def pstats2vstats(stats, top=None, min_pct=None):
+    # convert pstats to vstats, keeping only the 'top' functions by cumtime
+    # and those above 'min_pct' percent of the summary if asked to, see
+    # prune_vstats; pruned functions are never converted
+    kept = None
+    if top is not None or min_pct is not None:
+        kept = _kept_funcs(dict((func, item[3]) for func, item in stats.iteritems()),
+                           top, min_pct)
+
     vstats, callee_map = {}, {}
+    others = {}     # map: caller -> [callcount, totaltime] of pruned callees
     for func, (cc, nc, tt, ct, callers) in stats.iteritems():
+        if kept is not None and func not in kept:
+            for caller, caller_stats in callers.iteritems():
+                if caller not in kept:
+                    continue
+                if isinstance(caller_stats, tuple):   # for cProfile results
+                    callcount, totaltime = caller_stats[0], caller_stats[3]
+                else:   # estimated by the time per call, see callee_totaltime
+                    callcount, totaltime = caller_stats, ct * caller_stats / max(nc, 1)
+                other = others.setdefault(caller, [0, 0.0])
+                other[0] += callcount
+                other[1] += totaltime
+            continue
         stats_item = (func, cc, nc, tt, ct)
         entry = fake_entry(stats_item)
         name = str(entry.code)
@@ -164,10 +225,77 @@ def pstats2vstats(stats):
             if not callee_map.has_key(caller_name):
                 callee_map[caller_name] = {}
             callee_map[caller_name][name] = caller_stats
+
+    for caller, (callcount, totaltime) in others.iteritems():
+        entry = _other_entry(fake_code(caller), callcount, totaltime)
+        name = str(entry.code)
+        vstats[name] = entry
+        callee_map.setdefault(str(fake_code(caller)), {})[name] = \
+            (callcount, callcount, totaltime, totaltime)
     _update_callees(vstats, callee_map)
     return vstats
 
 
+# name of the entries standing for the pruned callees of a caller
+OTHER_NAME = '<other>'
+
+
+def _other_entry(caller_code, callcount, totaltime):
+    # the entry of the pruned callees of a caller, located at the caller so
+    # that every caller has its own
+    if caller_code.co_filename:
+        code = fake_code((caller_code.co_filename, caller_code.co_firstlineno, OTHER_NAME))
+    else:   # a built-in caller
+        code = fake_code(('', 0, '%s of %s' % (OTHER_NAME, caller_code.co_name)))
+    return fake_entry2(code, callcount, 0, totaltime, totaltime, {})
+
+
+def _kept_funcs(cumtimes, top=None, min_pct=None):
+    # funcs among the 'top' by cumtime and above 'min_pct' percent of the
+    # largest cumtime; cumtimes: map: func -> cumtime
+    kept = cumtimes
+    if min_pct is not None:
+        limit = max(cumtimes.itervalues()) * min_pct / 100.0 if cumtimes else 0.0
+        kept = dict((func, ct) for func, ct in kept.iteritems() if ct >= limit)
+    if top is not None and len(kept) > top:
+        import heapq
+        kept = heapq.nlargest(top, kept, key=kept.get)
+    return set(kept)
+
+
+def prune_vstats(vstats, top=None, min_pct=None):
+    """Keep the 'top' functions by cumtime, and those above 'min_pct'
+    percent of the summary
+
+    The calls of a kept function to pruned functions are folded into one
+    '<other>' callee per caller, whose inline and total times are the
+    times of the calls, so the times of kept functions still add up.
+    Calls of pruned functions are dropped.
+    """
+    kept = _kept_funcs(dict((func, entry.totaltime) for func, entry in vstats.iteritems()),
+                       top, min_pct)
+    result = {}
+    for func in kept:
+        entry = vstats[func]
+        callees, other = {}, None
+        for callee, subentry in entry.callees.iteritems():
+            if callee in kept:
+                callees[callee] = fake_subentry(subentry.callcount, subentry.totaltime)
+            elif callee in vstats:
+                if other is None:
+                    other = [0, 0.0]
+                other[0] += subentry.callcount
+                other[1] += callee_totaltime(subentry, vstats[callee])
+        if other is not None:
+            other_entry = _other_entry(entry.code, other[0], other[1])
+            name = str(other_entry.code)
+            result[name] = other_entry
+            callees[name] = fake_subentry(other[0], other[1])
+        result[func] = fake_entry2(entry.code, entry.callcount, entry.reccallcount,
+                                   entry.inlinetime, entry.totaltime, callees)
+    return result
+
+
 def _update_callees(vstats, callee_map):
     for caller, callees in callee_map.iteritems():
         if caller not in vstats:
@@ -175,29 +303,49 @@ def _update_callees(vstats, callee_map):
         entry = vstats[caller]
         entry.callees = callees
         
-        t_sum = 0.0
         for callee, xstats in callees.iteritems():
             callcount, totaltime = xstats, -1.0 
             if isinstance(xstats, (tuple)):  # for cProfile results
                 callcount = xstats[0]
                 totaltime = xstats[3]
-            t_sum += totaltime
             callees[callee] = fake_subentry(callcount, totaltime)
 
-        # test if there exist recursive calls
-        if t_sum < 0 or _test_greater(t_sum, entry.totaltime - entry.inlinetime):
-            # print caller, t_sum, entry.totaltime, entry.inlinetime
-            for callee in callees:
-                # we are in a case where there exist recursive calls, and we mark
-                # total time that the callee spent when called by the caller
-                # 'unknown' for simplicity. 
-                callees[callee].totaltime = -1.0 # unknown
+        _check_recursive_callees(entry)
+
+
+def _check_recursive_callees(entry):
+    t_sum = 0.0
+    for subentry in entry.callees.itervalues():
+        if subentry.totaltime < 0:
+            t_sum = -1.0
+            break
+        t_sum += subentry.totaltime
+
+    # test if there exist recursive calls
+    if t_sum < 0 or _test_greater(t_sum, entry.totaltime - entry.inlinetime):
+        # print caller, t_sum, entry.totaltime, entry.inlinetime
+        for subentry in entry.callees.itervalues():
+            # we are in a case where there exist recursive calls, and we mark
+            # total time that the callee spent when called by the caller
+            # 'unknown' for simplicity. 
+            subentry.totaltime = -1.0 # unknown
 
 
 def _test_greater(x, y, rel_tol=1e-6):
     return x - y > max(x, y) * rel_tol
 
 
+def callee_totaltime(subentry, callee_entry):
+    # get total time that a callee spent when called by a caller, estimated
+    # by the callee's time per call if it is 'unknown' for recursive calls
+    if subentry.totaltime >= 0:
+        return subentry.totaltime
+    if callee_entry.callcount > 0:
+        return (callee_entry.totaltime * subentry.callcount
+                / callee_entry.callcount)
+    return 0.0
+
+
 def vstats2callermap(vstats):
     # get the dict that maps a callee to a list of its callers
     caller_map = {}
@@ -209,6 +357,73 @@ def vstats2callermap(vstats):
     return caller_map
 
 
+def hot_paths(vstats, k=10, root=None, min_fraction=0.0, max_expansions=None):
+    """Get the k heaviest call paths of vstats, from root if given
+
+    Returns a list of (time, [func, ...]), heaviest first, where a path
+    starts at a function nobody calls, or at root, and its time is the
+    estimated inline time of its last function on the path. Paths lighter
+    than min_fraction of the roots' time are not followed, and the search
+    stops after max_expansions steps, see vstatspaths.py.
+    """
+    import vstatspaths
+    if max_expansions is None:
+        max_expansions = vstatspaths.DEFAULT_MAX_EXPANSIONS
+    return vstatspaths.hot_paths(vstats, k, root, min_fraction, max_expansions)
+
+
+def merge_vstats(vstats_list):
+    # sum up entries and callees of several vstats into a new vstats
+    result = {}
+    for vstats in vstats_list:
+        _merge_into(result, vstats)
+    return result
+
+
+def _merge_into(dst, src):
+    for func, entry in src.iteritems():
+        if func not in dst:
+            dst[func] = fake_entry2(entry.code, 0, 0, 0.0, 0.0, {})
+        dst_entry = dst[func]
+        dst_entry.callcount += entry.callcount
+        dst_entry.reccallcount += entry.reccallcount
+        dst_entry.inlinetime += entry.inlinetime
+        dst_entry.totaltime += entry.totaltime
+
+        dst_callees = dst_entry.callees
+        for callee, subentry in entry.callees.iteritems():
+            if callee not in dst_callees:
+                dst_callees[callee] = fake_subentry(subentry.callcount,
+                                                    subentry.totaltime)
+                continue
+            dst_subentry = dst_callees[callee]
+            dst_subentry.callcount += subentry.callcount
+            if dst_subentry.totaltime < 0 or subentry.totaltime < 0:
+                dst_subentry.totaltime = -1.0  # unknown in any input
+            else:
+                dst_subentry.totaltime += subentry.totaltime
+
+
+# key of the top level dict of vstats collected per thread, which maps
+# thread labels to vstats, e.g. {THREADS_KEY: {'MainThread': vstats}}
+THREADS_KEY = '__threads__'
+
+
+def is_thread_vstats(vstats):
+    return THREADS_KEY in vstats and isinstance(vstats[THREADS_KEY], dict)
+
+
+# keys of the top level dict of memory stats, see vMemoryProfile, e.g.
+# {MEMORY_KEY: vstats, PEAKS_KEY: {func: peak}}, where the times of the
+# vstats are bytes and the callcounts are numbers of allocated blocks
+MEMORY_KEY = '__memory__'
+PEAKS_KEY = '__peaks__'
+
+
+def is_memory_vstats(vstats):
+    return MEMORY_KEY in vstats and isinstance(vstats[MEMORY_KEY], dict)
+
+
 def vstats_summary(vstats):
     # summary total execution time
     summary = 0
@@ -220,8 +435,9 @@ def vstats_summary(vstats):
 def simple_code_format(code):
     where = '<built-in>'
     if code.co_filename:
-        filename = os.path.basename(code.co_filename)
-        where = '%s:%d' % (filename, code.co_firstlineno)
+        where = os.path.basename(code.co_filename)
+        if code.co_firstlineno:     # line 0 is no line, e.g. of a group
+            where = '%s:%d' % (where, code.co_firstlineno)
     return simple_funcname(code.co_name), where
 
 
@@ -252,8 +468,23 @@ def simple_funcname(funcname):
 
 profile_module = 'cProfile'
 
+# format of the stats saved by the profiles, see export_vstats()
+dump_format = 'vstats'
+
+# profile memory allocations instead of time, see vMemoryProfile
+profile_memory = False
+
+
+def _create_profile(threads=None):
+    if profile_memory:
+        import vMemoryProfile
+        return vMemoryProfile.MemoryProfile()
+    if threads:
+        return ThreadProfile(separate=(threads == 'separate'))
+    return Profile(profile_module)
+
 
-def run(statement, filename=None, sort=-1):
+def run(statement, filename=None, sort=-1, threads=None):
     """Run statement under profiler optionally saving results in filename
 
     This function takes a single argument that can be passed to the
@@ -263,30 +494,40 @@ def run(statement, filename=None, sort=-1):
     function automatically prints a simple profiling report, sorted by the
     standard name string (file/line/function-name) that is presented in
     each line.
+
+    If threads is 'merge' or 'separate', every thread started while the
+    statement runs is profiled as well, see class 'ThreadProfile'.
     """
-    prof = Profile(profile_module)
+    pid = os.getpid()
+    prof = _create_profile(threads)
     try:
         prof = prof.run(statement)
     except SystemExit:
         pass
+    if os.getpid() != pid:
+        return  # in a forked child, which dumps its stats at exit
     if filename is not None:
         prof.dump_stats(filename)
     else:
         return prof.print_stats(sort)
 
 
-def runctx(statement, globals, locals, filename=None, sort=-1):
+def runctx(statement, globals, locals, filename=None, sort=-1,
+           threads=None):
     """Run statement under profiler, supplying your own globals and locals,
     optionally saving results in filename.
 
-    statement and filename have the same semantics as profile.run
+    statement, filename and threads have the same semantics as run
     """
-    prof = Profile(profile_module)
+    pid = os.getpid()
+    prof = _create_profile(threads)
     try:
         prof = prof.runctx(statement, globals, locals)
     except SystemExit:
         pass
-    
+    if os.getpid() != pid:
+        return  # in a forked child, which dumps its stats at exit
+
     if filename is not None:
         prof.dump_stats(filename)
     else:
@@ -303,6 +544,12 @@ class Profile:
         self.profiler = profmod.Profile()
         self.stats = None
 
+    def enable(self):
+        self.profiler.enable()
+
+    def disable(self):
+        self.profiler.disable()
+
     def get_stats(self):
         import tempfile
         fp = tempfile.NamedTemporaryFile(delete=False)
@@ -317,7 +564,7 @@ class Profile:
         self.profiler.print_stats(sort)
 
     def dump_stats(self, filename):
-        dump_vstats(self.get_stats(), filename)
+        export_vstats(self.get_stats(), filename, dump_format)
 
     def run(self, cmd):
         self.profiler = self.profiler.run(cmd)
@@ -327,6 +574,261 @@ class Profile:
         self.profiler = self.profiler.runctx(cmd, globals, locals)
         return self
 
+
+class _PstatsSnapshot:
+    # pstats taken from a profiler, as pstats.Stats loads them
+    def __init__(self, stats):
+        self.stats = dict(stats)
+
+    def create_stats(self):
+        pass
+
+
+class ThreadProfile:
+    """Profiler that attaches a cProfile.Profile to every thread
+
+    A cProfile.Profile only sees the thread that enabled it. ThreadProfile
+    profiles the thread calling enable() and, via threading.setprofile,
+    every thread started afterwards until disable() is called. Threads that
+    were already running when enable() was called are not profiled.
+
+    A cProfile.Profile can only be disabled from its own thread, so
+    disable() stops the profiler of the calling thread only: those of
+    threads still running, e.g. of a thread pool, keep counting until
+    their threads end. disable() takes the stats of every thread, and
+    get_stats() and print_stats() report these until enable() is called
+    again.
+
+    Results of the threads are merged into one vstats by get_stats(), or
+    kept separate as {THREADS_KEY: {thread_label: vstats}} if 'separate'
+    is true.
+    """
+
+    def __init__(self, separate=False):
+        self.separate = separate
+        self.profilers = {}  # map: thread label -> cProfile.Profile
+        self.stats = None
+        self._profiler = None  # profiler of the thread calling enable()
+        self._snapshots = None  # map: thread label -> pstats, see disable()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self._snapshots = None
+        threading.setprofile(self._attach)
+        self._profiler = self._new_profiler()
+        self._profiler.enable()
+
+    def disable(self):
+        threading.setprofile(None)
+        if self._profiler:
+            self._profiler.disable()
+            self._profiler = None
+        # the profilers of other threads still running cannot be stopped
+        # from here, so the profile ends with the stats they have now
+        self._snapshots = self._snapshot_stats()
+
+    def _snapshot_stats(self):
+        # the pstats of every thread, taken without disabling profilers of
+        # running threads
+        snapshots = {}
+        self._lock.acquire()
+        try:
+            profilers = self.profilers.items()
+        finally:
+            self._lock.release()
+        for label, profiler in profilers:
+            profiler.snapshot_stats()
+            snapshots[label] = profiler.stats
+        return snapshots
+
+    def _attach(self, frame, event, arg):
+        # installed by threading.setprofile, called once in every new thread
+        # to replace itself by a profiler of the thread
+        self._new_profiler().enable()
+
+    def _new_profiler(self):
+        import cProfile
+        profiler = cProfile.Profile()
+        thread = threading.current_thread()
+        self._lock.acquire()
+        try:
+            label = thread.name
+            if label in self.profilers:
+                label = '%s-%d' % (thread.name, thread.ident)
+            self.profilers[label] = profiler
+        finally:
+            self._lock.release()
+        return profiler
+
+    def get_thread_stats(self):
+        # get the dict that maps thread labels to vstats of the threads
+        snapshots = self._snapshots
+        if snapshots is None:
+            snapshots = self._snapshot_stats()
+        thread_stats = {}
+        for label, stats in snapshots.iteritems():
+            thread_stats[label] = pstats2vstats(stats)
+        return thread_stats
+
+    def get_stats(self):
+        thread_stats = self.get_thread_stats()
+        if self.separate:
+            self.stats = {THREADS_KEY: thread_stats}
+        else:
+            self.stats = merge_vstats(thread_stats.values())
+        return self.stats
+
+    def print_stats(self, sort=-1):
+        import pstats
+        snapshots = self._snapshots
+        if snapshots is None:
+            snapshots = self._snapshot_stats()
+        stats = pstats.Stats(*[_PstatsSnapshot(snapshot) for snapshot in snapshots.values()])
+        stats.strip_dirs().sort_stats(sort).print_stats()
+
+    def dump_stats(self, filename):
+        export_vstats(self.get_stats(), filename, dump_format)
+
+    def run(self, cmd):
+        import __main__
+        dict = __main__.__dict__
+        return self.runctx(cmd, dict, dict)
+
+    def runctx(self, cmd, globals, locals):
+        self.enable()
+        try:
+            exec cmd in globals, locals
+        finally:
+            self.disable()
+        return self
+
+#__________________________________________________________________________
+# Profiling child processes
+#
+# After profile_children() is called, every child forked by the process
+# starts a fresh profiler right after the fork, and dumps its stats to a
+# per-PID file when it exits. The environment variables below are
+# inherited by children started via exec as well: a Python child calls
+# profile_child() to start its profiler from them, e.g. with a
+# sitecustomize.py on its PYTHONPATH holding
+#
+#     import vProfile
+#     vProfile.profile_child()
+#
+# Merely importing vProfile does not profile a process, so that processes
+# which inherit the environment and use vProfile for other ends, e.g.
+# ProfViz, are not profiled by surprise.
+
+CHILD_OUTFILE_ENV = 'VPROFILE_CHILD_OUTFILE'
+CHILD_THREADS_ENV = 'VPROFILE_CHILD_THREADS'
+
+_child_profile = None   # (profile, outfile) of the current child process
+_fork_hook_installed = False
+
+
+def child_outfile(filename, pid):
+    # e.g. child_outfile('out.vstats', 1234) == 'out.1234.vstats'
+    root, ext = os.path.splitext(filename)
+    return '%s.%d%s' % (root, pid, ext)
+
+
+def profile_children(filename, threads=None):
+    """Profile child processes of the current process
+
+    Each child writes its stats to child_outfile(filename, pid). The files
+    can be combined with vstatsmerge.py. Forked children are profiled from
+    the fork; children started via exec once they call profile_child().
+    """
+    os.environ[CHILD_OUTFILE_ENV] = filename
+    os.environ[CHILD_THREADS_ENV] = threads or ''
+    _install_fork_hook()
+
+
+def _install_fork_hook():
+    global _fork_hook_installed
+    if _fork_hook_installed:
+        return
+    _fork_hook_installed = True
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_on_fork_child)
+        return
+
+    fork = os.fork
+
+    def _fork():
+        pid = fork()
+        if pid == 0:
+            _on_fork_child()
+        return pid
+    os.fork = _fork
+
+
+def _on_fork_child():
+    filename = os.environ.get(CHILD_OUTFILE_ENV)
+    if filename:
+        _start_child_profile(filename, os.environ.get(CHILD_THREADS_ENV))
+
+
+def _start_child_profile(filename, threads=None):
+    global _child_profile
+    # stats inherited from the parent are dropped along with its profiler
+    prof = _create_profile(threads or None)
+    prof.enable()
+    if _child_profile is None:
+        import atexit
+        atexit.register(_dump_child_stats)
+        _wrap_exit()
+    _child_profile = (prof, child_outfile(filename, os.getpid()))
+
+
+def _wrap_exit():
+    # children of multiprocessing and the like leave by os._exit, which
+    # skips atexit handlers
+    exit = os._exit
+
+    def _exit(status):
+        _dump_child_stats()
+        exit(status)
+    os._exit = _exit
+
+
+def _dump_child_stats():
+    global _child_profile
+    if _child_profile is None or _child_profile[0] is None:
+        return
+    prof, outfile = _child_profile
+    _child_profile = (None, outfile)
+    prof.disable()
+    prof.dump_stats(outfile)
+
+
+def profile_child():
+    """Start profiling the current process if its parent called profile_children
+
+    The entry hook of children started via exec, e.g. in their
+    sitecustomize:  import vProfile; vProfile.profile_child()
+    Returns whether the process is profiled.
+    """
+    filename = os.environ.get(CHILD_OUTFILE_ENV)
+    if filename and _child_profile is None:
+        _install_fork_hook()
+        _start_child_profile(filename, os.environ.get(CHILD_THREADS_ENV))
+    return _child_profile is not None
+
+#__________________________________________________________________________
+# Remote profiling
+
+
+def start_agent(host='127.0.0.1', port=18812):
+    """Start an agent serving ProfViz clients that profile this process
+
+    The agent samples the stacks of all threads on command of a client
+    and streams the stats to it, see vRemote.py.
+    """
+    import vRemote
+    return vRemote.ProfileAgent(host, port).start()
+
 #__________________________________________________________________________
 
 
@@ -339,13 +841,67 @@ def main():
     parser.add_option('-s', '--sort', dest="sort",
         help="sort order when printing to stdout, based on pstats.Stats class",
         default=-1)
+    parser.add_option('-t', '--threads', dest="threads",
+        type="choice", choices=["merge", "separate"],
+        help="profile all threads started by the script, and 'merge' their "
+             "stats into one or keep them 'separate'",
+        default=None)
+    parser.add_option('-c', '--children', dest="children",
+        action="store_true",
+        help="profile child processes as well, each child saves its stats "
+             "to <outfile> suffixed by its pid; Python children started via "
+             "exec are profiled if they run 'import vProfile; "
+             "vProfile.profile_child()', e.g. from a sitecustomize.py",
+        default=False)
+    parser.add_option('-f', '--format', dest="format",
+        type="choice", choices=["vstats", "speedscope", "chrome"],
+        help="format of <outfile>: 'vstats', 'speedscope' or 'chrome' "
+             "trace events",
+        default='vstats')
+    parser.add_option('-l', '--lines', dest="lines",
+        action="store_true",
+        help="time the lines of the script as well, and save them to "
+             "<outfile>.lines, see vLineProfile; the function times in "
+             "<outfile> then include the overhead of tracing the lines",
+        default=False)
+    parser.add_option('-b', '--line-budget', dest="line_budget",
+        type="float",
+        help="with -l, stop timing the lines of the busiest functions when "
+             "the tracing overhead exceeds <line_budget> times the run time",
+        default=None)
+    parser.add_option('-m', '--memory', dest="memory",
+        action="store_true",
+        help="profile memory allocations instead of time, which requires "
+             "tracemalloc, see vMemoryProfile",
+        default=False)
 
     if not sys.argv[1:]:
         parser.print_usage()
         sys.exit(2)
         
     (options, args) = parser.parse_args()
+    if options.memory and (options.threads or options.format != 'vstats'):
+        parser.error("option -m conflicts with options -t and -f")
     sys.argv[:] = args
+
+    global dump_format, profile_memory
+    dump_format = options.format
+    profile_memory = options.memory
+
+    if options.children:
+        if not options.outfile:
+            parser.error("option -c requires option -o")
+        # let 'import vProfile' in the script share our state instead of
+        # bootstrapping a second copy of the module from the environment
+        sys.modules.setdefault('vProfile', sys.modules[__name__])
+        profile_children(options.outfile, options.threads)
+
+    line_profile = None
+    if options.lines:
+        if not options.outfile:
+            parser.error("option -l requires option -o")
+        import vLineProfile
+        line_profile = vLineProfile.LineProfile(budget=options.line_budget)
     
     if len(args) > 0:
         progname = args[0]
@@ -357,7 +913,16 @@ def main():
             '__name__': '__main__',
             '__package__': None,
         }
-        runctx(code, globs, None, options.outfile, options.sort)
+        if line_profile:
+            line_profile.enable()
+        try:
+            runctx(code, globs, None, options.outfile, options.sort,
+                   options.threads)
+        finally:
+            if line_profile:
+                line_profile.disable()
+                line_profile.dump_stats(
+                    vLineProfile.line_stats_file(options.outfile))
     else:
         parser.print_usage()
     return parser
@@ -0,0 +1,342 @@
+#! /usr/bin/env python
+#
+#  Module for profiling a running process remotely
+#
+
+"""Remote live profiling over TCP
+
+A ProfileAgent embedded in a target process (see vProfile.start_agent)
+listens for a ProfViz client. On command it starts a StackSampler, which
+samples the stacks of all threads of the process from a thread of its
+own, so a running process can be profiled without restarting it. While
+sampling, the agent streams snapshots of the stats to the client.
+
+Stats are kept as the 'partial' stats of vstatsmerge. A snapshot only
+carries the entries changed since the previous one, and is sent as a
+zlib compressed marshal string. Every message is framed by a header of
+a one byte type and a four byte payload length:
+
+    client -> agent:  'S' start sampling, payload: '!d' sampling interval
+                      'T' stop sampling
+                      'R' reset stats
+    agent -> client:  'V' snapshot, payload: (codes, entries) changed
+
+In sampled stats, callcount of an entry or a callee is the number of
+samples in which the function or the call was on the stack, and times
+are counted in seconds of wall clock time between samples.
+"""
+
+import sys
+import time
+import zlib
+import socket
+import select
+import struct
+import marshal
+import threading
+
+import vProfile
+import vstatsmerge
+
+
+__all__ = ["StackSampler", "ProfileAgent", "RemoteClient",
+           "DEFAULT_AGENT_HOST", "DEFAULT_AGENT_PORT"]
+
+DEFAULT_AGENT_HOST = '127.0.0.1'
+DEFAULT_AGENT_PORT = 18812
+
+DEFAULT_SAMPLING_INTERVAL = 0.005
+DEFAULT_PUSH_INTERVAL = 1.0
+# how often the agent thread checks whether it was stopped, in seconds
+_POLL_INTERVAL = 0.2
+
+_HEADER = struct.Struct('!cI')
+
+#__________________________________________________________________________
+# Message framing
+
+
+def send_message(sock, type, payload=''):
+    sock.sendall(_HEADER.pack(type, len(payload)) + payload)
+
+
+def recv_message(sock):
+    # returns (type, payload), or (None, None) if the peer has gone
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None, None
+    type, size = _HEADER.unpack(header)
+    payload = _recv_exactly(sock, size)
+    if payload is None:
+        return None, None
+    return type, payload
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def encode_partial(partial):
+    return zlib.compress(marshal.dumps(partial), 1)
+
+
+def decode_partial(payload):
+    return marshal.loads(zlib.decompress(payload))
+
+#__________________________________________________________________________
+# Sampler
+
+
+class StackSampler:
+    """Sampling profiler of all threads of the current process"""
+
+    def __init__(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.codes, self.entries = {}, {}   # partial stats
+        self.lock = threading.Lock()
+        self._keys = {}     # map: code object -> vstats key
+        self._dirty = set() # keys of entries changed since take_changes()
+        self.ignored = set() # idents of threads not to be sampled
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='vProfile-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.codes, self.entries = {}, {}
+            self._keys = {}
+            self._dirty = set()
+        finally:
+            self.lock.release()
+
+    def mark_all_changed(self):
+        self.lock.acquire()
+        try:
+            self._dirty = set(self.entries)
+        finally:
+            self.lock.release()
+
+    def take_changes(self):
+        # get partial stats of the entries changed since the last call
+        self.lock.acquire()
+        try:
+            codes, entries = {}, {}
+            for name in self._dirty:
+                codes[name] = self.codes[name]
+                nc, rc, tt, ct, callees = self.entries[name]
+                entries[name] = [nc, rc, tt, ct, dict(callees)]
+            self._dirty = set()
+            return codes, entries
+        finally:
+            self.lock.release()
+
+    def _run(self):
+        ignored = self.ignored | set([threading.current_thread().ident])
+        last = time.time()
+        while self._running:
+            time.sleep(self.interval)
+            now = time.time()
+            elapsed, last = now - last, now
+            frames = sys._current_frames()
+            self.lock.acquire()
+            try:
+                for ident, frame in frames.iteritems():
+                    if ident not in ignored:
+                        self._sample(frame, elapsed)
+            finally:
+                self.lock.release()
+            del frames
+
+    def _sample(self, frame, elapsed):
+        stack = []
+        while frame is not None:
+            stack.append(self._key(frame.f_code))
+            frame = frame.f_back
+
+        entries = self.entries
+        entries[stack[0]][2] += elapsed  # the leaf spends inline time
+        seen, calls = set(), set()
+        callee = None
+        for name in stack:
+            entry = entries[name]
+            if name not in seen:
+                seen.add(name)
+                entry[0] += 1
+                entry[3] += elapsed
+            if callee is not None and (name, callee) not in calls:
+                calls.add((name, callee))
+                edge = entry[4].get(callee)
+                if edge is None:
+                    entry[4][callee] = [1, elapsed]
+                else:
+                    edge[0] += 1
+                    edge[1] += elapsed
+            callee = name
+        self._dirty.update(seen)
+
+    def _key(self, code):
+        name = self._keys.get(code)
+        if name is None:
+            label = (code.co_filename, code.co_firstlineno, code.co_name)
+            name = intern(str(vProfile.fake_code(label)))
+            self._keys[code] = name
+            if name not in self.entries:
+                self.codes[name] = label
+                self.entries[name] = [0, 0, 0.0, 0.0, {}]
+        return name
+
+#__________________________________________________________________________
+# Agent
+
+
+class ProfileAgent:
+    """TCP server embedded in a target process, serving one client at a time"""
+
+    def __init__(self, host=DEFAULT_AGENT_HOST, port=DEFAULT_AGENT_PORT,
+                 push_interval=DEFAULT_PUSH_INTERVAL):
+        self.push_interval = push_interval
+        self.sampler = StackSampler()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(1)
+        self.address = self._server.getsockname()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve,
+                                        name='vProfile-agent')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # closing the socket from here does not wake an accept() blocked in
+        # the agent thread, so the thread polls _running and closes it itself
+        self._running = False
+        self.sampler.stop()
+        if self._thread is None:
+            self._server.close()
+        elif self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _serve(self):
+        self.sampler.ignored.add(threading.current_thread().ident)
+        try:
+            while self._running:
+                readable, _, _ = select.select([self._server], [], [], _POLL_INTERVAL)
+                if readable and self._running:
+                    self._accept()
+        finally:
+            self._server.close()
+
+    def _accept(self):
+        try:
+            conn, _ = self._server.accept()
+        except socket.error:
+            return
+        try:
+            self._handle(conn)
+        except socket.error:
+            pass
+        finally:
+            self.sampler.stop()
+            conn.close()
+
+    def _handle(self, conn):
+        # a new client gets all the stats in its first snapshot
+        self.sampler.mark_all_changed()
+
+        last_push = time.time()
+        while self._running:
+            timeout = max(0.0, last_push + self.push_interval - time.time())
+            timeout = min(timeout, _POLL_INTERVAL)
+            readable, _, _ = select.select([conn], [], [], timeout)
+            if readable:
+                type, payload = recv_message(conn)
+                if type is None:
+                    return
+                self._command(type, payload)
+            if time.time() - last_push >= self.push_interval:
+                last_push = time.time()
+                changes = self.sampler.take_changes()
+                if changes[1]:
+                    send_message(conn, 'V', encode_partial(changes))
+
+    def _command(self, type, payload):
+        if type == 'S':
+            self.sampler.interval = struct.unpack('!d', payload)[0]
+            self.sampler.start()
+        elif type == 'T':
+            self.sampler.stop()
+        elif type == 'R':
+            self.sampler.reset()
+
+#__________________________________________________________________________
+# Client
+
+
+class RemoteClient:
+    """Client of a ProfileAgent, accumulating the snapshots it streams"""
+
+    def __init__(self, host=DEFAULT_AGENT_HOST, port=DEFAULT_AGENT_PORT,
+                 timeout=5.0):
+        self._sock = socket.create_connection((host, port), timeout)
+        self.partial = ({}, {})
+
+    def start(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        send_message(self._sock, 'S', struct.pack('!d', interval))
+
+    def stop(self):
+        send_message(self._sock, 'T')
+
+    def reset(self):
+        send_message(self._sock, 'R')
+        self.partial = ({}, {})
+
+    def close(self):
+        self._sock.close()
+
+    def poll(self, timeout=0.0):
+        # apply the snapshots arrived within timeout, returns True if any
+        updated = False
+        while True:
+            readable, _, _ = select.select([self._sock], [], [], timeout)
+            if not readable:
+                return updated
+            type, payload = recv_message(self._sock)
+            if type is None:
+                raise socket.error('connection closed by the agent')
+            if type == 'V':
+                codes, entries = decode_partial(payload)
+                self.partial[0].update(codes)
+                self.partial[1].update(entries)
+                updated = True
+            timeout = 0.0
+
+    def vstats(self):
+        return vstatsmerge.partial2vstats(self.partial)
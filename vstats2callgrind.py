@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+#
+#  Tool for converting vstats (or pstats) to the callgrind format, which is
+#  readable by KCachegrind
+#      see http://valgrind.org/docs/manual/cl-format.html
+#
+
+"""Callgrind export of vstats
+
+Costs are written in microseconds. File and function names are written
+once and referred to by ids afterwards ('fl=(1) name', then 'fl=(1)'),
+and lines are collected in a buffer written in bulk. Functions are named
+by their vstats keys, which callgrind2vstats.py reads back.
+"""
+
+import os
+import sys
+from optparse import OptionParser
+
+import vProfile
+
+
+__all__ = ["CallgrindWriter", "vstats2callgrind"]
+
+BUILTIN_FILENAME = '<built-in>'
+
+EVENTS = 'Microseconds'
+COST_SCALE = 1000000   # costs per second
+
+
+class CallgrindWriter:
+    def __init__(self, fp, buffer_lines=8192):
+        self.fp = fp
+        self.buffer_lines = buffer_lines
+        self._lines = []
+        self._files = {}    # map: filename -> id
+        self._funcs = {}    # map: vstats key -> id
+
+    def graph(self, vstats):
+        lines = self._lines
+        summary = 0
+        for entry in vstats.itervalues():
+            summary = max(summary, entry.totaltime)
+        lines.append('version: 1')
+        lines.append('creator: vstats2callgrind')
+        lines.append('positions: line')
+        lines.append('events: %s' % EVENTS)
+        lines.append('summary: %d' % _cost(summary))
+
+        for func, entry in vstats.iteritems():
+            code = entry.code
+            lineno = code.co_firstlineno
+            lines.append('')
+            lines.append('fl=' + self._name(self._files, code.co_filename
+                                            or BUILTIN_FILENAME))
+            lines.append('fn=' + self._name(self._funcs, func))
+            lines.append('%d %d' % (lineno, _cost(entry.inlinetime)))
+
+            for callee, subentry in entry.callees.iteritems():
+                callee_entry = vstats.get(callee)
+                if callee_entry is None:
+                    continue
+                callee_code = callee_entry.code
+                totaltime = vProfile.callee_totaltime(subentry, callee_entry)
+                lines.append('cfl=' + self._name(self._files,
+                                                 callee_code.co_filename
+                                                 or BUILTIN_FILENAME))
+                lines.append('cfn=' + self._name(self._funcs, callee))
+                lines.append('calls=%d %d' % (subentry.callcount,
+                                              callee_code.co_firstlineno))
+                lines.append('%d %d' % (lineno, _cost(totaltime)))
+
+            if len(lines) >= self.buffer_lines:
+                self.flush()
+                lines = self._lines
+        self.flush()
+
+    def flush(self):
+        if self._lines:
+            self._lines.append('')
+            self.fp.write('\n'.join(self._lines))
+            self._lines = []
+
+    def _name(self, names, name):
+        # compressed name: '(id) name' the first time, '(id)' afterwards
+        name_id = names.get(name)
+        if name_id is not None:
+            return '(%d)' % name_id
+        name_id = names[name] = len(names) + 1
+        return '(%d) %s' % (name_id, name)
+
+
+def _cost(seconds):
+    return int(seconds * COST_SCALE + 0.5)
+
+
+def vstats2callgrind(vstats, outfile):
+    output = open(outfile, 'w', 1 << 16)
+    try:
+        CallgrindWriter(output).graph(vstats)
+    finally:
+        output.close()
+
+
+def main():
+    usage = "%s -o output_file_path stats_file"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    parser.add_option('-o', '--outfile', dest="outfile",
+                      help="save callgrind data to <outfile>", default=None)
+
+    options, args = parser.parse_args()
+    if not options.outfile or len(args) != 1:
+        parser.print_usage()
+        sys.exit(2)
+
+    import vstatsmerge
+    vstats = vstatsmerge.partial2vstats(vstatsmerge.load_partial(args[0]))
+    vstats2callgrind(vstats, options.outfile)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,6 +12,24 @@
 
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+DEFAULT_BUFFER_SIZE = 1 << 16   # bytes written to the output at once
+
+# weights are styled by the nearest of PALETTE_SIZE levels, see Theme.palette;
+# enough levels that the styles of the themes below change by at most one
+# hex step per color channel, and sizes by at most 0.01, font sizes of up
+# to 24 included
+PALETTE_SIZE = 8192
+
+# the styles computed by Theme.batch, named after the methods of Theme
+STYLE_FIELDS = ('node_bgcolor', 'node_fgcolor', 'node_fontsize', 'edge_color',
+                'edge_fontsize', 'edge_penwidth', 'edge_arrowsize')
+
 
 class Theme:
     def __init__(self,
@@ -35,6 +53,7 @@ class Theme:
         self.maxpenwidth = maxpenwidth
         self.gamma = gamma
         self.skew = skew
+        self._palette = None    # (parameters, size, palette), see palette()
 
     def graph_bgcolor(self):
         return self.hsl_to_rgb(*self.bgcolor)
@@ -116,6 +135,99 @@ class Theme:
 
         return (r, g, b)
 
+    def batch(self, weights):
+        """Styles of many weights at once.
+
+        Returns a dict of STYLE_FIELDS to sequences of the values of the
+        methods of the same names, computed in one NumPy pass over the
+        weights if NumPy is available; colors are rows of (r, g, b).
+        """
+        if numpy is None:
+            return dict((name, [getattr(self, name)(weight) for weight in weights])
+                        for name in STYLE_FIELDS)
+
+        weights = numpy.asarray(weights, dtype=float)
+        colors = self.colors(weights)
+        fontsizes = numpy.maximum(weights ** 2 * self.maxfontsize, self.minfontsize)
+        penwidths = numpy.maximum(weights * self.maxpenwidth, self.minpenwidth)
+        return {
+            'node_bgcolor': colors,
+            'node_fgcolor': numpy.tile(self.graph_bgcolor(), (len(weights), 1)),
+            'node_fontsize': fontsizes,
+            'edge_color': colors,
+            'edge_fontsize': fontsizes,
+            'edge_penwidth': penwidths,
+            'edge_arrowsize': 0.5 * numpy.sqrt(penwidths),
+        }
+
+    def colors(self, weights):
+        # color() of an array of weights, as an array of (r, g, b) rows
+        weights = numpy.clip(numpy.asarray(weights, dtype=float), 0.0, 1.0)
+
+        hmin, smin, lmin = self.mincolor
+        hmax, smax, lmax = self.maxcolor
+
+        if self.skew < 0:
+            raise ValueError("Skew must be greater than 0")
+        elif self.skew == 1.0:
+            t = weights
+        else:
+            t = (-1.0 + self.skew ** weights) / (self.skew - 1.0)
+
+        h = (hmin + t*(hmax - hmin)) % 1.0
+        s = numpy.clip(smin + t*(smax - smin), 0.0, 1.0)
+        l = numpy.clip(lmin + t*(lmax - lmin), 0.0, 1.0)
+
+        m2 = numpy.where(l <= 0.5, l*(s + 1.0), l + s - l*s)
+        m1 = l*2.0 - m2
+        rgb = numpy.column_stack([self._hues_to_rgb(m1, m2, h + 1.0/3.0),
+                                  self._hues_to_rgb(m1, m2, h),
+                                  self._hues_to_rgb(m1, m2, h - 1.0/3.0)])
+        return rgb ** self.gamma
+
+    def palette(self, size=PALETTE_SIZE):
+        """Styles of size weights evenly spaced in [0, 1], see quantize().
+
+        Returns a dict of STYLE_FIELDS to lists of strings, colors as
+        '#rrggbb' and sizes with 2 decimals. The palette is cached until
+        the parameters of the theme change.
+        """
+        parameters = (self.bgcolor, self.mincolor, self.maxcolor,
+                      self.minfontsize, self.maxfontsize, self.minpenwidth,
+                      self.maxpenwidth, self.gamma, self.skew)
+        if self._palette is not None and self._palette[:2] == (parameters, size):
+            return self._palette[2]
+
+        styles = self.batch([level / (size - 1.0) for level in xrange(size)])
+        palette, formatted = {}, {}     # formatted by id, for shared styles
+        for name in STYLE_FIELDS:
+            values = styles[name]
+            if id(values) not in formatted:
+                if hasattr(values, 'tolist'):
+                    values = values.tolist()
+                if name in ('node_bgcolor', 'node_fgcolor', 'edge_color'):
+                    formatted[id(styles[name])] = [rgb2hex(rgb) for rgb in values]
+                else:
+                    formatted[id(styles[name])] = ["%.2f" % value for value in values]
+            palette[name] = formatted[id(styles[name])]
+        self._palette = (parameters, size, palette)
+        return palette
+
+    def quantize(self, weights, size=PALETTE_SIZE):
+        # the palette levels of weights, clipped to [0, 1]
+        if numpy is None:
+            return [int(min(max(weight, 0.0), 1.0) * (size - 1) + 0.5)
+                    for weight in weights]
+        weights = numpy.clip(numpy.asarray(weights, dtype=float), 0.0, 1.0)
+        return numpy.floor(weights * (size - 1) + 0.5).astype(int).tolist()
+
+    def _hues_to_rgb(self, m1, m2, h):
+        # _hue_to_rgb() of arrays
+        h = numpy.where(h < 0.0, h + 1.0, numpy.where(h > 1.0, h - 1.0, h))
+        return numpy.select([h*6 < 1.0, h*2 < 1.0, h*3 < 2.0],
+                            [m1 + (m2 - m1)*h*6.0, m2, m1 + (m2 - m1)*(2.0/3.0 - h)*6.0],
+                            m1)
+
     def _hue_to_rgb(self, m1, m2, h):
         if h < 0.0:
             h += 1.0
@@ -147,6 +259,14 @@ GRAY_COLORMAP = Theme(
     maxcolor = (0.0, 0.0, 0.0), # black
 )
 
+# for callgraphs of differences between profiles, where the weight 0.5
+# stands for 'unchanged' (see vstatsdiff.diff_weights)
+DIFF_COLORMAP = Theme(
+    mincolor = (1.0/3.0, 1.0, 0.35), # green, improved
+    maxcolor = (0.0, 1.0, 0.5), # satured red, regressed
+    gamma = 1.0
+)
+
 BW_COLORMAP = Theme(
     minfontsize = 8.0,
     maxfontsize = 24.0,
@@ -157,18 +277,40 @@ BW_COLORMAP = Theme(
 )
 
 
+def rgb2hex((r, g, b)):
+    # '#rrggbb' of a color of floats in [0, 1]
+    def float2int(f):
+        if f <= 0.0:
+            return 0
+        if f >= 1.0:
+            return 255
+        return int(255.0*f + 0.5)
+
+    return "#" + "".join(["%02x" % float2int(c) for c in (r, g, b)])
+
+
 class DotWriter:
     """Writer for the DOT language.
 
+    Writes are gathered in a buffer and passed to the file in chunks of
+    about buffer_size bytes; call flush() after writing with the methods
+    other than graph(), which flushes itself.
+
     See also:
     - "The DOT Language" specification
       http://www.graphviz.org/doc/info/lang.html
     """
 
-    def __init__(self, fp):
+    def __init__(self, fp, buffer_size=DEFAULT_BUFFER_SIZE):
         self.fp = fp
-
-    def graph(self, vstats, theme, summary=0):
+        self.buffer_size = buffer_size
+        self._chunks = []
+        self._buffered = 0
+
+    def graph(self, vstats, theme, summary=0, weights=None, notes=None):
+        # weights: map: func -> weight in [0, 1] used to style the node of
+        #     func and its incoming edges, instead of its share of summary
+        # notes: map: func -> an additional line of the labels of func
         self.begin_graph()
 
         fontname = theme.graph_fontname()
@@ -182,45 +324,76 @@ class DotWriter:
             for _, entry in vstats.iteritems():
                 summary = max(summary, entry.totaltime)
 
+        # the node of a func and the edges into it are styled alike, so the
+        # ids and the attributes of both are formatted once per func, and
+        # every node and edge is written as one line, in the order of before;
+        # styles are those of the palette level of the weight of the func,
+        # formatted once per level
         from vProfile import simple_code_format
+        ids, labels, edge_labels = {}, {}, {}
+        funcs, func_weights = [], []
+        format_id = self.format_id
+
         for func, entry in vstats.iteritems():
-            labels = []
-            labels.append('%s [%s]' % simple_code_format(entry.code))
-            labels.append('%6.2f%%' % (100.0 * entry.totaltime / summary))
-            labels.append('(%6.2f%%)' % (100.0 * entry.inlinetime / summary))
-            labels.append(str(entry.callcount))
+            ids[func] = str(id(func))
+            name, where = simple_code_format(entry.code)
+            numbers = ['%6.2f%%' % (100.0 * entry.totaltime / summary),
+                       '(%6.2f%%)' % (100.0 * entry.inlinetime / summary),
+                       str(entry.callcount)]
+            if notes and func in notes:
+                numbers.append(notes[func])
+            numbers = '\n'.join(numbers)
 
-            label = '\n'.join(labels)
             weight = entry.totaltime / summary
+            if weights is not None:
+                weight = weights.get(func, 0.5)
+
+            labels[func] = format_id('%s [%s]\n%s' % (name, where, numbers))
+            edge_labels[func] = format_id('%s %s\n%s' % (name, where, numbers))
+            funcs.append(func)
+            func_weights.append(weight)
+
+        levels = dict(zip(funcs, theme.quantize(func_weights)))
+        node_styles, edge_styles = self._styles(theme.palette(), set(levels.itervalues()))
 
-            self.node(id(func),
-                label = label,
-                color = self.color(theme.node_bgcolor(weight)),
-                fontcolor = self.color(theme.node_fgcolor(weight)),
-                fontsize = "%.2f" % theme.node_fontsize(weight),
-            )
+        edge_attrs = {}
+        for func in funcs:
+            edge_attrs[func] = ' [label=%s, %s];\n' % (edge_labels[func],
+                                                      edge_styles[levels[func]])
 
+        write = self.write
+        for func, entry in vstats.iteritems():
+            write('\t%s [label=%s, %s];\n' % (ids[func], labels[func],
+                                               node_styles[levels[func]]))
+            src = '\t%s -> ' % ids[func]
             for callee in entry.callees:
-                callee_entry = vstats[callee]
-                labels = []
-                labels.append('%s %s' % simple_code_format(callee_entry.code))
-                labels.append('%6.2f%%' % (100.0 * callee_entry.totaltime / summary))
-                labels.append('(%6.2f%%)' % (100.0 * callee_entry.inlinetime / summary))
-                labels.append(str(callee_entry.callcount))
-
-                label = '\n'.join(labels)
-                weight = callee_entry.totaltime / summary
-                self.edge(id(func), id(callee),
-                    label = label,
-                    color = self.color(theme.edge_color(weight)),
-                    fontcolor = self.color(theme.edge_color(weight)),
-                    fontsize = "%.2f" % theme.edge_fontsize(weight),
-                    penwidth = "%.2f" % theme.edge_penwidth(weight),
-                    labeldistance = "%.2f" % theme.edge_penwidth(weight),
-                    arrowsize = "%.2f" % theme.edge_arrowsize(weight),
-                )
+                write(src + ids[callee] + edge_attrs[callee])
 
         self.end_graph()
+        self.flush()
+
+    def _styles(self, palette, levels):
+        # maps: level -> the style attributes of nodes and of edges, see
+        # Theme.palette
+        format_id = self.format_id
+        node_styles, edge_styles = {}, {}
+        for level in levels:
+            color, fontsize = palette['edge_color'][level], palette['edge_fontsize'][level]
+            penwidth = palette['edge_penwidth'][level]
+            node_styles[level] = ', '.join(['%s=%s' % (name, format_id(value)) for name, value in (
+                ('color', palette['node_bgcolor'][level]),
+                ('fontcolor', palette['node_fgcolor'][level]),
+                ('fontsize', palette['node_fontsize'][level]),
+            )])
+            edge_styles[level] = ', '.join(['%s=%s' % (name, format_id(value)) for name, value in (
+                ('color', color),
+                ('fontcolor', color),
+                ('fontsize', fontsize),
+                ('penwidth', penwidth),
+                ('labeldistance', penwidth),
+                ('arrowsize', palette['edge_arrowsize'][level]),
+            )])
+        return node_styles, edge_styles
 
     def begin_graph(self):
         self.write('digraph {\n')
@@ -229,61 +402,40 @@ class DotWriter:
         self.write('}\n')
 
     def attr(self, what, **attrs):
-        self.write("\t")
-        self.write(what)
-        self.attr_list(attrs)
-        self.write(";\n")
+        self.write("\t%s%s;\n" % (what, self.attrs(attrs)))
 
     def node(self, node, **attrs):
-        self.write("\t")
-        self.id(node)
-        self.attr_list(attrs)
-        self.write(";\n")
+        self.write("\t%s%s;\n" % (self.format_id(node), self.attrs(attrs)))
 
     def edge(self, src, dst, **attrs):
-        self.write("\t")
-        self.id(src)
-        self.write(" -> ")
-        self.id(dst)
-        self.attr_list(attrs)
-        self.write(";\n")
+        self.write("\t%s -> %s%s;\n" % (self.format_id(src), self.format_id(dst),
+                                        self.attrs(attrs)))
 
     def attr_list(self, attrs):
+        self.write(self.attrs(attrs))
+
+    def attrs(self, attrs):
+        # ' [name=value, ...]' of attrs, or '' if there are none
         if not attrs:
-            return
-        self.write(' [')
-        first = True
-        for name, value in attrs.iteritems():
-            if first:
-                first = False
-            else:
-                self.write(", ")
-            self.id(name)
-            self.write('=')
-            self.id(value)
-        self.write(']')
+            return ''
+        format_id = self.format_id
+        return ' [%s]' % ', '.join(['%s=%s' % (format_id(name), format_id(value))
+                                    for name, value in attrs.iteritems()])
 
     def id(self, id):
+        self.write(self.format_id(id))
+
+    def format_id(self, id):
         if isinstance(id, (int, float)):
-            s = str(id)
+            return str(id)
         elif isinstance(id, basestring):
             if id.isalnum():
-                s = id
-            else:
-                s = self.escape(id)
-        else:
-            raise TypeError
-        self.write(s)
-
-    def color(self, (r, g, b)):
-        def float2int(f):
-            if f <= 0.0:
-                return 0
-            if f >= 1.0:
-                return 255
-            return int(255.0*f + 0.5)
+                return id
+            return self.escape(id)
+        raise TypeError
 
-        return "#" + "".join(["%02x" % float2int(c) for c in (r, g, b)])
+    def color(self, rgb):
+        return rgb2hex(rgb)
 
     def escape(self, s):
         s = s.encode('utf-8')
@@ -294,7 +446,16 @@ class DotWriter:
         return '"' + s + '"'
 
     def write(self, s):
-        self.fp.write(s)
+        self._chunks.append(s)
+        self._buffered += len(s)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            self.fp.write(''.join(self._chunks))
+            self._chunks = []
+            self._buffered = 0
 
 #__________________________________________________________________________
 # Utility functions
@@ -368,6 +529,23 @@ def _clean_vstats(vstats):
 # summary :
 #     the total time spent by a program
 #
+# theme, weights, notes :
+#     the colormap of the callgraph, and the optional weights and notes
+#     passed to DotWriter.graph, e.g. from vstatsdiff.diff_weights
+#
+# collapse_cycles :
+#     draw each cycle of recursive calls as one node, see vstatscycles;
+#     a root in a cycle is replaced by its cycle
+#
+# group_level, group_depth :
+#     if group_level is 'file', 'module' or 'package', draw a node per group
+#     of functions instead, see vstatsgroups; a root is replaced by its group
+#
+# outfile :
+#     a filename, or a file object such as the stdin of a dot process (see
+#     render_dot), which is written to but not closed; if not given, the dot
+#     source is returned as a string
+#
 # -----------------------------------------------------------------------------
 # NOTE: the comments above are written according to the current implementation
 #       of ProfViz
@@ -375,10 +553,33 @@ def _clean_vstats(vstats):
 
 
 def vstats2dot(vstats, root=None, outfile=None,
-               threshold=0.0, summary=0):
+               threshold=0.0, summary=0,
+               theme=TEMPERATURE_COLORMAP, weights=None, notes=None,
+               collapse_cycles=False, group_level=None, group_depth=1):
+    if group_level:
+        import vstatsgroups
+        vstats, groups = vstatsgroups.rollup(vstats, group_level, group_depth)
+        notes = {}
+        for name, members in groups.iteritems():
+            if root in members:
+                root = name
+            notes[name] = '%d functions' % len(members)
+    elif collapse_cycles:
+        import vstatscycles
+        vstats, cycles = vstatscycles.collapse_cycles(vstats)
+        notes = dict(notes or {})
+        for name, members in cycles.iteritems():
+            if root in members:
+                root = name
+            notes[name] = '%d functions' % len(members)
+
     vstats = _filter_vstats(vstats, root,
                             threshold, summary)
 
+    if hasattr(outfile, 'write'):
+        DotWriter(outfile).graph(vstats, theme, summary, weights, notes)
+        return None
+
     output = None
     if outfile:
         output = open(outfile, 'w')
@@ -388,8 +589,29 @@ def vstats2dot(vstats, root=None, outfile=None,
 
     try:
         dot_writer = DotWriter(output)
-        dot_writer.graph(vstats, TEMPERATURE_COLORMAP, summary)
+        dot_writer.graph(vstats, theme, summary, weights, notes)
         if not outfile:
             return output.getvalue()
     finally:
         output.close()
+
+
+def render_dot(vstats, root=None, imagefile=None, format='png', dot='dot', **options):
+    """Render the callgraph of vstats into imagefile by Graphviz dot
+
+    The dot source is written to the stdin of dot as it is made, with no
+    file in between. options are those of vstats2dot. Returns the exit
+    status of dot.
+    """
+    from subprocess import Popen, PIPE
+    process = Popen([dot, '-T' + format, '-o', imagefile], stdin=PIPE)
+    try:
+        vstats2dot(vstats, root, outfile=process.stdin, **options)
+    except IOError:     # dot quit early, its status tells why
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except IOError:
+            pass
+    return process.wait()
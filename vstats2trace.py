@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+#
+#  Tool for converting vstats to the speedscope and Chrome trace event
+#  formats, for viewing profiles without ProfViz
+#      see https://www.speedscope.app and chrome://tracing
+#
+
+"""Speedscope and Chrome trace export of vstats
+
+vstats hold no stacks, so stacks are taken from the call tree that
+vstatsflame.FlameGraph approximates. Each frame of the tree becomes a
+weighted sample of its self time (speedscope), or a complete event
+nested in the event of its parent (Chrome trace). Thread-aware vstats
+become one profile or one tid per thread.
+
+The JSON is written piece by piece while walking the tree, so no JSON
+string of the whole profile is built in memory.
+"""
+
+import os
+import sys
+import json
+from optparse import OptionParser
+
+import vProfile
+from vstatsflame import FlameGraph
+
+
+__all__ = ["dump_speedscope", "dump_chrome_trace"]
+
+DEFAULT_MIN_FRACTION = 0.0001
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+def _thread_vstats(vstats):
+    # list of (name, vstats) of the threads
+    if vProfile.is_thread_vstats(vstats):
+        return sorted(vstats[vProfile.THREADS_KEY].iteritems())
+    return [('all', vstats)]
+
+
+def _write_array(fp, items):
+    fp.write('[')
+    first = True
+    for item in items:
+        if not first:
+            fp.write(',')
+        first = False
+        fp.write(item)
+    fp.write(']')
+
+
+def dump_speedscope(vstats, filename, min_fraction=DEFAULT_MIN_FRACTION):
+    threads = _thread_vstats(vstats)
+    graphs = [FlameGraph(thread_vstats, min_fraction=min_fraction)
+              for _, thread_vstats in threads]
+
+    # frames are shared by the profiles of the threads
+    frames = {}     # map: vstats key -> index into 'frames'
+
+    def iter_frames():
+        for (_, thread_vstats), graph in zip(threads, graphs):
+            for func in graph.funcs[1:]:
+                if func in frames:
+                    continue
+                frames[func] = len(frames)
+                code = thread_vstats[func].code
+                frame = {'name': code.co_name}
+                if code.co_filename:
+                    frame['file'] = code.co_filename
+                    frame['line'] = code.co_firstlineno
+                yield json.dumps(frame)
+
+    fp = open(filename, 'w', 1 << 16)
+    try:
+        fp.write('{"$schema":%s,"exporter":"vstats2trace","name":%s,'
+                 % (json.dumps(SPEEDSCOPE_SCHEMA),
+                    json.dumps(os.path.basename(filename))))
+        fp.write('"shared":{"frames":')
+        _write_array(fp, iter_frames())
+        fp.write('},"profiles":[')
+        for i, ((name, _), graph) in enumerate(zip(threads, graphs)):
+            if i:
+                fp.write(',')
+            _write_sampled_profile(fp, name, graph, frames)
+        fp.write(']}\n')
+    finally:
+        fp.close()
+
+
+def _write_sampled_profile(fp, name, graph, frames):
+    # a frame of the tree is a sample of its stack, weighted by self time
+    self_values = list(graph.values)
+    for frame in xrange(1, len(graph)):
+        self_values[graph.parents[frame]] -= graph.values[frame]
+    samples = [frame for frame in xrange(1, len(graph))
+               if self_values[frame] > 0]
+
+    def iter_stacks():
+        for frame in samples:
+            stack = graph.ancestors(frame)[:-1]  # without the root
+            stack.reverse()
+            yield json.dumps([frames[graph.funcs[f]] for f in stack])
+
+    fp.write('{"type":"sampled","name":%s,"unit":"seconds",'
+             '"startValue":0,"endValue":%r,"samples":'
+             % (json.dumps(name), graph.values[0]))
+    _write_array(fp, iter_stacks())
+    fp.write(',"weights":')
+    _write_array(fp, (repr(self_values[frame]) for frame in samples))
+    fp.write('}')
+
+
+def dump_chrome_trace(vstats, filename, min_fraction=DEFAULT_MIN_FRACTION):
+    fp = open(filename, 'w', 1 << 16)
+    try:
+        fp.write('{"displayTimeUnit":"ms","traceEvents":')
+        _write_array(fp, _iter_chrome_events(vstats, min_fraction))
+        fp.write('}\n')
+    finally:
+        fp.close()
+
+
+def _iter_chrome_events(vstats, min_fraction):
+    for tid, (name, thread_vstats) in enumerate(_thread_vstats(vstats)):
+        yield json.dumps({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                          'tid': tid, 'args': {'name': name}})
+        graph = FlameGraph(thread_vstats, min_fraction=min_fraction)
+        xs, widths, _ = graph.layout()
+        total = graph.values[0] * 1e6   # in microseconds
+        for frame in xrange(1, len(graph)):
+            code = thread_vstats[graph.funcs[frame]].code
+            event = {
+                'name': graph.label(frame, thread_vstats),
+                'cat': 'function',
+                'ph': 'X',
+                'ts': xs[frame] * total,
+                'dur': widths[frame] * total,
+                'pid': 1,
+                'tid': tid,
+            }
+            if code.co_filename:
+                event['args'] = {'file': code.co_filename,
+                                 'line': code.co_firstlineno}
+            yield json.dumps(event)
+
+
+_exporters = {
+    'speedscope': dump_speedscope,
+    'chrome': dump_chrome_trace,
+}
+
+
+def main():
+    usage = "%s -f format -o output_file_path stats_file"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    parser.add_option('-o', '--outfile', dest="outfile",
+                      help="save the trace to <outfile>", default=None)
+    parser.add_option('-f', '--format', dest="format",
+                      type="choice", choices=sorted(_exporters),
+                      help="'speedscope' or 'chrome' (trace events)",
+                      default='speedscope')
+    parser.add_option('-m', '--min-fraction', dest="min_fraction",
+                      type="float",
+                      help="omit frames below this fraction of the total "
+                           "time, defaults to %g" % DEFAULT_MIN_FRACTION,
+                      default=DEFAULT_MIN_FRACTION)
+
+    options, args = parser.parse_args()
+    if not options.outfile or len(args) != 1:
+        parser.print_usage()
+        sys.exit(2)
+
+    try:
+        vstats = vProfile.load_vstats(args[0])
+    except ValueError:  # not JSON, so pstats
+        vstats = vProfile.pstats2vstats(vProfile.load_pstats(args[0]))
+    _exporters[options.format](vstats, options.outfile, options.min_fraction)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,399 @@
+#! /usr/bin/env python
+#
+#  Tool for benchmarking the hot paths of ProfViz on synthetic profiles,
+#  with results in JSON so that runs can be compared for regressions
+#
+
+"""Benchmarks of ProfViz on synthetic pstats
+
+synthetic_pstats() makes a pstats dict of a given number of functions:
+function i is called by one function before it and, on average, 'fanout'
+functions call any function, so the calls form a DAG with a single root.
+A 'builtins' fraction of the functions are built-ins, which call nothing,
+and a 'recursive' fraction of the others call themselves 'depth' levels
+deep. Times are made consistent bottom-up: the total time of a function
+is its inline time plus the times of its calls, each the callee's total
+time shared by its calls.
+
+The benchmark times each case on profiles of each size, the best of
+'repeat' runs, and prints (or writes) a JSON document:
+
+    {"python": ..., "platform": ..., "started": ..., "params": {...},
+     "results": [{"case": ..., "functions": ..., "edges": ...,
+                  "best": seconds, "runs": [seconds, ...]}, ...]}
+
+Cases of ProfViz itself need PyQt4, and are reported as skipped without
+it. Given a baseline document, cases slower than the baseline by more
+than a tolerance are listed, and the exit status is 1.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import marshal
+import shutil
+import platform
+import tempfile
+from timeit import default_timer
+from optparse import OptionParser
+
+import vProfile
+import vstats2dot
+
+
+__all__ = ["synthetic_pstats", "run_benchmarks", "compare_results", "CASES"]
+
+CASES = ('load_pstats', 'pstats2vstats', 'dump_vstats', 'load_vstats',
+         'vstats2callermap', '_filter_vstats', 'DotWriter.graph',
+         'createStatsTable', 'onStatsFilter')
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+DEFAULT_THRESHOLD = 0.01    # as the default callgraph threshold of ProfViz
+DEFAULT_TOLERANCE = 0.2
+
+_MODULE_SIZE = 50           # functions per synthetic module
+
+
+def synthetic_pstats(nfuncs, fanout=3.0, depth=3, builtins=0.1,
+                     recursive=0.05, seed=0):
+    """Return a pstats dict of nfuncs functions, see the module docstring"""
+    rand = random.Random(seed)
+    labels, is_builtin = [], []
+    for i in xrange(nfuncs):
+        if i and rand.random() < builtins:
+            labels.append(('~', 0, '<built-in method f%d>' % i))
+            is_builtin.append(True)
+        else:
+            labels.append(('/src/pkg%d/mod%d.py' % (i // (_MODULE_SIZE * 20), i // _MODULE_SIZE),
+                           10 * (i % _MODULE_SIZE) + 1, 'f%d' % i))
+            is_builtin.append(False)
+
+    # callers[i]: {caller index: call count}; the first caller is a function
+    # before i, the others any functions before i, for fanout calls per
+    # function on average
+    callers = [{} for _ in xrange(nfuncs)]
+    last_caller = 0
+    for i in xrange(1, nfuncs):
+        candidate = rand.randrange(i)
+        if is_builtin[candidate]:
+            candidate = last_caller
+        callers[i][candidate] = rand.randint(1, 10)
+        if not is_builtin[i]:
+            last_caller = i
+    extra = max(fanout - 1.0, 0.0)
+    for i in xrange(1, nfuncs):
+        count = int(extra) + (rand.random() < extra - int(extra))
+        for _ in xrange(count):
+            caller = rand.randrange(i)
+            if not is_builtin[caller]:
+                callers[i][caller] = callers[i].get(caller, 0) + rand.randint(1, 10)
+
+    # bottom-up times: a function's calls are all to functions after it
+    callcounts = [sum(c.itervalues()) or 1 for c in callers]
+    inline = [rand.expovariate(1.0) * 1e-5 * callcounts[i] for i in xrange(nfuncs)]
+    total = list(inline)
+    for i in xrange(nfuncs - 1, 0, -1):
+        for caller, count in callers[i].iteritems():
+            total[caller] += total[i] * count / callcounts[i]
+
+    stats = {}
+    for i in xrange(nfuncs):
+        entry_callers = {}
+        for caller, count in callers[i].iteritems():
+            share = float(count) / callcounts[i]
+            entry_callers[labels[caller]] = (count, count, inline[i] * share,
+                                             total[i] * share)
+        cc = nc = callcounts[i]
+        if not is_builtin[i] and depth > 0 and rand.random() < recursive:
+            # recursive calls count in nc only, and their times are not
+            # added again to the total time; caller tuples are (nc, cc, tt,
+            # ct) as in cProfile, where only the first self-call of each
+            # outermost call is primitive, e.g. (9, 3) for 3 calls of depth 3
+            entry_callers[labels[i]] = (cc * depth, cc, 0.0, 0.0)
+            nc = cc * (depth + 1)
+        stats[labels[i]] = (cc, nc, inline[i], total[i], entry_callers)
+    return stats
+
+
+def _edges(vstats):
+    return sum(len(entry.callees) for entry in vstats.itervalues())
+
+
+def _time(func, repeat):
+    runs = []
+    for _ in xrange(max(repeat, 1)):
+        start = default_timer()
+        func()
+        runs.append(default_timer() - start)
+    return runs
+
+
+def _import_profviz():
+    # (ProfViz module, its application), or None without PyQt4
+    try:
+        import ProfViz
+    except ImportError:
+        return None
+    app = ProfViz.QApplication.instance() or ProfViz.QApplication([sys.argv[0]])
+    return ProfViz, app
+
+
+def _cases(stats, workdir, threshold):
+    # map: case -> (setup, shape); setup returns the function to time, or a
+    # string telling why the case is skipped, and shape, called after it,
+    # the (functions, edges) of the stats measured. The files, vstats and
+    # filtered graph the cases need are made when first set up, so only
+    # the cases selected pay for them
+    pstats_file = os.path.join(workdir, 'synthetic.prof')
+    vstats_file = os.path.join(workdir, 'synthetic.vstats')
+    made = {}
+
+    def __make(name):
+        if name not in made:
+            if name == 'pstats_file':
+                fp = open(pstats_file, 'wb')
+                try:
+                    marshal.dump(stats, fp)
+                finally:
+                    fp.close()
+                made[name] = pstats_file
+            elif name == 'vstats':
+                made[name] = vProfile.pstats2vstats(stats)
+            elif name == 'summary':
+                made[name] = vProfile.vstats_summary(__make('vstats'))
+            elif name == 'filtered':
+                made[name] = vstats2dot._filter_vstats(__make('vstats'), None, threshold,
+                                                       __make('summary'))
+        return made[name]
+
+    def __load_pstats():
+        filename = __make('pstats_file')
+        return lambda: vProfile.load_pstats(filename)
+
+    def __dump_vstats():
+        vstats = __make('vstats')
+        return lambda: vProfile.dump_vstats(vstats, vstats_file)
+
+    def __load_vstats():
+        vProfile.dump_vstats(__make('vstats'), vstats_file)
+        return lambda: vProfile.load_vstats(vstats_file)
+
+    def __vstats2callermap():
+        vstats = __make('vstats')
+        return lambda: vProfile.vstats2callermap(vstats)
+
+    def __filter_vstats():
+        vstats, summary = __make('vstats'), __make('summary')
+        return lambda: vstats2dot._filter_vstats(vstats, None, threshold, summary)
+
+    def __graph():
+        filtered, summary = __make('filtered'), __make('summary')
+
+        def __run():
+            fp = open(os.devnull, 'w')
+            try:
+                vstats2dot.DotWriter(fp).graph(filtered, vstats2dot.TEMPERATURE_COLORMAP,
+                                               summary)
+            finally:
+                fp.close()
+        return __run
+
+    def __create_stats_table():
+        profviz = _import_profviz()
+        if profviz is None:
+            return 'PyQt4 is not available'
+        entries, summary = __make('vstats').values(), __make('summary')
+        return lambda: profviz[0].createStatsTable(summary, entries)
+
+    def __on_stats_filter():
+        profviz = _import_profviz()
+        if profviz is None:
+            return 'PyQt4 is not available'
+        window = profviz[0].MyWindow()
+        window.setStats(__make('vstats'), 'synthetic')
+        for lineedit, text in ((window._filefilter_lineedit, 'mod1'),
+                               (window._funcfilter_lineedit, 'f1')):
+            lineedit.blockSignals(True)
+            lineedit.setText(text)
+            lineedit.blockSignals(False)
+        return window.onStatsFilter
+
+    # the callers of pstats are the callees of its vstats, inverted
+    shape = lambda: (len(stats), sum(len(entry[4]) for entry in stats.itervalues()))
+    filtered_shape = lambda: (len(made['filtered']), _edges(made['filtered']))
+    return {
+        'load_pstats': (__load_pstats, shape),
+        'pstats2vstats': (lambda: lambda: vProfile.pstats2vstats(stats), shape),
+        'dump_vstats': (__dump_vstats, shape),
+        'load_vstats': (__load_vstats, shape),
+        'vstats2callermap': (__vstats2callermap, shape),
+        '_filter_vstats': (__filter_vstats, shape),
+        'DotWriter.graph': (__graph, filtered_shape),
+        'createStatsTable': (__create_stats_table, shape),
+        'onStatsFilter': (__on_stats_filter, shape),
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, cases=CASES, repeat=3,
+                   threshold=DEFAULT_THRESHOLD, log=None, **params):
+    """Return the benchmark document of the cases on each size
+
+    params are passed to synthetic_pstats; log, if given, is called with
+    each result as it is measured.
+    """
+    results = []
+    workdir = tempfile.mkdtemp(prefix='vstatsbench')
+    try:
+        for size in sizes:
+            stats = synthetic_pstats(size, **params)
+            table = _cases(stats, workdir, threshold)
+            for case in cases:
+                setup, shape = table[case]
+                measured = setup()
+                functions, edges = shape()
+                result = {'case': case, 'functions': functions, 'edges': edges,
+                          'size': size}
+                if isinstance(measured, basestring):
+                    result['skipped'] = measured
+                else:
+                    runs = _time(measured, repeat)
+                    result.update(best=min(runs), runs=runs)
+                results.append(result)
+                if log is not None:
+                    log(result)
+            del stats, table
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    params = dict(params, threshold=threshold, repeat=repeat)
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': params,
+            'results': results}
+
+
+def compare_results(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """Return [(case, size, baseline best, current best)] of the cases
+    slower than in baseline by more than tolerance, a fraction
+    """
+    before = dict(((result['case'], result['size']), result['best'])
+                  for result in baseline['results'] if 'best' in result)
+    slower = []
+    for result in current['results']:
+        key = (result['case'], result['size'])
+        if 'best' not in result or key not in before:
+            continue
+        if result['best'] > before[key] * (1.0 + tolerance):
+            slower.append(key + (before[key], result['best']))
+    return slower
+
+
+def _log(result):
+    if 'skipped' in result:
+        line = 'skipped (%s)' % result['skipped']
+    else:
+        line = '%10.4f s' % result['best']
+    print >> sys.stderr, '%-18s %8d funcs %8d edges  %s' % (
+        result['case'], result['functions'], result['edges'], line)
+
+
+def main():
+    usage = "%s [-s sizes] [-c cases] [-r repeat] [-o json_file] [-b baseline]\n" \
+            "       %s -g pstats_file [-s size]"
+    prog = os.path.basename(sys.argv[0])
+    parser = OptionParser(usage=usage % (prog, prog))
+    parser.add_option('-s', '--sizes', dest="sizes",
+                      help="comma separated numbers of functions, defaults to %s"
+                           % ','.join(map(str, DEFAULT_SIZES)),
+                      default=','.join(map(str, DEFAULT_SIZES)))
+    parser.add_option('-c', '--cases', dest="cases",
+                      help="comma separated cases, of %s" % ', '.join(CASES),
+                      default=','.join(CASES))
+    parser.add_option('-r', '--repeat', dest="repeat", type="int",
+                      help="runs of each case, the best is kept, defaults to 3",
+                      default=3)
+    parser.add_option('-t', '--threshold', dest="threshold", type="float",
+                      help="callgraph threshold (%%) of _filter_vstats and "
+                           "DotWriter.graph, defaults to %s" % DEFAULT_THRESHOLD,
+                      default=DEFAULT_THRESHOLD)
+    parser.add_option('--fanout', dest="fanout", type="float",
+                      help="calls into each function on average, defaults to 3",
+                      default=3.0)
+    parser.add_option('--depth', dest="depth", type="int",
+                      help="depth of recursive calls, defaults to 3",
+                      default=3)
+    parser.add_option('--builtins', dest="builtins", type="float",
+                      help="fraction of built-in functions, defaults to 0.1",
+                      default=0.1)
+    parser.add_option('--recursive', dest="recursive", type="float",
+                      help="fraction of recursive functions, defaults to 0.05",
+                      default=0.05)
+    parser.add_option('--seed', dest="seed", type="int",
+                      help="seed of the generator, defaults to 0", default=0)
+    parser.add_option('-g', '--generate', dest="generate",
+                      help="only write a synthetic pstats file of the first size",
+                      default=None)
+    parser.add_option('-o', '--output', dest="output",
+                      help="write the results to <json_file> instead of stdout",
+                      default=None)
+    parser.add_option('-b', '--baseline', dest="baseline",
+                      help="compare with the results in <baseline>", default=None)
+    parser.add_option('--tolerance', dest="tolerance", type="float",
+                      help="slowdown allowed against the baseline, defaults to %s"
+                           % DEFAULT_TOLERANCE, default=DEFAULT_TOLERANCE)
+
+    options, args = parser.parse_args()
+    if args:
+        parser.print_usage()
+        sys.exit(2)
+
+    try:
+        sizes = [int(size) for size in options.sizes.split(',') if size]
+    except ValueError:
+        parser.error('bad sizes: %s' % options.sizes)
+    cases = [case for case in options.cases.split(',') if case]
+    for case in cases:
+        if case not in CASES:
+            parser.error('unknown case: %s' % case)
+    params = dict(fanout=options.fanout, depth=options.depth,
+                  builtins=options.builtins, recursive=options.recursive,
+                  seed=options.seed)
+
+    if options.generate:
+        fp = open(options.generate, 'wb')
+        try:
+            marshal.dump(synthetic_pstats(sizes[0], **params), fp)
+        finally:
+            fp.close()
+        return 0
+
+    document = run_benchmarks(sizes, cases, options.repeat, options.threshold,
+                              log=_log, **params)
+    if options.output:
+        fp = open(options.output, 'w')
+        try:
+            json.dump(document, fp, indent=1)
+        finally:
+            fp.close()
+    else:
+        print json.dumps(document, indent=1)
+
+    if options.baseline:
+        fp = open(options.baseline)
+        try:
+            baseline = json.load(fp)
+        finally:
+            fp.close()
+        slower = compare_results(baseline, document, options.tolerance)
+        for case, size, before, after in slower:
+            print >> sys.stderr, 'slower: %s at %d functions, %.4f s -> %.4f s' % (
+                case, size, before, after)
+        if slower:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+#! /usr/bin/env python
+#
+#  Module for caching converted profiles on disk, so opening a profile
+#  again skips loading and converting it
+#
+
+"""On-disk cache of converted stats
+
+Stats loaded from a file (pstats, vstats, callgrind, ...) are saved in a
+cache directory of the user, and loaded from there the next time the
+same file is opened. An entry is keyed by the absolute path, modification
+time and size of the file, and a hash of its content, and by a 'variant'
+naming the options of the conversion, e.g. pruning. The content hash is
+taken over the first, middle and last blocks of the file only, so it
+costs the same for any size of file; the modification time and size
+catch the rest.
+
+Entries are partial stats (see vstatsmerge) saved by marshal, the fastest
+format to load, with a header of their version. When the cache grows
+beyond its size, the least recently used entries are removed; entries
+are touched when used, so their modification times tell.
+
+The cache directory is VSTATS_CACHE_DIR if set, or a 'ProfViz' directory
+in the cache directory of the platform, and its size VSTATS_CACHE_SIZE
+megabytes, DEFAULT_CACHE_SIZE by default.
+"""
+
+import os
+import sys
+import time
+import marshal
+import hashlib
+import threading
+from optparse import OptionParser
+
+import vProfile
+import vstatsmerge
+
+
+__all__ = ["is_cached", "load_cached", "store_cached", "store_cached_async",
+           "cache_dir", "clear_cache"]
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.vcache'
+DEFAULT_CACHE_SIZE = 1024   # in megabytes
+
+_SAMPLE_SIZE = 1 << 20      # bytes of each block hashed
+
+
+def cache_dir():
+    directory = os.environ.get('VSTATS_CACHE_DIR')
+    if directory:
+        return directory
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'ProfViz')
+
+
+def cache_size():
+    # in bytes
+    try:
+        return int(os.environ.get('VSTATS_CACHE_SIZE', DEFAULT_CACHE_SIZE)) << 20
+    except ValueError:
+        return DEFAULT_CACHE_SIZE << 20
+
+
+def _content_hash(filename, size):
+    digest = hashlib.sha1()
+    fp = open(filename, 'rb')
+    try:
+        for offset in sorted(set([0, max(size // 2 - _SAMPLE_SIZE // 2, 0),
+                                  max(size - _SAMPLE_SIZE, 0)])):
+            fp.seek(offset)
+            digest.update(fp.read(_SAMPLE_SIZE))
+    finally:
+        fp.close()
+    return digest.hexdigest()
+
+
+def _entry_file(filename, variant):
+    st = os.stat(filename)
+    key = '\0'.join((os.path.abspath(filename), repr(st.st_mtime),
+                     str(st.st_size), _content_hash(filename, st.st_size),
+                     variant))
+    return os.path.join(cache_dir(), hashlib.sha1(key).hexdigest() + CACHE_SUFFIX)
+
+#__________________________________________________________________________
+# Stats to and from marshallable values
+
+
+def _vstats2partial(vstats):
+    codes, entries = {}, {}
+    for name, entry in vstats.iteritems():
+        code = entry.code
+        codes[name] = (code.co_filename, code.co_firstlineno, code.co_name)
+        entries[name] = [entry.callcount, entry.reccallcount,
+                         entry.inlinetime, entry.totaltime,
+                         dict((callee, [subentry.callcount, subentry.totaltime])
+                              for callee, subentry in entry.callees.iteritems())]
+    return codes, entries
+
+
+def _encode(stats):
+    if vProfile.is_memory_vstats(stats):
+        return ('memory', _encode(stats[vProfile.MEMORY_KEY]),
+                stats.get(vProfile.PEAKS_KEY, {}))
+    if vProfile.is_thread_vstats(stats):
+        return ('threads', dict((label, _vstats2partial(vstats)) for label, vstats
+                                in stats[vProfile.THREADS_KEY].iteritems()))
+    return ('vstats', _vstats2partial(stats))
+
+
+def _decode(value):
+    # the vstats saved are restored as they were, see vstatsmerge.build_vstats
+    if value[0] == 'memory':
+        return {vProfile.MEMORY_KEY: _decode(value[1]), vProfile.PEAKS_KEY: value[2]}
+    if value[0] == 'threads':
+        return {vProfile.THREADS_KEY: dict((label, vstatsmerge.build_vstats([partial]))
+                                           for label, partial in value[1].iteritems())}
+    return vstatsmerge.build_vstats([value[1]])
+
+#__________________________________________________________________________
+# Cache entries
+
+
+def is_cached(filename, variant=''):
+    """Return True if the stats of a file are in the cache"""
+    try:
+        return os.path.isfile(_entry_file(filename, variant))
+    except (IOError, OSError):
+        return False
+
+
+@vProfile.without_gc
+def load_cached(filename, variant=''):
+    """Return the cached stats of a file, or None"""
+    try:
+        entry_file = _entry_file(filename, variant)
+        fp = open(entry_file, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        try:
+            version, value = marshal.load(fp)
+        finally:
+            fp.close()
+        if version != CACHE_VERSION:
+            raise ValueError('cache version %s' % version)
+        stats = _decode(value)
+    except Exception:   # an entry of another version, or damaged
+        _remove(entry_file)
+        return None
+    try:
+        os.utime(entry_file, None)  # used now, for the LRU eviction
+    except OSError:
+        pass
+    return stats
+
+
+@vProfile.without_gc
+def store_cached(filename, stats, variant=''):
+    """Save the stats of a file in the cache, returns True if saved"""
+    try:
+        entry_file = _entry_file(filename, variant)
+        directory = os.path.dirname(entry_file)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_file = '%s.%d.%d.tmp' % (entry_file, os.getpid(),
+                                      threading.current_thread().ident)
+        fp = open(temp_file, 'wb')
+        try:
+            marshal.dump((CACHE_VERSION, _encode(stats)), fp)
+        finally:
+            fp.close()
+        if os.path.exists(entry_file):  # rename does not replace on Windows
+            os.remove(entry_file)
+        os.rename(temp_file, entry_file)
+    except (IOError, OSError, ValueError):
+        return False
+    evict(cache_size())
+    return True
+
+
+def store_cached_async(filename, stats, variant=''):
+    """Save the stats of a file in the cache in a background thread
+
+    For callers that must not wait for the write and the eviction, e.g.
+    a GUI; returns the thread. The stats must not change meanwhile.
+    """
+    thread = threading.Thread(target=store_cached, args=(filename, stats, variant),
+                              name='vstatscache-store')
+    thread.start()
+    return thread
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def _entries():
+    # [(mtime, size, path)] of the cache entries
+    directory = cache_dir()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    entries = []
+    for name in names:
+        if not name.endswith(CACHE_SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def evict(max_size):
+    # remove the least recently used entries until the cache fits max_size
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        _remove(path)
+        total -= size
+
+
+def clear_cache():
+    evict(0)
+
+
+def main():
+    usage = "%s [--clear]"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    parser.add_option('--clear', dest="clear", action="store_true",
+                      help="remove every entry of the cache", default=False)
+
+    options, args = parser.parse_args()
+    if args:
+        parser.print_usage()
+        sys.exit(2)
+
+    if options.clear:
+        clear_cache()
+    entries = _entries()
+    print '%s: %d entries, %.1f of %.1f MB' % (
+        cache_dir(), len(entries),
+        sum(size for _, size, _ in entries) / 1048576.0, cache_size() / 1048576.0)
+    if entries:
+        print 'least recently used on %s' % time.strftime(
+            '%Y-%m-%d %H:%M:%S', time.localtime(min(entries)[0]))
+
+if __name__ == '__main__':
+    sys.exit(main())
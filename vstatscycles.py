@@ -0,0 +1,179 @@
+#
+#  Module for collapsing recursive call cycles of vstats
+#
+
+"""Call cycles of vstats, collapsed the way gprof does
+
+cProfile cannot tell how the time of a recursive function splits among
+its callees, so vProfile marks such callee times 'unknown' (-1.0). Here
+mutually recursive functions, the strongly connected components of the
+call graph found by an iterative Tarjan's algorithm, are collapsed into
+cycle nodes named '<cycle N>', leaving an acyclic call graph:
+
+    inlinetime   : inline time of the members
+    totaltime    : time of the calls into the cycle from outside, which
+                   never nest, or the largest total time of a member if
+                   some of these are unknown
+    callcount    : calls into the cycle from outside
+    reccallcount : calls between members
+
+Calls of members to outside functions become calls of the cycle. Calls
+of a function to itself are dropped. Callee times still unknown are
+estimated by callee_totaltime() of vProfile, and scaled down if they
+exceed the time a caller spent in its callees.
+"""
+
+import vProfile
+from vProfile import fake_code, fake_entry2, fake_subentry
+
+
+__all__ = ["strongly_connected_components", "collapse_cycles",
+           "callee_times", "CYCLE_NAME"]
+
+CYCLE_NAME = '<cycle %d>'
+
+
+def strongly_connected_components(vstats):
+    # components of the call graph, callees before their callers
+    index, lowlink = {}, {}
+    stack, on_stack = [], set()
+    components = []
+
+    for start in vstats:
+        if start in index:
+            continue
+        index[start] = lowlink[start] = len(index)
+        stack.append(start)
+        on_stack.add(start)
+        work = [(start, iter(vstats[start].callees))]
+        while work:
+            func, callees = work[-1]
+            for callee in callees:
+                if callee not in vstats:
+                    continue
+                if callee not in index:
+                    index[callee] = lowlink[callee] = len(index)
+                    stack.append(callee)
+                    on_stack.add(callee)
+                    work.append((callee, iter(vstats[callee].callees)))
+                    break
+                if callee in on_stack:
+                    lowlink[func] = min(lowlink[func], index[callee])
+            else:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    lowlink[caller] = min(lowlink[caller], lowlink[func])
+                if lowlink[func] == index[func]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == func:
+                            break
+                    components.append(component)
+    return components
+
+
+def callee_times(vstats, func):
+    # map: callee -> time func spent in it, with unknown times estimated
+    entry = vstats[func]
+    times, estimated = {}, []
+    for callee, subentry in entry.callees.iteritems():
+        if callee not in vstats:
+            continue
+        times[callee] = vProfile.callee_totaltime(subentry, vstats[callee])
+        if subentry.totaltime < 0:
+            estimated.append(callee)
+
+    # estimates of recursive calls may exceed what the caller spent
+    room = max(entry.totaltime - entry.inlinetime, 0.0)
+    known = sum(times[callee] for callee in times if callee not in estimated)
+    guess = sum(times[callee] for callee in estimated)
+    if guess > max(room - known, 0.0) and guess > 0:
+        scale = max(room - known, 0.0) / guess
+        for callee in estimated:
+            times[callee] *= scale
+    return times
+
+
+def collapse_cycles(vstats):
+    """Collapse the call cycles of vstats
+
+    Returns (vstats, cycles), a new vstats without call cycles or unknown
+    callee times, and a map of cycle keys to lists of member keys.
+    """
+    components = [component for component
+                  in strongly_connected_components(vstats)
+                  if len(component) > 1]
+    components.sort(key=lambda component:
+                    -max(vstats[func].totaltime for func in component))
+
+    cycles, cycle_of = {}, {}
+    for number, members in enumerate(components):
+        name = CYCLE_NAME % (number + 1)
+        cycles[name] = sorted(members)
+        for func in members:
+            cycle_of[func] = name
+
+    result = {}
+    for func, entry in vstats.iteritems():
+        if func not in cycle_of:
+            result[func] = fake_entry2(entry.code, entry.callcount,
+                                       entry.reccallcount, entry.inlinetime,
+                                       entry.totaltime, {})
+    for name, members in cycles.iteritems():
+        result[name] = fake_entry2(fake_code(('', 0, name)), 0, 0,
+                                   sum(vstats[func].inlinetime
+                                       for func in members), 0.0, {})
+
+    # calls into each cycle from outside: [callcount, totaltime or -1.0]
+    calls_in = dict((name, [0, 0.0]) for name in cycles)
+    for func, entry in vstats.iteritems():
+        caller = cycle_of.get(func, func)
+        callees = result[caller].callees
+        for callee, subentry in entry.callees.iteritems():
+            if callee not in vstats:
+                continue
+            target = cycle_of.get(callee, callee)
+            if target == caller:
+                if caller in cycles:    # a call between members
+                    result[caller].reccallcount += subentry.callcount
+                continue
+            if target in cycles:
+                calls = calls_in[target]
+                calls[0] += subentry.callcount
+                if calls[1] < 0 or subentry.totaltime < 0:
+                    calls[1] = -1.0
+                else:
+                    calls[1] += subentry.totaltime
+            if target not in callees:
+                callees[target] = fake_subentry(subentry.callcount,
+                                                subentry.totaltime)
+                continue
+            dst = callees[target]
+            dst.callcount += subentry.callcount
+            if dst.totaltime < 0 or subentry.totaltime < 0:
+                dst.totaltime = -1.0
+            else:
+                dst.totaltime += subentry.totaltime
+
+    for name, members in cycles.iteritems():
+        entry = result[name]
+        callcount, totaltime = calls_in[name]
+        if totaltime < 0 or not callcount:  # unknown, or a root cycle
+            totaltime = max(vstats[func].totaltime for func in members)
+        if not callcount:
+            callcount = max(vstats[func].callcount - vstats[func].reccallcount
+                            for func in members)
+        entry.callcount = callcount
+        entry.totaltime = max(totaltime, entry.inlinetime)
+
+    # fill in the callee times left unknown
+    for func, entry in result.iteritems():
+        if any(subentry.totaltime < 0
+               for subentry in entry.callees.itervalues()):
+            for callee, time in callee_times(result, func).iteritems():
+                entry.callees[callee].totaltime = time
+    return result, cycles
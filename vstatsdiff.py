@@ -0,0 +1,107 @@
+#
+#  Module for comparing two vstats, e.g. profiles taken before and after
+#  a performance fix
+#
+
+import os
+
+
+__all__ = ["align_vstats", "diff_vstats", "diff_weights"]
+
+#__________________________________________________________________________
+# Alignment
+
+# Functions are first joined by their vstats keys. The remaining ones are
+# joined by looser keys, so that a function still matches after lines were
+# inserted above it, or after its file moved to another directory. If a
+# looser key is shared by several candidates, the one with the nearest
+# first line number is taken.
+
+_fuzzy_keys = [
+    lambda code: (code.co_filename, code.co_name),
+    lambda code: (os.path.basename(code.co_filename), code.co_name),
+]
+
+
+def align_vstats(vstats_a, vstats_b):
+    """Align functions of two vstats by hash joins
+
+    Returns a list of (func_a, func_b) pairs of vstats keys, where func_a
+    or func_b is None for a function found in only one of the vstats.
+    """
+    pairs = []
+    rest_a = []
+    for func in vstats_a:
+        if func in vstats_b:
+            pairs.append((func, func))
+        else:
+            rest_a.append(func)
+    rest_b = [func for func in vstats_b if func not in vstats_a]
+
+    for fuzzy_key in _fuzzy_keys:
+        if not rest_a or not rest_b:
+            break
+        table = {}
+        for func in rest_b:
+            table.setdefault(fuzzy_key(vstats_b[func].code), []).append(func)
+
+        unmatched_a = []
+        for func in rest_a:
+            code = vstats_a[func].code
+            candidates = table.get(fuzzy_key(code))
+            if not candidates:
+                unmatched_a.append(func)
+                continue
+            lineno = code.co_firstlineno
+            best = min(candidates, key=lambda c:
+                       abs(vstats_b[c].code.co_firstlineno - lineno))
+            candidates.remove(best)
+            pairs.append((func, best))
+
+        rest_a = unmatched_a
+        rest_b = [func for candidates in table.itervalues()
+                  for func in candidates]
+
+    pairs.extend((func, None) for func in rest_a)
+    pairs.extend((None, func) for func in rest_b)
+    return pairs
+
+#__________________________________________________________________________
+# Differences
+
+
+def diff_vstats(vstats_a, vstats_b):
+    """Compare two vstats function by function
+
+    Returns a list of (func_a, func_b, entry_a, entry_b) tuples, one for
+    each pair of aligned functions, where entry_a or entry_b is None for a
+    function found in only one of the vstats.
+    """
+    diff = []
+    for func_a, func_b in align_vstats(vstats_a, vstats_b):
+        entry_a = vstats_a[func_a] if func_a is not None else None
+        entry_b = vstats_b[func_b] if func_b is not None else None
+        diff.append((func_a, func_b, entry_a, entry_b))
+    return diff
+
+
+def diff_weights(diff):
+    """Get weights for coloring a callgraph of the vstats compared second
+
+    Returns (weights, notes): weights maps vstats keys to values in [0, 1],
+    0.5 for an unchanged cumtime and 1.0 for the largest regression, and
+    notes maps vstats keys to labels of the cumtime differences.
+    """
+    deltas = {}
+    for func_a, func_b, entry_a, entry_b in diff:
+        if func_b is None:
+            continue
+        totaltime_a = entry_a.totaltime if entry_a is not None else 0.0
+        deltas[func_b] = entry_b.totaltime - totaltime_a
+
+    scale = max([abs(delta) for delta in deltas.itervalues()] or [0.0])
+    weights, notes = {}, {}
+    for func, delta in deltas.iteritems():
+        weights[func] = 0.5 + 0.5 * delta / scale if scale > 0 else 0.5
+        notes[func] = '%+.3fs' % delta
+    return weights, notes
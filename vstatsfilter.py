@@ -0,0 +1,381 @@
+#! /usr/bin/env python
+#
+#  Tool for selecting the functions of vstats by filter expressions, e.g.
+#  to triage many profiles from scripts
+#
+
+"""Filter expressions over vstats
+
+An expression compares columns of the stats table with constants, and
+combines comparisons with 'and', 'or', 'not' and parentheses:
+
+    cumtime > 0.5 and file ~ "db/" and ncall > 1000
+    not (func == "<module>" or pct < 1)
+
+Numeric columns are compared by <, <=, >, >=, == and !=, and string
+columns by == and != or searched for regular expressions by ~ and !~:
+
+    ncall, reccall, tottime, cumtime, percall (tottime per call),
+    cumpercall, pct (percentage of cumtime), line  : numbers
+    func (simple name), file (full path), key      : strings
+
+An expression is compiled once into a predicate over whole columns, not
+rows. Columns of vstats are built once, only those used, as NumPy arrays
+if NumPy is available, and as lists otherwise. A regular expression is
+searched once per distinct string of a column, e.g. once per file.
+"""
+
+import os
+import re
+import sys
+import operator
+from optparse import OptionParser
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import vProfile
+
+
+__all__ = ["Filter", "Columns", "FilterError", "compile_filter",
+           "NUMERIC_FIELDS", "STRING_FIELDS"]
+
+NUMERIC_FIELDS = ('ncall', 'reccall', 'tottime', 'cumtime', 'percall',
+                  'cumpercall', 'pct', 'line')
+STRING_FIELDS = ('func', 'file', 'key')
+
+_COMPARISONS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne,
+}
+
+_token_pattern = re.compile(r'''\s*(?:
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*') |
+    (?P<op><=|>=|==|!=|!~|<|>|=|~|\(|\)) |
+    (?P<name>[A-Za-z_]\w*)
+)''', re.VERBOSE)
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _numeric_value(name, entry, summary):
+    if name == 'ncall':
+        return entry.callcount
+    if name == 'reccall':
+        return entry.reccallcount
+    if name == 'tottime':
+        return entry.inlinetime
+    if name == 'cumtime':
+        return entry.totaltime
+    if name == 'percall':
+        return entry.inlinetime / entry.callcount if entry.callcount else 0.0
+    if name == 'cumpercall':
+        return entry.totaltime / entry.callcount if entry.callcount else 0.0
+    if name == 'pct':
+        return 100.0 * entry.totaltime / summary if summary else 0.0
+    return entry.code.co_firstlineno
+
+
+class Columns:
+    """Columns of vstats for filters, built when first used"""
+
+    def __init__(self, vstats, summary=None):
+        self.vstats = vstats
+        self.keys = list(vstats)
+        self.summary = summary or vProfile.vstats_summary(vstats)
+        self._numeric = {}
+        self._strings = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def numeric(self, name):
+        column = self._numeric.get(name)
+        if column is None:
+            vstats, summary = self.vstats, self.summary
+            column = [_numeric_value(name, vstats[key], summary)
+                      for key in self.keys]
+            if numpy is not None:
+                column = numpy.array(column, dtype=float)
+            self._numeric[name] = column
+        return column
+
+    def strings(self, name):
+        # (distinct strings, index of the string of each row)
+        column = self._strings.get(name)
+        if column is None:
+            distinct, indexes = {}, []
+            for key in self.keys:
+                code = self.vstats[key].code
+                if name == 'func':
+                    value = vProfile.simple_funcname(code.co_name)
+                elif name == 'file':
+                    value = code.co_filename
+                else:
+                    value = key
+                indexes.append(distinct.setdefault(value, len(distinct)))
+            values = [None] * len(distinct)
+            for value, index in distinct.iteritems():
+                values[index] = value
+            if numpy is not None:
+                indexes = numpy.array(indexes, dtype=int)
+            column = self._strings[name] = (values, indexes)
+        return column
+
+
+#__________________________________________________________________________
+# Column-wise operations, on NumPy arrays or lists
+
+
+def _compare(column, op, value):
+    if numpy is not None:
+        return op(column, value)
+    return [op(x, value) for x in column]
+
+
+def _take(matches, indexes):
+    if numpy is not None:
+        return numpy.array(matches, dtype=bool)[indexes]
+    return [matches[i] for i in indexes]
+
+
+def _and(a, b):
+    if numpy is not None:
+        return a & b
+    return [x and y for x, y in zip(a, b)]
+
+
+def _or(a, b):
+    if numpy is not None:
+        return a | b
+    return [x or y for x, y in zip(a, b)]
+
+
+def _not(a):
+    if numpy is not None:
+        return ~a
+    return [not x for x in a]
+
+
+def _everything(columns):
+    if numpy is not None:
+        return numpy.ones(len(columns), dtype=bool)
+    return [True] * len(columns)
+
+#__________________________________________________________________________
+# Parser
+
+
+class _Parser:
+    # recursive descent parser compiling an expression into a function of
+    # Columns returning a mask of the rows
+    #   expr := conj ('or' conj)* ; conj := neg ('and' neg)*
+    #   neg  := 'not' neg | '(' expr ')' | field op constant
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = self.tokenize(expression)
+        self.pos = 0
+        self.fields = set()
+
+    def tokenize(self, expression):
+        tokens, pos = [], 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = _token_pattern.match(expression, pos)
+            if match is None or match.end() == pos:
+                raise FilterError('unexpected character at column %d: %r'
+                                  % (pos + 1, expression[pos:].lstrip()[:1]))
+            kind = match.lastgroup
+            tokens.append((kind, match.group(kind), match.start(kind)))
+            pos = match.end()
+        return tokens
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None, len(self.expression))
+
+    def next(self, what):
+        kind, text, column = self.peek()
+        if kind is None:
+            raise FilterError('%s expected at the end' % what)
+        self.pos += 1
+        return kind, text, column
+
+    def error(self, what, token):
+        kind, text, column = token
+        if kind is None:
+            return FilterError('%s expected at the end' % what)
+        return FilterError('%s expected at column %d, got %r'
+                           % (what, column + 1, text))
+
+    def parse(self):
+        predicate = self.parse_or()
+        if self.peek()[0] is not None:
+            raise self.error("'and' or 'or'", self.peek())
+        return predicate
+
+    def parse_or(self):
+        predicate = self.parse_and()
+        while self.peek()[:2] == ('name', 'or'):
+            self.pos += 1
+            predicate = self._combine(_or, predicate, self.parse_and())
+        return predicate
+
+    def parse_and(self):
+        predicate = self.parse_not()
+        while self.peek()[:2] == ('name', 'and'):
+            self.pos += 1
+            predicate = self._combine(_and, predicate, self.parse_not())
+        return predicate
+
+    @staticmethod
+    def _combine(combine, left, right):
+        return lambda columns: combine(left(columns), right(columns))
+
+    def parse_not(self):
+        token = self.peek()
+        if token[:2] == ('name', 'not'):
+            self.pos += 1
+            operand = self.parse_not()
+            return lambda columns: _not(operand(columns))
+        if token[:2] == ('op', '('):
+            self.pos += 1
+            predicate = self.parse_or()
+            if self.peek()[:2] != ('op', ')'):
+                raise self.error("')'", self.peek())
+            self.pos += 1
+            return predicate
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        token = self.next('a column')
+        field = token[1]
+        if token[0] != 'name' or field not in NUMERIC_FIELDS + STRING_FIELDS:
+            raise self.error('a column (%s)' % ', '.join(NUMERIC_FIELDS + STRING_FIELDS), token)
+        self.fields.add(field)
+
+        op_token = self.next('an operator')
+        op = op_token[1]
+        if op_token[0] != 'op' or op in '()':
+            raise self.error('an operator', op_token)
+
+        token = self.next('a constant')
+        if field in NUMERIC_FIELDS:
+            if token[0] != 'number':
+                raise self.error('a number', token)
+            if op not in _COMPARISONS:
+                raise self.error('a comparison of numbers', op_token)
+            value = float(token[1])
+            compare = _COMPARISONS[op]
+            return lambda columns: _compare(columns.numeric(field), compare, value)
+
+        if token[0] != 'string':
+            raise self.error('a quoted string', token)
+        value = token[1][1:-1].decode('string_escape')
+        if op in ('~', '!~'):
+            try:
+                regex = re.compile(value)
+            except re.error, e:
+                raise FilterError('bad regular expression at column %d: %s'
+                                  % (token[2] + 1, e))
+            test = lambda s: regex.search(s) is not None
+        elif op in ('==', '='):
+            test = lambda s: s == value
+        elif op == '!=':
+            test = lambda s: s != value
+        else:
+            raise self.error('==, !=, ~ or !~ for strings', op_token)
+        negate = op == '!~'
+
+        def __match(columns):
+            values, indexes = columns.strings(field)
+            matches = [test(s) != negate for s in values]
+            return _take(matches, indexes)
+        return __match
+
+
+class Filter:
+    """A compiled filter expression"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        parser = _Parser(expression)
+        if parser.tokens:
+            self._predicate = parser.parse()
+        else:   # an empty expression selects every function
+            self._predicate = _everything
+        self.fields = parser.fields
+
+    def mask(self, columns):
+        return self._predicate(columns)
+
+    def select(self, columns):
+        # keys of the selected functions
+        mask = self.mask(columns)
+        keys = columns.keys
+        if numpy is not None:
+            return [keys[i] for i in numpy.flatnonzero(mask)]
+        return [key for key, selected in zip(keys, mask) if selected]
+
+    def __call__(self, vstats, summary=None):
+        return self.select(Columns(vstats, summary))
+
+
+def compile_filter(expression):
+    return Filter(expression)
+
+
+def main():
+    usage = "%s [-s column] [-n count] expression stats_file [stats_file ...]"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    parser.add_option('-s', '--sort', dest="sort", choices=NUMERIC_FIELDS,
+                      help="sort the functions by <column>, defaults to cumtime",
+                      default='cumtime')
+    parser.add_option('-n', '--count', dest="count", type="int",
+                      help="show at most <count> functions per file",
+                      default=None)
+
+    options, args = parser.parse_args()
+    if len(args) < 2:
+        parser.print_usage()
+        sys.exit(2)
+
+    try:
+        stats_filter = compile_filter(args[0])
+    except FilterError, e:
+        print >> sys.stderr, 'error: %s' % e
+        sys.exit(2)
+
+    for filename in args[1:]:
+        try:
+            vstats = vProfile.load_vstats(filename)
+        except ValueError:  # not JSON, so pstats
+            vstats = vProfile.pstats2vstats(vProfile.load_pstats(filename))
+        if vProfile.is_memory_vstats(vstats):
+            vstats = vstats[vProfile.MEMORY_KEY]
+        if vProfile.is_thread_vstats(vstats):
+            vstats = vProfile.merge_vstats(vstats[vProfile.THREADS_KEY].values())
+
+        columns = Columns(vstats)
+        keys = stats_filter.select(columns)
+        order = columns.numeric(options.sort)
+        position = dict((key, i) for i, key in enumerate(columns.keys))
+        keys.sort(key=lambda key: -order[position[key]])
+        print '== %s: %d of %d functions' % (filename, len(keys), len(columns))
+        print '%10s %10s %10s %8s  %s' % ('ncall', 'tottime', 'cumtime', 'pct', 'function')
+        for key in keys[:options.count]:
+            entry = vstats[key]
+            print '%10d %10.3f %10.3f %8.2f  %s' % (
+                entry.callcount, entry.inlinetime, entry.totaltime,
+                100.0 * entry.totaltime / columns.summary if columns.summary else 0.0,
+                key)
+
+if __name__ == '__main__':
+    sys.exit(main())
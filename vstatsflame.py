@@ -0,0 +1,190 @@
+#
+#  Module for computing flame graphs (icicle charts) from vstats
+#
+
+"""Flame graphs of vstats
+
+vstats only keep caller/callee edges, not whole stacks, so a call tree is
+approximated: a callee gets the share of its caller's frame given by the
+time the callee spent when called by the caller. A function is not
+expanded again below itself, which keeps recursive calls from looping,
+and frames smaller than a fraction of the root are pruned.
+
+Frames are stored in breadth first order in parallel lists, so the frames
+of a depth are contiguous and the children of a frame are contiguous. The
+horizontal layout is then an exclusive prefix sum over the frame sizes,
+computed one depth at a time, with NumPy if it is available.
+"""
+
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import vProfile
+
+
+__all__ = ["FlameGraph", "ROOT_LABEL"]
+
+ROOT_LABEL = '<all>'
+
+DEFAULT_MIN_FRACTION = 0.001
+DEFAULT_MAX_DEPTH = 128
+
+
+class FlameGraph:
+    def __init__(self, vstats, root=None,
+                 min_fraction=DEFAULT_MIN_FRACTION,
+                 max_depth=DEFAULT_MAX_DEPTH):
+        self.funcs = []     # vstats key of each frame, None for ROOT_LABEL
+        self.parents = []   # index of the parent frame, -1 for the root
+        self.depths = []
+        self.values = []    # size of each frame, in seconds
+        self.max_depth = 0
+        self._build(vstats, root, min_fraction, max_depth)
+
+    def _build(self, vstats, root, min_fraction, max_depth):
+        if root in vstats:
+            tops = [root]
+        else:
+            caller_map = vProfile.vstats2callermap(vstats)
+            tops = [func for func in vstats if func not in caller_map]
+            if not tops and vstats:  # every function is in a cycle
+                tops = [max(vstats, key=lambda func: vstats[func].totaltime)]
+        tops.sort(key=lambda func: vstats[func].totaltime, reverse=True)
+
+        self._add(None, -1, 0, sum(vstats[func].totaltime for func in tops))
+        threshold = self.values[0] * min_fraction
+        for func in tops:
+            if vstats[func].totaltime >= threshold:
+                self._add(func, 0, 1, vstats[func].totaltime)
+
+        frame = 1
+        while frame < len(self.funcs):
+            depth = self.depths[frame]
+            if depth < max_depth:
+                self._expand(vstats, frame, threshold)
+            frame += 1
+        self.max_depth = max(self.depths)
+
+    def _expand(self, vstats, frame, threshold):
+        func, value = self.funcs[frame], self.values[frame]
+        entry = vstats[func]
+        if entry.totaltime <= 0:
+            return
+
+        ancestors = set()
+        parent = frame
+        while parent > 0:
+            ancestors.add(self.funcs[parent])
+            parent = self.parents[parent]
+
+        children = []
+        for callee, subentry in entry.callees.iteritems():
+            if callee in ancestors or callee not in vstats:
+                continue
+            edge_time = vProfile.callee_totaltime(subentry, vstats[callee])
+            children.append((value * edge_time / entry.totaltime, callee))
+
+        # estimates of recursive calls may exceed the frame
+        total = sum(child_value for child_value, _ in children)
+        scale = value / total if total > value else 1.0
+
+        children.sort(reverse=True)
+        depth = self.depths[frame] + 1
+        for child_value, callee in children:
+            child_value *= scale
+            if child_value < threshold:
+                break
+            self._add(callee, frame, depth, child_value)
+
+    def _add(self, func, parent, depth, value):
+        self.funcs.append(func)
+        self.parents.append(parent)
+        self.depths.append(depth)
+        self.values.append(value)
+
+    def __len__(self):
+        return len(self.funcs)
+
+    def label(self, frame, vstats):
+        func = self.funcs[frame]
+        if func is None:
+            return ROOT_LABEL
+        return '%s [%s]' % vProfile.simple_code_format(vstats[func].code)
+
+    def ancestors(self, frame):
+        result = []
+        while frame >= 0:
+            result.append(frame)
+            frame = self.parents[frame]
+        return result
+
+    def layout(self, zoom=0):
+        """Lay out frames for a view zoomed into the frame 'zoom'
+
+        Returns (xs, widths, visible): the left edges and widths of the
+        frames as fractions of the view width, and the indexes of the
+        visible frames, i.e. the frame 'zoom', its descendants, and its
+        ancestors, which span the whole view.
+        """
+        if numpy is not None:
+            xs, widths = self._numpy_layout(zoom)
+        else:
+            xs, widths = self._python_layout(zoom)
+
+        eps = 1e-9
+        depth = self.depths[zoom]
+        visible = [frame for frame in xrange(len(self.funcs))
+                   if self.depths[frame] > depth
+                   and xs[frame] >= -eps and xs[frame] + widths[frame] <= 1 + eps]
+        for frame in self.ancestors(zoom):
+            xs[frame], widths[frame] = 0.0, 1.0
+            visible.append(frame)
+        return xs, widths, visible
+
+    def _depth_ranges(self):
+        # [begin, end) of the frames of each depth
+        ranges, begin = [], 0
+        for frame in xrange(1, len(self.depths) + 1):
+            if frame == len(self.depths) or \
+                    self.depths[frame] != self.depths[begin]:
+                ranges.append((begin, frame))
+                begin = frame
+        return ranges
+
+    def _numpy_layout(self, zoom):
+        values = numpy.array(self.values, dtype=float)
+        parents = numpy.array(self.parents, dtype=int)
+        xs = numpy.zeros(len(values))
+
+        # x of a frame = x of its parent + sizes of its elder siblings
+        exclusive = numpy.cumsum(values) - values
+        first_child = numpy.zeros(len(values), dtype=int)
+        for begin, end in self._depth_ranges()[1:]:
+            level_parents = parents[begin:end]
+            is_first = numpy.ones(end - begin, dtype=bool)
+            is_first[1:] = level_parents[1:] != level_parents[:-1]
+            firsts = numpy.arange(begin, end)[is_first]
+            first_child[level_parents[is_first]] = firsts
+            xs[begin:end] = (xs[level_parents] + exclusive[begin:end]
+                             - exclusive[first_child[level_parents]])
+
+        scale = values[zoom] if values[zoom] > 0 else 1.0
+        return list((xs - xs[zoom]) / scale), list(values / scale)
+
+    def _python_layout(self, zoom):
+        values, parents = self.values, self.parents
+        xs = [0.0] * len(values)
+        offsets = collections.defaultdict(float)
+        for frame in xrange(1, len(values)):
+            parent = parents[frame]
+            xs[frame] = xs[parent] + offsets[parent]
+            offsets[parent] += values[frame]
+
+        scale = values[zoom] if values[zoom] > 0 else 1.0
+        x0 = xs[zoom]
+        return ([(x - x0) / scale for x in xs],
+                [value / scale for value in values])
@@ -0,0 +1,184 @@
+#
+#  Module for rolling vstats up to files, modules and packages
+#
+
+"""Roll-up of vstats by file, module or package
+
+Functions are grouped by the name of their file, their dotted module name,
+or the first 'depth' parts of the module name for packages. Module names
+are taken relative to site-packages or the standard library if a file is
+under one, and relative to the common directory of the other absolute
+filenames otherwise, drives left out; relative filenames are taken as they
+are. Windows and Unix filenames are understood wherever the stats are
+loaded. Built-in functions go to the group '<built-in>'.
+
+A group is a vstats entry of its own:
+
+    inlinetime   : inline time of the members
+    totaltime    : total time of the members, less the time of calls
+                   between members, which is counted in the caller too
+    callcount    : calls into the group from other groups
+    reccallcount : calls between members
+
+and calls between members of different groups become calls between the
+groups. Time that a group spends in itself through other groups is still
+counted twice, as vstats do not keep stacks, so total times are capped by
+the total time of the program. Unknown times of recursive calls are
+estimated by vstatscycles.callee_times.
+"""
+
+import re
+import ntpath
+
+import vProfile
+from vProfile import fake_code, fake_entry2, fake_subentry
+from vstatscycles import callee_times
+
+
+__all__ = ["rollup", "GroupNamer", "GROUP_LEVELS", "BUILTIN_GROUP"]
+
+GROUP_LEVELS = ('file', 'module', 'package')
+
+BUILTIN_GROUP = '<built-in>'
+
+# roots of library modules, e.g. lib/python2.7/ on Unix or \Python27\lib\ on
+# Windows; the last one in a filename wins, e.g. site-packages under lib
+_library_pattern = re.compile(r'[\\/](?:site-packages|dist-packages|'
+                              r'lib[\\/]python\d+(?:\.\d+)?|'
+                              r'python\d+[\\/]lib)(?=[\\/])', re.I)
+
+
+class GroupNamer:
+    """Names the group of a file, for the files of one vstats"""
+
+    def __init__(self, filenames, level='package', depth=1):
+        if level not in GROUP_LEVELS:
+            raise ValueError('unknown group level: %s' % level)
+        self.level = level
+        self.depth = max(depth, 1)
+        local = [_strip_drive(filename) for filename in filenames
+                 if _is_absolute(filename) and not _library_pattern.search(filename)]
+        self.root = _common_dir(local)
+        self._names = {}
+
+    def __call__(self, filename):
+        name = self._names.get(filename)
+        if name is None:
+            name = self._names[filename] = self._name(filename)
+        return name
+
+    def _name(self, filename):
+        if not filename:
+            return BUILTIN_GROUP
+        if self.level == 'file':
+            return filename
+        module = self.module_name(filename)
+        if self.level == 'module':
+            return module
+        return '.'.join(module.split('.')[:self.depth])
+
+    def module_name(self, filename):
+        match = None
+        for match in _library_pattern.finditer(filename):
+            pass
+        if match is not None:
+            path = filename[match.end():]
+        elif not _is_absolute(filename):
+            path = filename
+        elif self.root and _strip_drive(filename).startswith(self.root):
+            path = _strip_drive(filename)[len(self.root):]
+        else:
+            path = ntpath.basename(filename)
+        path = ntpath.splitext(path)[0]
+        parts = [part for part in re.split(r'[\\/]', path) if part]
+        if len(parts) > 1 and parts[-1] == '__init__':
+            parts.pop()
+        return '.'.join(parts) or path
+
+
+# ntpath handles the filenames of stats of both Windows and Unix, wherever
+# they are loaded: 'C:' drives are split, and '/' is a separator too
+
+
+def _strip_drive(filename):
+    return ntpath.splitdrive(filename)[1]
+
+
+def _is_absolute(filename):
+    return _strip_drive(filename)[:1] in ('/', '\\')
+
+
+def _common_dir(paths):
+    # the longest directory prefix of paths, with a trailing separator
+    prefix = ntpath.commonprefix(list(paths)) if paths else ''
+    return prefix[:max(prefix.rfind('/'), prefix.rfind('\\')) + 1]
+
+
+def _group_label(vstats, name, funcs, level):
+    # a label whose location is the file or directory of the group; line 0
+    # makes simple_code_format() show no line number
+    if name == BUILTIN_GROUP:
+        return ('', 0, name)
+    if level == 'file':
+        return (name, 0, name)
+    files = set(vstats[func].code.co_filename for func in funcs)
+    if len(files) == 1:
+        return (files.pop(), 0, name)
+    return (_common_dir(files).rstrip('/\\'), 0, name)
+
+
+def rollup(vstats, level='package', depth=1):
+    """Group the entries of vstats
+
+    Returns (vstats, members), the vstats of the groups keyed by group
+    names, and a map of group names to lists of member keys.
+    """
+    namer = GroupNamer(set(entry.code.co_filename
+                           for entry in vstats.itervalues()), level, depth)
+    group_of, members = {}, {}
+    for func, entry in vstats.iteritems():
+        name = namer(entry.code.co_filename)
+        group_of[func] = name
+        members.setdefault(name, []).append(func)
+
+    result = {}
+    for name, funcs in members.iteritems():
+        result[name] = fake_entry2(fake_code(_group_label(vstats, name, funcs,
+                                                          level)), 0, 0,
+                                   sum(vstats[func].inlinetime for func in funcs),
+                                   sum(vstats[func].totaltime for func in funcs),
+                                   {})
+
+    called = set()
+    for func, entry in vstats.iteritems():
+        group = result[group_of[func]]
+        times = None
+        for callee, subentry in entry.callees.iteritems():
+            if callee not in vstats or callee == func:
+                continue
+            called.add(callee)
+            if times is None:
+                times = callee_times(vstats, func)
+            target = group_of[callee]
+            if target == group_of[func]:
+                group.reccallcount += subentry.callcount
+                group.totaltime -= times[callee]
+                continue
+            result[target].callcount += subentry.callcount
+            if target not in group.callees:
+                group.callees[target] = fake_subentry(0, 0.0)
+            group.callees[target].callcount += subentry.callcount
+            group.callees[target].totaltime += times[callee]
+
+    limit = vProfile.vstats_summary(vstats)
+    for name, entry in result.iteritems():
+        if not entry.callcount:     # a group of roots
+            entry.callcount = sum(vstats[func].callcount
+                                  - vstats[func].reccallcount
+                                  for func in members[name]
+                                  if func not in called)
+        entry.totaltime = min(max(entry.totaltime, entry.inlinetime), limit)
+        for target, subentry in entry.callees.iteritems():
+            subentry.totaltime = min(subentry.totaltime,
+                                     result[target].totaltime)
+    return result, members
@@ -0,0 +1,387 @@
+#! /usr/bin/env python
+#
+#  Tool for merging pstats/vstats files, e.g. hourly profiles of a service
+#  or the per-PID files dumped by the child processes of a program
+#  profiled by 'vProfile.py -c'
+#
+
+"""Merge engine for pstats and vstats
+
+Inputs are converted to 'partial' stats, a compact form of vstats made of
+plain lists and dicts which is cheap to sum up and to pass between
+processes:
+
+    codes   : map: vstats key -> (filename, lineno, funcname) label
+    entries : map: vstats key -> [callcount, reccallcount,
+                                  inlinetime, totaltime,
+                                  {callee key: [callcount, totaltime]}]
+
+A callee totaltime of -1.0 means 'unknown', as in vstats. Partial stats
+of the inputs are summed up by a tree reduction over a process pool, and
+converted to vstats once at the end.
+
+A single big pstats file is converted by convert_pstats() in a process
+pool, in two phases: the functions are split into shards, each giving
+the entries of its functions and the callee maps of their callers,
+inverted from the callers dicts of pstats; entries and callees are then
+joined by the shards owning their keys. Where processes are forked,
+workers read their shards from the stats loaded by the parent instead of
+receiving them.
+"""
+
+import os
+import sys
+import json
+import zlib
+import threading
+import marshal
+from optparse import OptionParser
+
+import vProfile
+
+
+__all__ = ["merge_files", "load_partial", "merge_partials", "partial2vstats",
+           "build_vstats", "convert_pstats"]
+
+# pstats with fewer functions are converted by one process, as starting
+# a pool costs more than it saves
+PARALLEL_MIN_FUNCS = 50000
+# building the vstats objects in the parent takes about 2/3 of a serial
+# conversion, so fewer processes do not win it back
+PARALLEL_MIN_PROCESSES = 8
+SHARDS_PER_PROCESS = 4
+
+#__________________________________________________________________________
+# Partial stats
+
+
+def load_partial(filename, labels=None):
+    # load a pstats or vstats file as partial stats
+    #   labels: map: pstats label -> vstats key, shared across inputs
+    #       to convert every label only once
+    if labels is None:
+        labels = {}
+    try:
+        stats = vProfile.load_pstats(filename)
+    except (ValueError, EOFError, TypeError):
+        stats = None
+    if isinstance(stats, dict):
+        return _pstats2partial(stats, labels)
+
+    # decode vstats as plain dicts, skipping the fake objects of vProfile
+    fp = open(filename, 'r')
+    try:
+        vstats = json.load(fp)
+    finally:
+        fp.close()
+    if vProfile.is_thread_vstats(vstats):
+        partial = ({}, {})
+        for thread_vstats in vstats[vProfile.THREADS_KEY].itervalues():
+            merge_partials(partial, _vstats2partial(thread_vstats))
+        return partial
+    return _vstats2partial(vstats)
+
+
+def _pstats2partial(stats, labels):
+    codes, entries = {}, {}
+    for func, (cc, nc, tt, ct, callers) in stats.iteritems():
+        name = _label2key(func, labels)
+        codes[name] = func
+        entries[name] = [nc, nc - cc, tt, ct, {}]
+
+    for func, (cc, nc, tt, ct, callers) in stats.iteritems():
+        name = labels[func]
+        for caller, xstats in callers.iteritems():
+            caller_name = _label2key(caller, labels)
+            if caller_name not in entries:
+                continue
+            callcount, totaltime = xstats, -1.0
+            if isinstance(xstats, tuple):  # for cProfile results
+                callcount = xstats[0]
+                totaltime = xstats[3]
+            entries[caller_name][4][name] = [callcount, totaltime]
+    return codes, entries
+
+
+def _label2key(label, labels):
+    name = labels.get(label)
+    if name is None:
+        # fake_code maps the '~' filename of cProfile built-ins to '', so
+        # built-ins from 'profile' and 'cProfile' results share a key
+        name = intern(str(vProfile.fake_code(label)))
+        labels[label] = name
+    return name
+
+
+def _vstats2partial(vstats):
+    codes, entries = {}, {}
+    for func, entry in vstats.iteritems():
+        code = entry['code']
+        name = intern(str(func))
+        codes[name] = (code['co_filename'], code['co_firstlineno'],
+                       code['co_name'])
+        callees = {}
+        for callee, subentry in entry['callees'].iteritems():
+            callees[intern(str(callee))] = [subentry['callcount'],
+                                            subentry['totaltime']]
+        entries[name] = [entry['callcount'], entry['reccallcount'],
+                         entry['inlinetime'], entry['totaltime'], callees]
+    return codes, entries
+
+
+def merge_partials(dst, src):
+    # sum up partial stats 'src' into 'dst', returns 'dst'
+    dst_codes, dst_entries = dst
+    src_codes, src_entries = src
+    for name, src_entry in src_entries.iteritems():
+        dst_entry = dst_entries.get(name)
+        if dst_entry is None:
+            dst_codes[name] = src_codes[name]
+            dst_entries[name] = src_entry
+            continue
+        dst_entry[0] += src_entry[0]
+        dst_entry[1] += src_entry[1]
+        dst_entry[2] += src_entry[2]
+        dst_entry[3] += src_entry[3]
+
+        dst_callees = dst_entry[4]
+        for callee, src_edge in src_entry[4].iteritems():
+            dst_edge = dst_callees.get(callee)
+            if dst_edge is None:
+                dst_callees[callee] = src_edge
+                continue
+            dst_edge[0] += src_edge[0]
+            if dst_edge[1] < 0 or src_edge[1] < 0:
+                dst_edge[1] = -1.0  # unknown in any input
+            else:
+                dst_edge[1] += src_edge[1]
+    return dst
+
+
+@vProfile.without_gc
+def partial2vstats(partial):
+    codes, entries = partial
+    vstats = {}
+    for name, (nc, rc, tt, ct, callees) in entries.iteritems():
+        subentries = {}
+        for callee, (callcount, totaltime) in callees.iteritems():
+            if callee in entries:
+                subentries[callee] = vProfile.fake_subentry(callcount,
+                                                            totaltime)
+        entry = vProfile.fake_entry2(vProfile.fake_code(codes[name]),
+                                     nc, rc, tt, ct, subentries)
+        vProfile._check_recursive_callees(entry)
+        vstats[name] = entry
+    return vstats
+
+#__________________________________________________________________________
+# Tree reduction
+
+
+def _reduce_files(filenames):
+    # load and sum up files one at a time, so only one input and the sum
+    # are held in memory
+    labels, partial = {}, ({}, {})
+    for filename in filenames:
+        merge_partials(partial, load_partial(filename, labels))
+    return partial
+
+
+def _reduce_pair(pair):
+    if len(pair) == 1:
+        return pair[0]
+    return merge_partials(pair[0], pair[1])
+
+
+def merge_files(filenames, processes=1):
+    """Sum up entries and callees of the given pstats/vstats files
+
+    The files are split among 'processes' worker processes, each of which
+    sums up its share of the files, and the partial sums are then merged
+    pairwise by the pool until one is left.
+    """
+    filenames = list(filenames)
+    if len(filenames) == 1 and (processes or 1) > 1:
+        try:
+            stats = vProfile.load_pstats(filenames[0])
+        except (ValueError, EOFError, TypeError):
+            stats = None
+        if isinstance(stats, dict):
+            return convert_pstats(stats, processes)
+
+    processes = max(1, min(processes or 1, len(filenames)))
+    if processes == 1:
+        return partial2vstats(_reduce_files(filenames))
+
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        shares = [filenames[i::processes] for i in xrange(processes)]
+        partials = pool.map(_reduce_files, shares)
+        while len(partials) > 1:
+            pairs = [partials[i:i + 2] for i in xrange(0, len(partials), 2)]
+            partials = pool.map(_reduce_pair, pairs)
+    finally:
+        pool.close()
+        pool.join()
+    return partial2vstats(partials[0])
+
+
+#__________________________________________________________________________
+# Sharded conversion of pstats
+
+
+# items of the stats being converted, inherited by forked workers; the
+# lock keeps conversions in several threads from sharing them
+_shard_items = None
+_shard_lock = threading.Lock()
+
+
+def _owner(name, count):
+    # the shard owning the entry of a vstats key
+    return zlib.crc32(name) % count
+
+
+@vProfile.without_gc
+def _split_shard(shard):
+    # phase 1: convert the items of a shard, and split the entries and the
+    # inverted callee maps by the shards owning them
+    #   shard: (index, count) into _shard_items, or (items, count)
+    #   returns: [marshalled (codes, entries, edges)] indexed by owner
+    items, count = shard
+    if isinstance(items, int):
+        items = _shard_items[items::count]
+    labels = {}
+    parts = [({}, {}, []) for _ in xrange(count)]
+    for func, (cc, nc, tt, ct, callers) in items:
+        name = _label2key(func, labels)
+        codes, entries, _ = parts[_owner(name, count)]
+        codes[name] = func
+        entries[name] = [nc, nc - cc, tt, ct, {}]
+        for caller, xstats in callers.iteritems():
+            callcount, totaltime = xstats, -1.0
+            if isinstance(xstats, tuple):  # for cProfile results
+                callcount = xstats[0]
+                totaltime = xstats[3]
+            caller_name = _label2key(caller, labels)
+            parts[_owner(caller_name, count)][2].append(
+                (caller_name, name, callcount, totaltime))
+    return [marshal.dumps(part) for part in parts]
+
+
+@vProfile.without_gc
+def _join_shard(parts):
+    # phase 2: join the parts owned by a shard into partial stats, with the
+    # times of recursive callees marked unknown
+    codes, entries, edges = {}, {}, []
+    for part in parts:
+        part_codes, part_entries, part_edges = marshal.loads(part)
+        codes.update(part_codes)
+        entries.update(part_entries)
+        edges.extend(part_edges)
+    for caller, callee, callcount, totaltime in edges:
+        entry = entries.get(caller)
+        if entry is not None:
+            entry[4][callee] = [callcount, totaltime]
+    for entry in entries.itervalues():
+        _check_recursive_edges(entry)
+    return marshal.dumps((codes, entries))
+
+
+def _check_recursive_edges(entry):
+    # vProfile._check_recursive_callees for partial entries
+    callees = entry[4].values()
+    t_sum = 0.0
+    for edge in callees:
+        if edge[1] < 0:
+            t_sum = -1.0
+            break
+        t_sum += edge[1]
+    if t_sum < 0 or vProfile._test_greater(t_sum, entry[3] - entry[2]):
+        for edge in callees:
+            edge[1] = -1.0
+
+
+@vProfile.without_gc
+def convert_pstats(stats, processes=None):
+    """Convert pstats to vstats with a pool of 'processes' processes,
+    the number of CPUs by default
+
+    Phase 1 converts shards of the functions, phase 2 joins the entries
+    and inverted callee maps by the shards owning their keys. Parts pass
+    between phases marshalled, which is cheap to load and interns keys
+    once per part. Only building the vstats objects is left to the
+    parent, which bounds the speedup.
+    """
+    import multiprocessing
+    processes = processes or multiprocessing.cpu_count()
+    if processes < PARALLEL_MIN_PROCESSES or len(stats) < PARALLEL_MIN_FUNCS:
+        return vProfile.pstats2vstats(stats)
+
+    with _shard_lock:
+        return _convert_shards(stats, processes)
+
+
+def _convert_shards(stats, processes):
+    import multiprocessing
+    global _shard_items
+    count = processes * SHARDS_PER_PROCESS
+    items = stats.items()
+    if hasattr(os, 'fork'):
+        _shard_items = items
+        shards = [(i, count) for i in xrange(count)]
+    else:
+        shards = [(items[i::count], count) for i in xrange(count)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        split = pool.map(_split_shard, shards)
+        del shards
+        owned = [[parts[i] for parts in split] for i in xrange(count)]
+        del split
+        joined = pool.imap_unordered(_join_shard, owned)
+        return build_vstats(marshal.loads(part) for part in joined)
+    finally:
+        pool.close()
+        pool.join()
+        _shard_items = None
+
+
+def build_vstats(partials):
+    # vstats of partial stats with disjoint keys, restored as they are:
+    # unlike partial2vstats, callees are not checked
+    vstats = {}
+    fake_code, fake_entry2, fake_subentry = \
+        vProfile.fake_code, vProfile.fake_entry2, vProfile.fake_subentry
+    for codes, entries in partials:
+        for name, (nc, rc, tt, ct, callees) in entries.iteritems():
+            subentries = {}
+            for callee, (callcount, totaltime) in callees.iteritems():
+                subentries[callee] = fake_subentry(callcount, totaltime)
+            vstats[name] = fake_entry2(fake_code(codes[name]),
+                                       nc, rc, tt, ct, subentries)
+    return vstats
+
+
+def main():
+    usage = "%s [-j jobs] -o output_file_path stats_file [stats_file ...]"
+    parser = OptionParser(usage=usage % os.path.basename(sys.argv[0]))
+    parser.add_option('-o', '--outfile', dest="outfile",
+                      help="save merged stats to <outfile>", default=None)
+    parser.add_option('-j', '--jobs', dest="jobs", type="int",
+                      help="number of worker processes, defaults to the "
+                           "number of CPUs", default=None)
+
+    options, args = parser.parse_args()
+    if not options.outfile or not args:
+        parser.print_usage()
+        sys.exit(2)
+
+    jobs = options.jobs
+    if jobs is None:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+    vProfile.dump_vstats(merge_files(args, jobs), options.outfile)
+
+if __name__ == '__main__':
+    sys.exit(main())
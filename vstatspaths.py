@@ -0,0 +1,109 @@
+#
+#  Module for extracting the hottest call paths of vstats
+#
+
+"""Top-K hot paths of vstats
+
+A path starts at a root, a function nobody calls (or a given function),
+and ends where it spends time inline. Its time is estimated the way
+vstatsflame estimates frames: a callee gets the share of its caller's
+time given by the time the callee spent when called by the caller (see
+vstatscycles.callee_times), and the path ends with the inline share of
+its last function.
+
+Times never grow along a path, so a best-first search that always
+extends the heaviest partial path, kept in a heap, finds the heaviest
+complete paths first and stops after k of them. A function already on a
+path is not visited again, which keeps recursion from looping. Paths are
+linked lists of (func, parent) pairs, so extending one is O(1).
+"""
+
+import heapq
+
+from vstatscycles import callee_times
+
+
+__all__ = ["hot_paths"]
+
+DEFAULT_MAX_EXPANSIONS = 1000000
+
+
+def hot_paths(vstats, k=10, root=None, min_fraction=0.0,
+              max_expansions=DEFAULT_MAX_EXPANSIONS):
+    """Return the k heaviest paths as (time, [func, ...]), root first
+
+    Partial paths lighter than min_fraction of the roots' time are not
+    extended, and the search gives up after max_expansions extensions.
+    """
+    if root in vstats:
+        roots = [root]
+    else:
+        called = set()
+        for entry in vstats.itervalues():
+            called.update(entry.callees)
+        roots = [func for func in vstats if func not in called]
+        if not roots and vstats:    # every function is in a cycle
+            roots = [max(vstats, key=lambda func: vstats[func].totaltime)]
+
+    # heap items: (-time, serial, is_complete, path); the serial keeps
+    # paths of equal time from being compared
+    heap = []
+    serial = 0
+    for func in roots:
+        heap.append((-vstats[func].totaltime, serial, False, (func, None)))
+        serial += 1
+    heapq.heapify(heap)
+    threshold = min_fraction * sum(vstats[func].totaltime for func in roots)
+
+    times_cache = {}
+    result = []
+    expansions = 0
+    while heap and len(result) < k and expansions < max_expansions:
+        time, _, complete, path = heapq.heappop(heap)
+        time = -time
+        if complete:
+            result.append((time, _path2list(path)))
+            continue
+
+        expansions += 1
+        func = path[0]
+        entry = vstats[func]
+        if entry.totaltime <= 0:
+            heapq.heappush(heap, (-time, serial, True, path))
+            serial += 1
+            continue
+
+        scale = time / entry.totaltime
+        times = times_cache.get(func)
+        if times is None:
+            times = times_cache[func] = callee_times(vstats, func)
+        on_path = None
+        extended = False
+        for callee, callee_time in times.iteritems():
+            callee_time = min(callee_time * scale, time)
+            if callee_time <= threshold or callee_time <= 0:
+                continue
+            if on_path is None:
+                on_path = set(_path2list(path))
+            if callee in on_path:
+                continue
+            heapq.heappush(heap, (-callee_time, serial, False,
+                                  (callee, path)))
+            serial += 1
+            extended = True
+
+        # the path may end here, with the inline time of func
+        inline = min(entry.inlinetime * scale, time)
+        if inline > threshold or not extended:
+            heapq.heappush(heap, (-inline, serial, True, path))
+            serial += 1
+    return result
+
+
+def _path2list(path):
+    funcs = []
+    while path is not None:
+        funcs.append(path[0])
+        path = path[1]
+    funcs.reverse()
+    return funcs
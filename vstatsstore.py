@@ -0,0 +1,285 @@
+#! /usr/bin/env python
+#
+#  Tool for keeping a time series of profiles, e.g. the hourly pstats files
+#  of a service, and querying trends and regressions across them
+#
+
+"""Profile store on SQLite
+
+A store is one SQLite file, by default STORE_FILENAME in the directory of
+the profiles it keeps. Each ingested pstats or vstats file becomes a
+snapshot taken at the modification time of the file, and the entries of
+its functions become samples of the snapshot:
+
+    labels    : id, vstats key, filename, lineno, name
+    snapshots : id, taken, source, mtime, size, summary
+    samples   : snapshot, label, ncall, reccall, tottime, cumtime
+
+Labels are shared by all snapshots, so a function is stored once however
+many snapshots it is in. A file already ingested, with the same path,
+modification time and size, is skipped, so a directory can be ingested
+again and again as files are added to it. Samples are indexed by label
+and snapshot, and snapshots by time, so the trend of a function and the
+difference between two snapshots are read without scanning the store.
+Callees are not stored.
+"""
+
+import os
+import sys
+import time
+import sqlite3
+from optparse import OptionParser
+
+import vstatsmerge
+
+
+__all__ = ["ProfileStore", "STORE_FILENAME", "METRICS"]
+
+STORE_FILENAME = 'vstats.db'
+
+METRICS = ('ncall', 'reccall', 'tottime', 'cumtime')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    filename TEXT,
+    lineno INTEGER,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken REAL NOT NULL,
+    source TEXT,
+    mtime REAL,
+    size INTEGER,
+    summary REAL
+);
+CREATE INDEX IF NOT EXISTS snapshots_taken ON snapshots (taken);
+CREATE UNIQUE INDEX IF NOT EXISTS snapshots_source
+    ON snapshots (source, mtime, size);
+CREATE TABLE IF NOT EXISTS samples (
+    snapshot INTEGER NOT NULL,
+    label INTEGER NOT NULL,
+    ncall INTEGER,
+    reccall INTEGER,
+    tottime REAL,
+    cumtime REAL,
+    PRIMARY KEY (snapshot, label)
+);
+CREATE INDEX IF NOT EXISTS samples_label ON samples (label, snapshot);
+"""
+
+
+def _check_metric(metric):
+    # metrics are column names, so they are never taken from queries as is
+    if metric not in METRICS:
+        raise ValueError('unknown metric: %s' % metric)
+    return metric
+
+
+class ProfileStore:
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.text_factory = str
+        self.conn.executescript(_SCHEMA)
+        self._label_ids = None  # map: vstats key -> label id, loaded lazily
+
+    def close(self):
+        self.conn.close()
+
+    def _labels(self):
+        if self._label_ids is None:
+            self._label_ids = dict(self.conn.execute(
+                'SELECT key, id FROM labels'))
+        return self._label_ids
+
+    def _label_id(self, key):
+        label_id = self._labels().get(key)
+        if label_id is None:
+            row = self.conn.execute('SELECT id FROM labels WHERE key = ?',
+                                    (key,)).fetchone()
+            if row is not None:     # added by another connection
+                label_id = self._label_ids[key] = row[0]
+        return label_id
+
+    def ingest(self, filename, taken=None):
+        """Add a pstats or vstats file as a snapshot taken at 'taken'
+
+        taken defaults to the modification time of the file. Returns the
+        id of the snapshot, or None if the file is already in the store.
+        """
+        source = os.path.abspath(filename)
+        st = os.stat(filename)
+        row = self.conn.execute(
+            'SELECT id FROM snapshots WHERE source = ? AND mtime = ? AND size = ?',
+            (source, st.st_mtime, st.st_size)).fetchone()
+        if row is not None:
+            return None
+
+        try:
+            partial = vstatsmerge.load_partial(filename)
+        except KeyError:    # memory stats, see vMemoryProfile
+            raise ValueError('not stats of time: %s' % filename)
+        if taken is None:
+            taken = st.st_mtime
+        return self.add_snapshot(partial, taken, source, st.st_mtime, st.st_size)
+
+    def add_snapshot(self, partial, taken, source=None, mtime=None, size=None):
+        """Add partial stats (see vstatsmerge) as a snapshot, returns its id"""
+        codes, entries = partial
+        summary = max([entry[3] for entry in entries.itervalues()] or [0.0])
+        labels = self._labels()
+        try:
+            new = [(key,) + tuple(codes[key]) for key in entries
+                   if key not in labels]
+            self.conn.executemany('INSERT OR IGNORE INTO labels '
+                                  '(key, filename, lineno, name) VALUES (?, ?, ?, ?)',
+                                  new)
+            for key, _, _, _ in new:
+                self._label_id(key)
+
+            cursor = self.conn.execute('INSERT INTO snapshots '
+                                       '(taken, source, mtime, size, summary) '
+                                       'VALUES (?, ?, ?, ?, ?)',
+                                       (taken, source, mtime, size, summary))
+            snapshot = cursor.lastrowid
+            self.conn.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?)',
+                                  ((snapshot, labels[key], nc, rc, tt, ct)
+                                   for key, (nc, rc, tt, ct, _)
+                                   in entries.iteritems()))
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            self._label_ids = None
+            raise
+        return snapshot
+
+    def snapshots(self, since=None, until=None):
+        # [(id, taken, source, summary)] ordered by time
+        return self.conn.execute(
+            'SELECT id, taken, source, summary FROM snapshots '
+            'WHERE taken >= ? AND taken <= ? ORDER BY taken, id',
+            (since or 0.0, until or sys.float_info.max)).fetchall()
+
+    def find_labels(self, pattern):
+        # vstats keys containing 'pattern'
+        pattern = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return [key for key, in self.conn.execute(
+            "SELECT key FROM labels WHERE key LIKE ? ESCAPE '\\' ORDER BY key",
+            ('%' + pattern + '%',))]
+
+    def trend(self, key, metric='tottime', since=None, until=None):
+        """Return [(taken, value)] of a function over the snapshots
+
+        Snapshots without the function are left out.
+        """
+        label_id = self._label_id(key)
+        if label_id is None:
+            return []
+        return self.conn.execute(
+            'SELECT snapshots.taken, samples.%s FROM samples '
+            'JOIN snapshots ON snapshots.id = samples.snapshot '
+            'WHERE samples.label = ? AND snapshots.taken >= ? AND snapshots.taken <= ? '
+            'ORDER BY snapshots.taken, snapshots.id' % _check_metric(metric),
+            (label_id, since or 0.0, until or sys.float_info.max)).fetchall()
+
+    def regressions(self, before, after, metric='tottime', limit=20):
+        """Return [(key, value before, value after)] of the functions whose
+        metric grew the most from snapshot 'before' to snapshot 'after'
+
+        Functions missing from 'before' count from 0.
+        """
+        metric = _check_metric(metric)
+        return self.conn.execute(
+            'SELECT labels.key, COALESCE(a.%(m)s, 0), b.%(m)s FROM samples AS b '
+            'JOIN labels ON labels.id = b.label '
+            'LEFT JOIN samples AS a ON a.snapshot = ? AND a.label = b.label '
+            'WHERE b.snapshot = ? AND b.%(m)s > COALESCE(a.%(m)s, 0) '
+            'ORDER BY b.%(m)s - COALESCE(a.%(m)s, 0) DESC LIMIT ?' % {'m': metric},
+            (before, after, limit)).fetchall()
+
+
+def _format_time(taken):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(taken))
+
+
+def main():
+    usage = "%s [-d store_file] ingest stats_file [stats_file ...]\n" \
+            "       %s [-d store_file] list\n" \
+            "       %s [-d store_file] [-m metric] [--days n] trend func\n" \
+            "       %s [-d store_file] [-m metric] [-n count] regressions id_a id_b"
+    prog = os.path.basename(sys.argv[0])
+    parser = OptionParser(usage=usage % ((prog,) * 4))
+    parser.add_option('-d', '--db', dest="db",
+                      help="the store, defaults to %s in the directory of the "
+                           "first stats file to ingest, or in the current "
+                           "directory" % STORE_FILENAME, default=None)
+    parser.add_option('-m', '--metric', dest="metric", choices=METRICS,
+                      help="one of %s, defaults to tottime" % ', '.join(METRICS),
+                      default='tottime')
+    parser.add_option('--days', dest="days", type="float",
+                      help="only the snapshots of the last <days> days",
+                      default=None)
+    parser.add_option('-n', '--count', dest="count", type="int",
+                      help="number of regressions to show, defaults to 20",
+                      default=20)
+
+    options, args = parser.parse_args()
+    if not args or args[0] not in ('ingest', 'list', 'trend', 'regressions'):
+        parser.print_usage()
+        sys.exit(2)
+    command, args = args[0], args[1:]
+
+    db = options.db
+    if db is None:
+        directory = os.path.dirname(args[0]) if command == 'ingest' and args else ''
+        db = os.path.join(directory, STORE_FILENAME)
+    since = None
+    if options.days is not None:
+        since = time.time() - options.days * 24 * 3600
+
+    store = ProfileStore(db)
+    try:
+        if command == 'ingest':
+            for filename in args:
+                snapshot = store.ingest(filename)
+                if snapshot is None:
+                    print 'skipped %s' % filename
+                else:
+                    print '%d %s' % (snapshot, filename)
+
+        elif command == 'list':
+            for snapshot, taken, source, summary in store.snapshots(since):
+                print '%6d  %s  %10.3f  %s' % (snapshot, _format_time(taken),
+                                               summary, source)
+
+        elif command == 'trend':
+            if len(args) != 1:
+                parser.print_usage()
+                sys.exit(2)
+            keys = [args[0]] if store._label_id(args[0]) else store.find_labels(args[0])
+            if len(keys) != 1:
+                print >> sys.stderr, '%d functions match %s' % (len(keys), args[0])
+                for key in keys:
+                    print >> sys.stderr, '  %s' % key
+                sys.exit(1)
+            print keys[0]
+            for taken, value in store.trend(keys[0], options.metric, since):
+                print '%s  %12.6g' % (_format_time(taken), value)
+
+        else:
+            if len(args) != 2:
+                parser.print_usage()
+                sys.exit(2)
+            before, after = int(args[0]), int(args[1])
+            print '%12s %12s %12s  %s' % ('before', 'after', '+/-', 'function')
+            for key, a, b in store.regressions(before, after, options.metric,
+                                               options.count):
+                print '%12.6g %12.6g %12.6g  %s' % (a, b, b - a, key)
+    finally:
+        store.close()
+
+if __name__ == '__main__':
+    sys.exit(main())